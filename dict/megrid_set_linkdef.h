@@ -0,0 +1,12 @@
+
+#include "megrid_set.hh"
+
+#ifdef __CINT__
+#pragma link off all globals;
+#pragma link off all classes;
+#pragma link off all functions;
+#pragma link C++ nestedclasses;
+
+#pragma link C++ class megrid_set;
+
+#endif
@@ -3,6 +3,17 @@
 
 #include "types.hh"
 
+#include <vector>
+#include <utility>
+#include <time.h>
+
+#ifdef __SSE__
+#include <xmmintrin.h>
+#endif
+#ifdef __F16C__
+#include <immintrin.h>
+#endif
+
 // #include <boost/function.hpp>
 
 // @FIXME set these as configurable parameters
@@ -21,7 +32,22 @@ namespace agf
     static real_t  MINFILTERW;
     static real_t  MAXFILTERW;
     static integer_t KMIN;
+    static integer_t _SOLVER_MAXITER;
   };
+  
+  //
+  // method used to solve for the filter width s.t. the total weight equals W_{c}
+  //
+  // SUPERNEWTON : bracket the root by halving (doubling) the initial bounds, 
+  //               then iterate with the supernewton method of libAGF
+  // BRACKETED   : bracket the root analytically from the neighbour distances & 
+  //               weights, then iterate with safeguarded Newton steps (at most 
+  //               _SOLVER_MAXITER), evaluating the exponentials 4 at a time 
+  //
+  // (mirrored by megrid::solver_type, keep the two in sync)
+  //
+  enum solver_type { SUPERNEWTON = 0,
+		     BRACKETED   = 1 };
 
   struct diagnostics
   {
@@ -29,6 +55,56 @@ namespace agf
     real_t f;		// ratio of min. weight to max.
     real_t W;		// total weight
     real_t V;           // final filter variance
+    real_t dp;		// estimated relative error due to the precision of the grid coordinates
+    integer_t nb;	// number of times the bracket on the filter width was moved
+    double t_scan;	// time (in seconds) spent computing the distances to the grid points
+    double t_select;	// time (in seconds) spent selecting the k nearest neighbours
+  };
+
+  //
+  // monotonic wall-clock time in seconds, used to time the phases of a PDF calculation
+  //
+  inline double wall_time( )
+  {
+    timespec ts;
+    clock_gettime( CLOCK_MONOTONIC, &ts );
+    return ts.tv_sec + 1.0e-9 * ts.tv_nsec;
+  }
+
+  //
+  // scratch buffers for PDF calculations, s.t. repeated queries do not allocate 
+  // memory once the buffers have grown to size; use one workspace per thread
+  //
+  class workspace
+  {
+  public:
+    workspace( ) { }
+    
+    //
+    // grow the buffers for a grid of npts points in ndim dimensions 
+    // (transformed from ndim_in dimensions) and k nearest neighbours
+    //
+    void reserve( integer_t npts, integer_t k, integer_t ndim, integer_t ndim_in )
+    {
+      if( (integer_t)dsqr.size() < npts ) dsqr.resize( npts );
+      if( (integer_t)knearest.size() < k ) knearest.resize( k );
+      if( (integer_t)clwtnearest.size() < k ) clwtnearest.resize( k );
+      if( (integer_t)weight.size() < k ) weight.resize( k );
+      if( (integer_t)point.size() < ndim ) point.resize( ndim );
+      if( (integer_t)offsets.size() < ndim ) offsets.resize( ndim );
+      if( (integer_t)buffer.size() < 2 * ndim_in ) buffer.resize( 2 * ndim_in );
+    }
+    
+    std::vector< std::pair<real_t, real_t> > dsqr; // distances squared & weights of grid points
+    std::vector<real_t> knearest;	// distances squared of the k nearest neighbours
+    std::vector<real_t> clwtnearest;	// weights of the k nearest neighbours
+    std::vector<real_t> weight;		// filter weights of the k nearest neighbours
+    std::vector<real_t> point;		// test point in the transformed grid
+    std::vector<real_t> buffer;		// intermediate test points during the transformation
+    std::vector<double> offsets;	// per-axis offsets used in spatial index searches
+    std::vector<long long> key;		// quantised test point used to look up cached PDF values
+    
+    diagnostics diag;			// diagnostics of the last PDF calculation
   };
 
   // namespace metrics // @TODO allow metric plugins ... just force Euclidean for now 
@@ -46,18 +122,99 @@ namespace agf
   // 		       integer_t ndim );
   // }
 
+  //
+  // squared Euclidean distance between two points
+  //
   template <typename FLOAT_T>
-  FLOAT_T metric( FLOAT_T* x,
-		  FLOAT_T* y, 
-		  integer_t ndim )
+  inline FLOAT_T metric( const FLOAT_T* x,
+			 const FLOAT_T* y, 
+			 integer_t ndim )
   {
     FLOAT_T d=0;
     for( integer_t idim=0; idim<ndim; ++idim )
     {
-      d += std::pow( x[idim] - y[idim], 2 );
+      FLOAT_T u = x[idim] - y[idim];
+      d += u * u;
+    }
+    return d;
+  }
+  
+#ifdef __SSE__
+  //
+  // single precision version, four coordinates at a time (the grid rows are 
+  // contiguous, so the scan over the grid streams through memory)
+  //
+  template <>
+  inline float metric<float>( const float* x,
+			      const float* y, 
+			      integer_t ndim )
+  {
+    __m128 acc = _mm_setzero_ps();
+    integer_t idim=0;
+    for( ; idim+4<=ndim; idim+=4 )
+    {
+      __m128 u = _mm_sub_ps( _mm_loadu_ps(x + idim), _mm_loadu_ps(y + idim) );
+      acc = _mm_add_ps( acc, _mm_mul_ps(u, u) );
+    }
+    float sum[4];
+    _mm_storeu_ps( sum, acc );
+    float d = (sum[0] + sum[1]) + (sum[2] + sum[3]);
+    for( ; idim<ndim; ++idim )
+    {
+      float u = x[idim] - y[idim];
+      d += u * u;
     }
     return d;
   }
+#endif
+  
+  //
+  // squared Euclidean distance to a point stored in half precision, which is
+  // widened to single precision on the fly
+  //
+  template <typename FLOAT_T>
+  inline FLOAT_T metric( const FLOAT_T* x,
+			 const half* y, 
+			 integer_t ndim )
+  {
+    FLOAT_T d=0;
+    for( integer_t idim=0; idim<ndim; ++idim )
+    {
+      FLOAT_T u = x[idim] - (float)y[idim];
+      d += u * u;
+    }
+    return d;
+  }
+  
+#if defined(__SSE__) && defined(__F16C__)
+  //
+  // single precision version, using the hardware conversion of four half 
+  // precision values at a time (the widening is exact, as in half::operator float)
+  //
+  template <>
+  inline float metric<float>( const float* x,
+			      const half* y, 
+			      integer_t ndim )
+  {
+    __m128 acc = _mm_setzero_ps();
+    integer_t idim=0;
+    for( ; idim+4<=ndim; idim+=4 )
+    {
+      __m128 yp = _mm_cvtph_ps( _mm_loadl_epi64( reinterpret_cast<const __m128i*>(y + idim) ) );
+      __m128 u = _mm_sub_ps( _mm_loadu_ps(x + idim), yp );
+      acc = _mm_add_ps( acc, _mm_mul_ps(u, u) );
+    }
+    float sum[4];
+    _mm_storeu_ps( sum, acc );
+    float d = (sum[0] + sum[1]) + (sum[2] + sum[3]);
+    for( ; idim<ndim; ++idim )
+    {
+      float u = x[idim] - (float)y[idim];
+      d += u * u;
+    }
+    return d;
+  }
+#endif
   
 
   template <typename FLOAT_T>
@@ -74,7 +231,48 @@ namespace agf
 		       FLOAT_T varhi,  
 		       FLOAT_T* weight,  // returned weights
 		       FLOAT_T& var_f,   // returned final filter variance
-		       FLOAT_T* clwts ); // point weights    
+		       FLOAT_T* clwts,   // point weights    
+		       integer_t* nmov=NULL ); // returned number of times the bracket was moved
+
+  //
+  // as above, with the BRACKETED solver (so no initial bounds are needed)
+  //
+  template <typename FLOAT_T>
+  integer_t optimize_bracketed( FLOAT_T* dsqr,    // distances squared (ascending)
+				integer_t npts,   // number of distances
+				FLOAT_T Wc,       // objective total weight
+				FLOAT_T* weight,  // returned weights
+				FLOAT_T& var_f,   // returned final filter variance
+				FLOAT_T* clwts ); // point weights    
+
+  template <typename FLOAT_T>
+  void nearest( FLOAT_T** grid,		// array of grid points
+		FLOAT_T* clwts,		// weights for each point
+		integer_t ndim,		// number of dimensions in the grid
+		integer_t npts,		// number of grid points
+		FLOAT_T* vec,		// test point
+		integer_t k,		// number of nearest neighbours
+		FLOAT_T* knearest,	// returned distances squared (ascending)
+		FLOAT_T* clwtnearest,	// returned point weights
+		integer_t nthreads=1,	// number of threads for the scan
+		std::pair<FLOAT_T, FLOAT_T>* buffer=NULL,	// scratch space for npts distances (allocated if NULL)
+		diagnostics* diag=NULL );	// if not NULL, the time spent in the scan & selection is filled
+  
+  //
+  // as above, for a grid stored row-by-row in one block of half precision values
+  //
+  template <typename FLOAT_T>
+  void nearest( const half* grid,
+		FLOAT_T* clwts,
+		integer_t ndim,
+		integer_t npts,
+		FLOAT_T* vec,
+		integer_t k,
+		FLOAT_T* knearest,
+		FLOAT_T* clwtnearest,
+		integer_t nthreads=1,
+		std::pair<FLOAT_T, FLOAT_T>* buffer=NULL,
+		diagnostics* diag=NULL );
   
   namespace pdf
   {
@@ -124,7 +322,25 @@ namespace agf
 		      FLOAT_T varhi,    // upper filter width
 		      integer_t k,      // number of grid points to use to determine filter width
 		      FLOAT_T Wc,       // weighted sum (equivalent to k in kNN)
-		      diagnostics* diag_param ); 
+		      diagnostics* diag_param,
+		      integer_t nthreads=1 ); // number of threads for the nearest neighbour search
+
+    //
+    // as above, but starting from the (sorted) k nearest neighbours of the 
+    // test point, eg., as returned by agf::nearest or a spatial index
+    //
+    template <typename FLOAT_T>
+    FLOAT_T adaptive( FLOAT_T* knearest,	// distances squared of k nearest neighbours
+		      FLOAT_T* clwtnearest,	// weights of k nearest neighbours
+		      integer_t ndim,   // number of dimensions in the grid
+		      integer_t n,      // number of grid points
+		      FLOAT_T varlo,    // lower filter width
+		      FLOAT_T varhi,    // upper filter width
+		      integer_t k,      // number of grid points to use to determine filter width
+		      FLOAT_T Wc,       // weighted sum (equivalent to k in kNN)
+		      diagnostics* diag_param,
+		      FLOAT_T* weight=NULL,	// scratch space for k filter weights (allocated if NULL)
+		      solver_type solver=SUPERNEWTON ); // method to solve for the filter width (varlo & varhi are not used with BRACKETED)
 
     template <typename FLOAT_T>
     FLOAT_T knn( FLOAT_T** grid,		// array of grid points
@@ -133,7 +349,15 @@ namespace agf
 		 integer_t n,			// number of grid points
 		 FLOAT_T* vec,			// vector (test point) at which to estimate the grid density
 		 integer_t k,			// number of nearest neighbours
-		 const FLOAT_T* dimensions=NULL );	// grid dimensions (for volume normalization)
+		 const FLOAT_T* dimensions=NULL,	// grid dimensions (for volume normalization)
+		 integer_t nthreads=1 );		// number of threads for the nearest neighbour search
+
+    template <typename FLOAT_T>
+    FLOAT_T knn( FLOAT_T* knearest,		// distances squared of k nearest neighbours
+		 FLOAT_T* clwtnearest,		// weights of k nearest neighbours
+		 integer_t ndim,		// number of dimensions in the grid
+		 integer_t k,			// number of nearest neighbours
+		 const FLOAT_T* dimensions );	// grid dimensions (for volume normalization)
 
   }
 }
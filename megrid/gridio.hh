@@ -1,5 +1,116 @@
+#ifndef gridio_hh
+#define gridio_hh
 
-enum file_type { ROOT = 0,
-		 TEXT = 1,
-		 HDF5 = 2 };
+#include <string>
+#include <stdint.h>
 
+#include "types.hh"
+
+namespace gridio
+{
+  enum file_type { ROOT   = 0,
+		   TEXT   = 1,
+		   HDF5   = 2,
+		   BINARY = 3 };
+
+#define GRIDIO_MAGIC "MEGRID"
+#define GRIDIO_VERSION 1
+#define GRIDIO_BYTE_ORDER 0x01020304
+#define GRIDIO_PAGE_SIZE 4096 // alignment (in bytes) of the grid coordinates in the file
+
+  //
+  // header of the binary grid format, followed by
+  //
+  //  - the axis names ('\n' separated)
+  //  - the transformations applied to the grid (see transform::itransformation_base::write)
+  //  - the weights of the grid points (npoints x real_t)
+  //  - the grid coordinates, stored row-by-row exactly as in memory (npoints x ndim
+  //    x real_t or half, depending on precision) and aligned to a page boundary
+  //
+  // the file is written in the native byte order (checked when the file is opened)
+  //
+  struct binary_header
+  {
+    char magic[8];
+    uint32_t version;
+    uint32_t byte_order;
+    uint32_t precision; // megrid::precision_type
+    uint32_t ndim;
+    uint64_t npoints;
+    uint64_t names_offset;
+    uint64_t names_size;
+    uint64_t transformations_offset;
+    uint64_t transformations_size;
+    uint64_t weights_offset;
+    uint64_t data_offset;
+    uint64_t data_size;
+    uint64_t file_size;
+    double precision_sumsq; // see megrid::get_precision_error
+  };
+
+  //
+  // read-only view of a binary grid file, mapped into memory s.t. processes
+  // that open the same file share its pages (modified pages are private copies)
+  //
+  class mapped_file
+  {
+  public:
+    mapped_file( );
+    ~mapped_file( );
+
+    //
+    // map the file into memory and validate the header
+    //
+    bool open( const std::string& file_name );
+    void close( );
+
+    bool is_open( ) const { return _addr != NULL; }
+
+    //
+    // check whether p points into the mapped file
+    //
+    bool contains( const void* p ) const;
+
+    const binary_header& get_header( ) const { return *static_cast<const binary_header*>(_addr); }
+
+    std::string get_axis_names( ) const;
+    std::string get_transformations( ) const;
+
+    const real_t* get_weights( ) const;
+    void* get_data( ) const;
+
+  private:
+    mapped_file( const mapped_file& ) { }
+    mapped_file& operator=( const mapped_file& ) { return (*this); }
+
+    void* _addr;
+    size_t _size;
+  };
+
+  //
+  // write a binary grid file (to a temporary file that is renamed once complete,
+  // s.t. readers, or other processes writing the same file, never see a partially
+  // written file); the offsets & sizes in the
+  // header are filled here (data_size must be set by the caller)
+  //
+  bool write_binary( const std::string& file_name,
+		     binary_header& header,
+		     const std::string& axis_names,
+		     const std::string& transformations,
+		     const real_t* weights,
+		     const void* data );
+
+  //
+  // hash of a description of the inputs of a grid (eg., file names & modification 
+  // times, expressions, transformations), used to name cached grid files
+  //
+  std::string fingerprint( const std::string& description );
+
+  //
+  // describe the size & modification time of a file (to detect changes), 
+  // returns false if the file does not exist
+  //
+  bool file_status( const std::string& file_name, std::string& status );
+}
+
+#endif
@@ -0,0 +1,166 @@
+#ifndef kdtree_hh
+#define kdtree_hh
+
+#include <vector>
+#include <utility>
+
+#include "types.hh"
+
+namespace agf
+{
+  class workspace;
+}
+
+#define KDTREE_LEAF_SIZE 32
+
+//
+// k-d tree spatial index over the points of a grid, used to find the
+// k nearest neighbours of a test point without scanning the whole grid
+//
+// the tree only stores a permutation of the point indices, so the grid data
+// and weights must outlive the index (and the index must be rebuilt if the
+// grid is modified)
+//
+class kdtree
+{
+public:
+  kdtree( const real_array_t* data,
+	  const real_t* weights,
+	  integer_t ndim,
+	  integer_t npts,
+	  integer_t leaf_size=KDTREE_LEAF_SIZE );
+  ~kdtree( );
+
+  //
+  // find the k nearest neighbours of the test point vec
+  //
+  // knearest and clwtnearest are filled with the distances squared and the
+  // weights of the neighbours, ordered by ascending (distance, weight), i.e.,
+  // exactly the k neighbours found by agf::nearest
+  //
+  // returns the number of neighbours found (min(k, npts) less any removed points)
+  //
+  integer_t nearest( const real_t* vec,
+		     integer_t k,
+		     real_t* knearest,
+		     real_t* clwtnearest ) const;
+  
+  //
+  // as above, using the scratch buffers of a workspace (so no memory is 
+  // allocated once the workspace has grown to size)
+  //
+  integer_t nearest( const real_t* vec,
+		     integer_t k,
+		     real_t* knearest,
+		     real_t* clwtnearest,
+		     agf::workspace& ws ) const;
+
+  //
+  // find all grid points within a distance squared r2 of the test point vec
+  //
+  // neighbours is filled with the distances squared and weights of the points
+  // in no particular order (it must have space for all grid points); returns
+  // the number of points found
+  //
+  integer_t range( const real_t* vec,
+		   real_t r2,
+		   std::pair<real_t, real_t>* neighbours,
+		   agf::workspace& ws ) const;
+
+  //
+  // find the index of the grid point nearest to the test point vec, skipping the
+  // point exclude (if >= 0), with its distance squared in d2; returns -1 if 
+  // there is no such point
+  //
+  integer_t nearest_index( const real_t* vec,
+			   real_t& d2,
+			   agf::workspace& ws,
+			   integer_t exclude=-1 ) const;
+
+  //
+  // remove a point from the index, s.t. it is skipped by all searches (eg., once
+  // it has been merged with another point); subtrees without points left are
+  // not visited
+  //
+  void remove( integer_t ipt );
+
+  integer_t get_ndim( ) const { return _ndim; }
+  integer_t get_npoints( ) const { return _npts; }
+  integer_t get_nnodes( ) const { return _nodes.size(); }
+
+  //
+  // get the point indices in the order of the leaves, s.t. consecutive points are 
+  // close in space (eg., to query the grid points with a warm cache)
+  //
+  const std::vector<integer_t>& get_permutation( ) const { return _perm; }
+
+private:
+  kdtree( const kdtree& ) { }
+  kdtree& operator=( const kdtree& ) { return (*this); }
+
+  struct node
+  {
+    integer_t begin;	// first entry in the permutation array
+    integer_t end;	// one past the last entry in the permutation array
+    integer_t left;	// index of the child nodes (-1 for leaves)
+    integer_t right;
+    integer_t dim;	// splitting dimension
+    real_t split;	// splitting value
+  };
+
+  typedef std::pair<real_t, real_t> neighbour_t;
+
+  //
+  // recursively partition the points in [begin, end), returns the node index
+  //
+  integer_t build( integer_t begin, integer_t end );
+
+  //
+  // recursively search the node for neighbours closer than the current k'th
+  //
+  void search( integer_t inode,
+	       double rd,
+	       std::vector<double>& offsets,
+	       const real_t* vec,
+	       integer_t k,
+	       std::vector<neighbour_t>& heap ) const;
+
+  //
+  // recursively collect the points of the node within r2, appending to neighbours[n...]
+  //
+  void collect( integer_t inode,
+		double rd,
+		std::vector<double>& offsets,
+		const real_t* vec,
+		real_t r2,
+		neighbour_t* neighbours,
+		integer_t& n ) const;
+
+  //
+  // recursively search the node for a point closer than the current nearest (best, bestd)
+  //
+  void find( integer_t inode,
+	     double rd,
+	     std::vector<double>& offsets,
+	     const real_t* vec,
+	     integer_t exclude,
+	     integer_t& best,
+	     real_t& bestd ) const;
+
+  const real_array_t* _data;
+  const real_t* _wgts;
+
+  integer_t _ndim;
+  integer_t _npts;
+  integer_t _leaf_size;
+
+  std::vector<integer_t> _perm; // permutation of point indices s.t. each node spans a contiguous range
+  std::vector<node> _nodes;
+
+  std::vector<char> _removed; // flags the removed points (empty until a point is removed)
+  std::vector<integer_t> _alive; // number of points left in each node
+  std::vector<integer_t> _parent; // parent of each node (-1 for the root)
+  std::vector<integer_t> _leaf; // leaf node holding each point
+};
+
+#endif
@@ -16,6 +16,9 @@
 
 typedef log4cpp::Priority::PriorityLevel priority_t;
 
+#define LOG_RATE_BURST 10 // number of repeated messages logged before rate-limiting
+#define LOG_ASYNC_CAPACITY 10000 // maximum number of messages queued for the background thread
+
 class logger 
 {
 public:
@@ -28,6 +31,44 @@ public:
 
   static log4cpp::Category& log();
   
+  //
+  // check whether messages with priority lvl are logged 
+  //
+  static bool is_enabled( priority_t lvl ) { return lvl <= msg_level; }
+  
+  //
+  // write messages from a background thread rather than the calling thread 
+  // (the queue is flushed at exit, or with flush)
+  //
+  static void set_async( bool async );
+  static void flush( );
+  
+  //
+  // allows the first LOG_RATE_BURST messages from one place in the code, then 
+  // only the 2^{n}'th, s.t. a burst of repeated messages can not flood the log
+  //
+  class rate_limit
+  {
+  public:
+    rate_limit( ) : _count( 0 ) { }
+    
+    bool pass( ) 
+    { 
+      unsigned long n = __sync_add_and_fetch( &_count, 1 ); 
+      return n <= LOG_RATE_BURST || (n & (n - 1)) == 0; 
+    }
+    
+    unsigned long get_count( ) const { return _count; }
+    
+    //
+    // note appended to rate-limited messages
+    //
+    std::string get_suffix( ) const;
+    
+  private:
+    volatile unsigned long _count;
+  };
+  
 private:
   logger();
   logger( const logger& ) {}
@@ -37,9 +78,37 @@ private:
 
   static log4cpp::Appender* _stream;
   static log4cpp::Appender* _file;
+  
+  static std::string _logfile;
+  static bool _async;
 
 };
 
 typedef log4cpp::Priority msg;
 
+//
+// log a message only if its priority is enabled, s.t. the message (including 
+// the formatting of its arguments) costs nothing otherwise, eg.,
+//
+//   LOG_DEBUG( "filter width: " << V );
+//
+#define LOG_AT( lvl, message )						\
+  do { if( logger::is_enabled( lvl ) ) { logger::log() << lvl << message; } } while( 0 )
+
+#define LOG_DEBUG( message ) LOG_AT( msg::DEBUG, message )
+#define LOG_INFO( message )  LOG_AT( msg::INFO, message )
+#define LOG_WARN( message )  LOG_AT( msg::WARN, message )
+#define LOG_ERROR( message ) LOG_AT( msg::ERROR, message )
+
+//
+// as above, rate-limited per call site (see logger::rate_limit)
+//
+#define LOG_RATE_LIMITED( lvl, message )				\
+  do { static logger::rate_limit _log_limit;				\
+    if( logger::is_enabled( lvl ) && _log_limit.pass() ) {		\
+      logger::log() << lvl << message << _log_limit.get_suffix();	\
+    } } while( 0 )
+
+#define LOG_WARN_LIMITED( message ) LOG_RATE_LIMITED( msg::WARN, message )
+
 #endif
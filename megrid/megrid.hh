@@ -26,6 +26,7 @@
  * - (lower priority) use boost::ndimarray instead of dynamic arrays (forego memory issues ...)
  * - (lower priority) allow to re-normalize the grid on the fly
  * - (lower priority) factorize the grid reading/storing into separate classes (ROOT, txt, HDF5 ...)
+ *       X binary (memory-mapped) format, see gridio.hh
  *
  *
  *
@@ -33,25 +34,92 @@
  */ 
 
 class foam;
+class kdtree;
+class pdfcache;
+
+namespace agf
+{
+  class workspace;
+}
+
+namespace gridio
+{
+  class mapped_file;
+}
 
 class megrid : public igrid_base
 {
-public:
-  
-  enum pdf_type { KNN = 0,
-		  AGF = 1 };
+  friend class megrid_set; // evaluates the grids of a set at a shared transformed test point
   
-  enum cluster_type { KMEANS       = 0,
-		      HIERARCHICAL = 1 };
+public:
   
-  megrid( std::string name, integer_t ndim ) ;
+  enum pdf_type { KNN        = 0,
+		  AGF        = 1,
+		  AGF_RADIUS = 2 };
+  
+  enum cluster_type { KMEANS           = 0,
+		      HIERARCHICAL     = 1,
+		      MINIBATCH_KMEANS = 2,
+		      HIERARCHICAL_RNN = 3 };
+  
+  enum index_type { BRUTE_FORCE = 0,
+		    KDTREE      = 1 };
+  
+  enum precision_type { SINGLE = 0,
+			HALF   = 1 };
+  
+  //
+  // same values as agf::solver_type (checked at compile time in megrid.cc)
+  //
+  enum solver_type { SUPERNEWTON = 0,
+		     BRACKETED   = 1 };
+  
+  //
+  // cumulative counters of the PDF calculations (times are wall-clock seconds)
+  //
+  struct statistics
+  {
+    statistics( ) { reset(); }
+    void reset( ) 
+    { 
+      nqueries = niterations = nexpansions = ncache_hits = ncache_misses = 0; 
+      t_transform = t_scan = t_select = t_optimize = 0; 
+    }
+    statistics& operator+=( const statistics& s )
+    {
+      nqueries += s.nqueries; niterations += s.niterations; nexpansions += s.nexpansions;
+      ncache_hits += s.ncache_hits; ncache_misses += s.ncache_misses;
+      t_transform += s.t_transform; t_scan += s.t_scan; t_select += s.t_select; t_optimize += s.t_optimize;
+      return (*this);
+    }
+    
+    unsigned long nqueries;	// number of PDF calculations
+    unsigned long niterations;	// number of filter width solver iterations
+    unsigned long nexpansions;	// number of times the bracket on the filter width was moved
+    unsigned long ncache_hits;	// number of PDF values found in the cache (see set_pdf_cache_size)
+    unsigned long ncache_misses;	// number of PDF values calculated & added to the cache
+    double t_transform;		// time spent transforming the test points
+    double t_scan;		// time spent computing distances to the grid points (incl. the spatial index search)
+    double t_select;		// time spent selecting the k nearest neighbours
+    double t_optimize;		// time spent solving for the filter width & evaluating the estimate
+  };
+  
+  megrid( std::string name, integer_t ndim, precision_type precision=SINGLE ) ;
   
   megrid( std::string name,
 	  std::string file_pattern,
 	  std::string tree_name, 
 	  std::string branch_names,
 	  std::string weight_expression="", 
-	  integer_t max_entries = -1 ) ;
+	  integer_t max_entries = -1,
+	  precision_type precision=SINGLE ) ;
+  
+  //
+  // open a grid saved in the binary format (see save); the grid coordinates are
+  // mapped into memory rather than read, so processes that open the same file
+  // share one copy, and the retained transformations are restored
+  //
+  megrid( std::string name, std::string file_name ) ;
   
   virtual ~megrid( );
   
@@ -68,6 +136,63 @@ public:
   //
   real_t pdf( const std::vector<real_t>& vec ) const;
   
+  //
+  // calculate the probability density for a given test point x=(x_{0}, ... x_{ndim-1}),
+  // using the scratch buffers in ws; the other pdf methods share one workspace 
+  // owned by the grid, so concurrent callers should each pass their own
+  //
+  real_t pdf( const real_t* x, agf::workspace& ws ) const;
+  
+  //
+  // calculate the probability density for n test points stored row-by-row in
+  // points (n x ndim, with ndim the untransformed grid dimension), filling out[0..n-1]
+  //
+  // scratch buffers are shared by all points in the batch; returns false if 
+  // the grid is not loaded or any of the points could not be evaluated
+  //
+  bool pdf_batch( const real_t* points, size_t n, real_t* out ) const;
+  
+  //
+  // get & reset the counters accumulated over all PDF calculations with this grid
+  //
+  const statistics& get_stats( ) const { return _stats; }
+  void reset_stats( ) { _stats.reset(); }
+  
+  //
+  // calculate the probability density for a given test point progressively, 
+  // starting from the coarsest level of the pyramid (see set_pyramid_levels) and
+  // refining to finer levels until the estimated relative error is below 
+  // tolerance, or until the next level is expected to exceed the time budget 
+  // (in seconds, <= 0 for no limit); the finest level is the full grid
+  //
+  // the error of each level is estimated by the relative change from the 
+  // previous level (1 for the coarsest); see get_progressive_error & _level
+  //
+  real_t pdf_progressive( const std::vector<real_t>& vec, real_t tolerance, real_t budget=0 ) const;
+  
+  //
+  // get the estimated relative error & the pyramid level (0 is the coarsest) 
+  // of the last progressive PDF calculation
+  //
+  real_t get_progressive_error( ) const { return _progressive_error; }
+  integer_t get_progressive_level( ) const { return _progressive_level; }
+  
+  //
+  // get & set the number of coarse levels in the pyramid of nested random 
+  // subsamples of the grid, and the ratio of the sizes of successive levels
+  // (eg., 2 levels with ratio 0.1 hold 1% & 10% of the grid points); the pyramid
+  // is built on the first progressive query after the grid is loaded or modified
+  //
+  integer_t get_pyramid_levels( ) const { return _pyramid_levels; }
+  void set_pyramid_levels( integer_t n );
+  real_t get_pyramid_ratio( ) const { return _pyramid_ratio; }
+  void set_pyramid_ratio( real_t r );
+  
+  //
+  // build the pyramid now rather than on the first progressive query
+  //
+  bool build_pyramid( ) const;
+  
   //
   // get & set W_{c} value, equivalent of K in k-nn scheme 
   //
@@ -80,14 +205,93 @@ public:
   integer_t get_maxk( ) const { return _maxk; }
   void set_maxk( integer_t k ) { _maxk = k; }
 
+  //
+  // get & set min_{delta}, if >= 0 then k is increased until the relative change
+  // in the PDF is below min_{delta} (negative to always use max_{k} neighbours)
+  //
+  real_t get_mindelta( ) const { return _mindelta; }
+  void set_mindelta( real_t d ) { _mindelta = d; }
+
   //
   // get & set PDF option
   //
+  // with AGF_RADIUS the AGF estimate is calculated from the grid points within
+  // a radius of the test point, beyond which the filter weights are below float 
+  // precision, rather than from all max_{k} nearest neighbours (the radius is 
+  // only expanded while the points within it can not reach W_{c}); the result 
+  // equals AGF up to the truncated weights (with min_{delta} >= 0 the neighbours
+  // are found as for AGF)
+  //
   pdf_type get_option_pdf( ) const { return _option_pdf; }
   void set_option_pdf( pdf_type t ) { _option_pdf = t; }
   
   //
-  // get the grid point coordinates
+  // get & set the method used to solve for the AGF filter width; BRACKETED 
+  // derives the bracket on the filter width from the neighbour distances & W_{c}
+  // and takes a bounded number of Newton steps (see agf::solver_type)
+  //
+  solver_type get_option_solver( ) const { return _option_solver; }
+  void set_option_solver( solver_type t ) { _option_solver = t; }
+  
+  //
+  // get & set the nearest neighbour search option; with KDTREE a spatial index 
+  // is built over the (transformed) grid on the first query after the grid is 
+  // loaded or modified, and is used to find the k nearest grid points
+  //
+  index_type get_option_index( ) const { return _option_index; }
+  void set_option_index( index_type t );
+  
+  //
+  // build the spatial index now rather than on the first query
+  //
+  bool build_index( ) const;
+  
+  //
+  // get & set the number of threads used to scan the grid within a single 
+  // PDF calculation (results do not depend on the number of threads)
+  //
+  integer_t get_nthreads( ) const { return _nthreads; }
+  void set_nthreads( integer_t n ) { _nthreads = n > 0 ? n : 1; }
+  
+  //
+  // get & set the number of PDF values kept in a cache keyed on the transformed 
+  // test point (0 to disable the cache, the default); once full, the least 
+  // recently used value is evicted
+  //
+  integer_t get_pdf_cache_size( ) const { return _pdf_cache_size; }
+  void set_pdf_cache_size( integer_t n );
+  
+  //
+  // get & set the tolerance with which the transformed test points are matched
+  // in the cache; coordinates are rounded to multiples of the tolerance (0 to
+  // only return values for identical points, the default)
+  //
+  real_t get_pdf_cache_tolerance( ) const { return _pdf_cache_tolerance; }
+  void set_pdf_cache_tolerance( real_t tol );
+  
+  //
+  // get & set the precision with which the grid coordinates are stored; with 
+  // HALF the coordinates take half the memory and are only widened to single
+  // precision in the distance calculation (the spatial index is not used, and 
+  // operations that modify the grid work on a temporary single precision copy)
+  //
+  precision_type get_option_precision( ) const { return _option_precision; }
+  bool set_option_precision( precision_type t );
+  
+  //
+  // get the RMS distance by which the grid points were moved when the grid 
+  // was converted to half precision (zero for single precision)
+  //
+  real_t get_precision_error( ) const;
+  
+  //
+  // get the estimated relative error of the last PDF calculation due to the 
+  // precision of the grid coordinates (zero for single precision)
+  //
+  real_t get_pdf_precision_error( ) const;
+  
+  //
+  // get the grid point coordinates (NULL if the grid is stored in half precision)
   //
   virtual const real_array_t* get_data( ) const { return _data; }
   
@@ -104,7 +308,7 @@ public:
   //
   // get resource allocation
   //
-  virtual integer_t get_resource_size( ) const { return _nreserved * sizeof(real_t) * _ndim; }
+  virtual integer_t get_resource_size( ) const { return _nreserved * _ndim * (_option_precision == HALF ? sizeof(half) : sizeof(real_t)); }
   
   //
   // get number of dimensions 
@@ -136,24 +340,59 @@ public:
   //  
   bool apply_transformation( transform::itransformation_base* t, bool retain=true, bool force_configure=false );
 
+  //
+  // queue a transformation, to be applied with the other queued transformations
+  // by apply_transformations( ), eg., a scaling followed by a rotation
+  //
+  void queue_transformation( transform::itransformation_base* t, bool retain=true, bool force_configure=false );
+
+  //
+  // apply the queued transformations in order; consecutive transformations that 
+  // do not need the (transformed) grid data to be configured are fused into one 
+  // pass over the grid, which is done in place if the dimension does not change;
+  // if a transformation fails, it and those after it are left in the queue
+  //
+  bool apply_transformations( );
+
   //
   // get list of transformations applied to this grid
   // 
   std::vector<const transform::itransformation_base*> get_transformations( ) const;
   
   //
-  // resample the grid, iteratively merging closest grid points (brute-force method)
+  // resample the grid, iteratively merging closest grid points into their weighted
+  // centroids (pairs of points that are each other's nearest neighbour are found
+  // with a spatial index, & in each iteration a point is merged at most once)
   //
   // niter is the number of merge operations (grid size is reduced by factor of <= 2^{niter})
-  // maxd is the maximum distance between grid points that are allowed to be merged (<= 0 implies no maximum)
+  // maxd is the maximum distance between grid points that are allowed to be merged (<= 0 implies no maximum),
+  // compared with the squared Euclidean distance; coincident points are not merged
   //
   bool resample( unsigned niter, double maxd=-1 );
   
   // 
   // resample the grid using various clustering algorithms
   //
+  // MINIBATCH_KMEANS is seeded with k-means|| & updates the cluster centers from 
+  // random batches of grid points (see set_cluster_batch_size), so it scales to
+  // large grids; it ignores method & supports only the Euclidian metric
+  //
+  // HIERARCHICAL_RNN agglomerates the grid points bottom-up, merging the pairs of
+  // points that are each other's nearest neighbour in rounds (cheapest pairs by 
+  // Ward's criterion first in the last round); it runs in memory linear in the 
+  // grid size, ignores method & supports only the Euclidian metric
+  //
   bool cluster( cluster_type t, unsigned int nclusters, char method, char metric='e' );
   
+  //
+  // get & set the number of grid points in each batch & the number of batches
+  // used for mini-batch k-means clustering
+  //
+  integer_t get_cluster_batch_size( ) const { return _cluster_batch_size; }
+  void set_cluster_batch_size( integer_t n ) { _cluster_batch_size = n > 0 ? n : 1; }
+  integer_t get_cluster_iterations( ) const { return _cluster_iterations; }
+  void set_cluster_iterations( integer_t n ) { _cluster_iterations = n > 0 ? n : 1; }
+  
   // 
   // create a 'foam' integration grid from this grid
   //
@@ -192,17 +431,61 @@ public:
   bool store( const std::string& file_name, 
 	      const std::string& tree_name, 
 	      const std::string& branch_names ); 
+  
+  //
+  // save grid into a binary file that can be opened with megrid( name, file_name ), 
+  // along with the transformations applied to the grid & the axis names
+  //
+  bool save( const std::string& file_name ) const;
+  
+  //
+  // get the expressions used to define each (untransformed) grid axis
+  //
+  const std::vector<std::string>& get_axis_names( ) const { return _axis_names; }
 
   //
   // add another grid to this one
   //
   bool add_grid( const megrid& g );
   megrid& operator+=( const megrid& g );
+
+  //
+  // move the points of another grid to this one, leaving the other grid empty;
+  // the storage of g is taken over instead of copied (only the row pointers & 
+  // weights are copied), so combining grids does not hold the points twice
+  //
+  // grids in half precision or opened from a binary file are copied & cleared
+  //
+  bool move_grid( megrid& g );
   
   //
   // set the verbosity of the logging
   //
   static void set_loglevel( const std::string& lvl );
+  
+  //
+  // write the log messages from a background thread (see logger::set_async)
+  //
+  static void set_logasync( bool async );
+  
+  //
+  // get & set the directory where loaded (and transformed) grids are cached 
+  // (empty to disable caching)
+  //
+  // grids loaded from ROOT files are saved in the binary format under a hash of 
+  // the input files (names, sizes & modification times), coordinate & weight 
+  // expressions and maximum number of entries; each subsequent transformation 
+  // extends the hash with the transformation parameters, s.t. a later job that 
+  // loads & transforms the grid in the same way opens the cached result instead
+  //
+  static std::string get_cache_directory( ) { return _cache_directory; }
+  static void set_cache_directory( const std::string& dir ) { _cache_directory = dir; }
+  
+  //
+  // get the hash identifying the grid in the cache (empty if the grid can not 
+  // be cached, eg., after points were added)
+  //
+  std::string get_cache_key( ) const { return _cache_key; }
 
 private:
   megrid() { }
@@ -218,13 +501,73 @@ private:
 	     std::string selection="",
 	     integer_t max_entries = -1 );
   
+  //
+  // open a grid from a binary file, optionally restoring the transformations
+  //
+  bool open( const std::string& file_name, bool restore_transformations=true );
+  
+  //
+  // get the name of the cached grid file for a given key (empty if caching is disabled)
+  //
+  std::string get_cache_file( const std::string& key ) const;
+  
+  //
+  // save the grid to the cache under a given key, along with the state of the 
+  // transformation t that produced it (if any)
+  //
+  bool save_cache( const std::string& key, const transform::itransformation_base* t=NULL ) const;
+  
   //
   // calculate the location of the point in the transformed grid
   // 
-  std::vector<real_t> get_transformed_point( const std::vector<real_t>& x ) const;
-  void get_transformed_point( const real_t* x, real_t* xp ) const;
+  void get_transformed_point( const real_t* x, real_t* xp, std::vector<real_t>& buffer ) const;
+  
+  //
+  // rebuild the chain of transformations applied to test points after the
+  // transformations change, composing consecutive affine maps into one
+  //
+  void compile_transformations( );
+  
+  //
+  // apply a chain of (configured) transformations to a point, alternating between 
+  // two halves of the buffer for the intermediate points (xp must not alias x)
+  //
+  void transform_point( const std::vector<transform::itransformation_base*>& chain,
+			const real_t* x, real_t* xp, std::vector<real_t>& buffer ) const;
+  
+  //
+  // apply a chain of (configured) transformations to all grid points in one pass,
+  // in place if the dimension does not change & distributed over nthreads
+  //
+  void transform_data( const std::vector<transform::itransformation_base*>& chain );
+  
+  //
+  // calculate the probability density at a point in the transformed grid, 
+  // adding the iterations & time spent in each phase to stats
+  //
+  real_t evaluate( real_t* x, agf::workspace& ws, statistics& stats ) const;
+  
+  //
+  // find the k nearest grid points to a point in the transformed grid
+  // (stored in ws.knearest & ws.clwtnearest)
+  //
+  void nearest( real_t* x, integer_t k, agf::workspace& ws ) const;
+  
+  //
+  // find the (at most k) nearest grid points within a distance squared r2 of
+  // a point in the transformed grid (stored in ws.knearest & ws.clwtnearest), 
+  // returns the number of points found
+  //
+  integer_t nearest_within( real_t* x, integer_t k, double r2, agf::workspace& ws ) const;
   
   std::vector<transform::itransformation_base*> _transformations;
+  std::vector<transform::itransformation_base*> _owned_transformations; // transformations restored from file (deleted with the grid)
+  std::vector<transform::itransformation_base*> _compiled_transformations; // _transformations, with consecutive affine maps composed into one
+  std::vector<transform::itransformation_base*> _composed_transformations; // the composed maps (deleted with the grid)
+  std::vector<std::string> _axis_names; // definition of each grid axis
+  std::string _cache_key; // hash of the inputs & operations that produced the grid
+  
+  static std::string _cache_directory; // directory for cached grids
   
   std::string _name; // name of the grid
   real_t _wc; // W_{c} value used for calculating PDF's
@@ -232,13 +575,57 @@ private:
   integer_t _maxk; // defines k used in optimizing sigma and calculating PDF's if pdf_type==AGF
   
   pdf_type _option_pdf; // option for algorithm used in calculating PDF's
+  index_type _option_index; // option for nearest neighbour search
+  precision_type _option_precision; // option for the storage of the grid coordinates
+  solver_type _option_solver; // option for the AGF filter width solver
+  
+  mutable kdtree* _index; // spatial index over the grid points (built on demand)
+  mutable pdfcache* _pdf_cache; // cached PDF values (NULL if disabled)
+  integer_t _pdf_cache_size; // capacity of the PDF cache
+  real_t _pdf_cache_tolerance; // quantisation of the test points in the PDF cache
+  
+  mutable std::vector<megrid*> _pyramid; // coarse levels of the pyramid, coarsest first (built on demand)
+  integer_t _pyramid_levels; // number of coarse levels in the pyramid
+  real_t _pyramid_ratio; // ratio of the sizes of successive levels
+  mutable real_t _progressive_error; // estimated relative error of the last progressive PDF calculation
+  mutable integer_t _progressive_level; // pyramid level of the last progressive PDF calculation
+  
+  integer_t _nthreads; // number of threads for the grid scan in each PDF calculation & for the transformations
+  integer_t _cluster_batch_size; // number of grid points in each batch of mini-batch k-means
+  integer_t _cluster_iterations; // number of batches of mini-batch k-means
+
+  struct queued_transformation
+  {
+    transform::itransformation_base* t;
+    bool retain;
+    bool force_configure;
+  };
+  std::vector<queued_transformation> _queued_transformations; // transformations to be applied by apply_transformations( )
+  
+  //
+  // put the transformations queue[iq..] that were not applied back in the queue;
+  // returns true if there are none
+  //
+  bool requeue_transformations( const std::vector<queued_transformation>& queue, unsigned iq );
+  
+  agf::workspace* _workspace; // scratch buffers for PDF calculations
+  mutable statistics _stats; // counters accumulated over the PDF calculations
   
   bool _is_locked; // flag indicates grid is locked (no further operations can be performed)
   
   real_t* _wgts; // weights for each grid point
-  real_array_t* _data; // grid data
+  real_array_t* _data; // grid data (pointers to the rows of _buffer)
+  real_t* _buffer; // contiguous storage for the grid data
+  std::vector<real_t*> _segments; // storage taken over from other grids, holding the rows of _data not in _buffer
+  half* _hbuffer; // contiguous storage for the grid data in half precision (replaces _data & _buffer)
+  mutable gridio::mapped_file* _mapping; // binary file holding _buffer or _hbuffer, if the grid was opened from one
+  double _precision_sumsq; // sum of the squared distances the grid points moved when stored in half precision
   
   std::vector<real_t> _grid_dimensions; // length scale for each grid axis
+  std::vector<real_t> _grid_min; // lower & upper bounds of each grid axis
+  std::vector<real_t> _grid_max;
+  std::vector<double> _moment1; // sum of the grid point coordinates
+  double _moment2; // sum of the squared norms of the grid points
   real_t _sum_wgts;
 
   integer_t _ndim; // dimensionality of the grid
@@ -250,13 +637,61 @@ private:
   //
   void clear( );
   
+  //
+  // discard the spatial index (eg., after the grid is modified)
+  //
+  void release_index( ) const;
+  
+  //
+  // discard the levels of the pyramid
+  //
+  void release_pyramid( ) const;
+  
+  //
+  // discard the spatial index, cached PDF values & pyramid after the grid is modified
+  //
+  void invalidate( ) const;
+  
   //
   // release memory for a given array
   //
   template<typename T>
   void release( T*& arr ) const;
-  template<typename T>
-  void release( T*& arr, integer_t len ) const;
+  
+  //
+  // allocate space for len points in dim dimensions as one contiguous (aligned) 
+  // block in buffer, stored row-by-row; arr is filled with pointers to the rows
+  //
+  void allocate( real_array_t*& arr, real_t*& buffer, integer_t len, integer_t dim ) const;
+  
+  void allocate( half*& buffer, integer_t len, integer_t dim ) const;
+  
+  //
+  // release memory allocated with allocate(...)
+  //
+  void release( real_array_t*& arr, real_t*& buffer ) const;
+  void release( half*& buffer ) const;
+  
+  //
+  // release _data, _buffer & the segments taken over from other grids
+  //
+  void release_data( );
+  
+  //
+  // check that a grid can be added to this one (same dimensions & transformations)
+  //
+  bool is_compatible( const megrid& g ) const;
+  
+  //
+  // release the mapped file if it holds buffer (or unconditionally for NULL), 
+  // returns true if the file was released
+  //
+  bool unmap( const void* buffer ) const;
+  
+  //
+  // copy the options that affect the PDF calculation to a level of the pyramid
+  //
+  void configure_level( megrid* level ) const;
   
   //
   // reserve space in memory
@@ -264,9 +699,11 @@ private:
   bool reserve( unsigned m );
   
   //
-  // copy an array structure
+  // get a grid point coordinate, or copy the coordinates of a grid point 
+  // to x, independent of the storage precision
   //
-  real_array_t* copy( const real_array_t* arr, integer_t len, integer_t dim ) const;
+  real_t get_coordinate( integer_t ipt, integer_t idim ) const;
+  void get_point( integer_t ipt, real_t* x ) const;
   
   //
   // k-means clustering
@@ -277,11 +714,44 @@ private:
   // hierarchical clustering
   //
   bool hierarchical_cluster( unsigned int nclusters, char method, char metric='e' );
+  
+  //
+  // mini-batch k-means clustering
+  //
+  bool minibatch_cluster( unsigned int nclusters );
+  
+  //
+  // hierarchical clustering by merging reciprocal nearest neighbours
+  //
+  bool rnn_cluster( unsigned int nclusters );
+  
+  //
+  // merge the pairs of grid points that are each other's nearest neighbour (and 
+  // closer than maxd, if > 0) into their weighted centroids, at most nmax pairs 
+  // with the smallest increase in the weighted sum of squares (Ward's criterion);
+  // returns the number of pairs merged
+  //
+  integer_t merge_neighbours( integer_t nmax, double maxd=-1 );
+  
+  //
+  // merge grid point jpt into ipt (the weighted centroid, with the summed weight)
+  //
+  void merge_points( integer_t ipt, integer_t jpt );
+  
+  //
+  // remove the flagged grid points, moving the others down in place
+  //
+  void drop_points( const std::vector<char>& drop );
 
   //
-  // calculate grid dimensions
+  // calculate grid dimensions & moments
   //
   void set_metadata( );
+  
+  //
+  // update grid dimensions & moments for a single added point
+  //
+  void update_metadata( const real_t* p, real_t w );
 };
 
 #endif
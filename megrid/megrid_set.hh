@@ -0,0 +1,88 @@
+#ifndef megrid_set_hh
+#define megrid_set_hh
+
+#include <string>
+#include <vector>
+
+#include "types.hh"
+#include "megrid.hh"
+
+//
+// a set of grids with the same coordinate definitions and one shared chain of
+// transformations, eg., the grids of the hypotheses an event is scored against
+//
+// each test point is transformed once, and the densities of all grids are
+// calculated from the transformed point in one call (in parallel over the grids
+// with nthreads > 1); the PDF caches & pyramids of the grids are not used
+//
+// the grids are not owned by the set and must outlive it
+//
+class megrid_set
+{
+public:
+
+  megrid_set( std::string name );
+  ~megrid_set( );
+
+  //
+  // add a grid to the set; the grid must have the same dimensions as the others
+  // and the same retained transformations, i.e., either none or those applied
+  // through the set (see apply_transformation)
+  //
+  bool add_grid( megrid* g );
+
+  //
+  // get the number of grids & the i'th grid in the set
+  //
+  integer_t get_ngrids( ) const { return _grids.size(); }
+  megrid* get_grid( integer_t i ) const { return _grids[i]; }
+
+  //
+  // apply a transformation to all grids in the set; unless it is already
+  // configured (or force_configure), the transformation is configured on the
+  // first grid and applied as is to the others, s.t. the chain is shared
+  //
+  bool apply_transformation( transform::itransformation_base* t, bool retain=true, bool force_configure=false );
+
+  //
+  // calculate the probability density of each grid for a given test point
+  // vec=(x_{0}, ... x_{ndim-1}) (-1 for grids that could not be evaluated)
+  //
+  std::vector<real_t> pdf( const std::vector<real_t>& vec ) const;
+
+  //
+  // as above, for a test point x, filling out[0..ngrids-1] (-1 for grids that 
+  // are not loaded or could not be evaluated); returns false if any such grid
+  //
+  bool pdf( const real_t* x, real_t* out ) const;
+
+  //
+  // calculate the ratio of the probability density of each grid to that of
+  // the grid iref (-1 if either could not be evaluated or the latter is zero)
+  //
+  std::vector<real_t> likelihood_ratios( const std::vector<real_t>& vec, integer_t iref=0 ) const;
+
+  //
+  // get & set the number of threads over which the grids are distributed
+  //
+  integer_t get_nthreads( ) const { return _nthreads; }
+  void set_nthreads( integer_t n ) { _nthreads = n > 0 ? n : 1; }
+
+  //
+  // get & set name of the set
+  //
+  std::string get_name( ) const { return _name; }
+  void set_name( const std::string& name ) { _name = name; }
+
+private:
+  megrid_set( ) { }
+  megrid_set( const megrid_set& ) { }
+  megrid_set& operator=( const megrid_set& ) { return (*this); }
+
+  std::string _name; // name of the set
+  std::vector<megrid*> _grids; // grids in the set
+  std::vector<agf::workspace*> _workspaces; // scratch buffers for the PDF calculations of each grid
+  integer_t _nthreads; // number of threads for the PDF calculations
+};
+
+#endif
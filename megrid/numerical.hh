@@ -74,8 +74,14 @@ FLOAT_T supernewton(void (*funcd) (FLOAT_T, void *, FLOAT_T *, FLOAT_T *),
   
   int gsl_status;	//error state from GSL calls
   
-  yp=gsl_vector_alloc(4);
-  A=gsl_matrix_alloc(4, 4);
+  //storage for the linear system is on the stack (no allocation per call):
+  double yp_data[4];
+  double A_data[16];
+  gsl_vector_view yp_view=gsl_vector_view_array(yp_data, 4);
+  gsl_matrix_view A_view=gsl_matrix_view_array(A_data, 4, 4);
+  
+  yp=&(yp_view.vector);
+  A=&(A_view.matrix);
   
   err=0;
   i=0;
@@ -261,10 +267,6 @@ FLOAT_T supernewton(void (*funcd) (FLOAT_T, void *, FLOAT_T *, FLOAT_T *),
   
   //printf("Supernewton: %d iterations required to reach convergence\n", i);
   
-  //clean up:
-  gsl_matrix_free(A);
-  gsl_vector_free(yp);
-  
   return x0;
 }
 
@@ -0,0 +1,79 @@
+#ifndef pdfcache_hh
+#define pdfcache_hh
+
+#include <list>
+#include <vector>
+#include <utility>
+
+#include <boost/unordered_map.hpp>
+#include <boost/functional/hash.hpp>
+
+#include "types.hh"
+#include "agf.hh"
+
+//
+// bounded cache of PDF values keyed on the (transformed) test point, s.t.
+// repeated queries at the same point return without scanning the grid; once
+// the cache is full the least recently used entry is evicted
+//
+// the coordinates are quantised to multiples of a tolerance (or compared
+// exactly if the tolerance is zero), so test points that round to the same
+// multiples share one value
+//
+class pdfcache
+{
+public:
+  typedef std::vector<long long> key_type;
+
+  struct value_type
+  {
+    real_t pdf;
+    agf::diagnostics diag;
+  };
+
+  pdfcache( integer_t capacity, real_t tolerance=0 );
+  ~pdfcache( );
+
+  //
+  // build the key for the test point x, extended with ntags values that
+  // identify the settings the PDF was calculated with
+  //
+  void make_key( const real_t* x,
+		 integer_t ndim,
+		 const double* tags,
+		 integer_t ntags,
+		 key_type& key ) const;
+
+  //
+  // look up the value for a key, marking it as most recently used; returns
+  // false if the key is not in the cache
+  //
+  bool find( const key_type& key, value_type& value );
+
+  //
+  // add (or replace) the value for a key, evicting the least recently used
+  // entry if the cache is full
+  //
+  void insert( const key_type& key, const value_type& value );
+
+  void clear( );
+
+  integer_t get_size( ) const { return _lookup.size(); }
+  integer_t get_capacity( ) const { return _capacity; }
+  real_t get_tolerance( ) const { return _tolerance; }
+
+private:
+  pdfcache( const pdfcache& ) { }
+  pdfcache& operator=( const pdfcache& ) { return (*this); }
+
+  typedef std::list< std::pair<key_type, value_type> > list_type;
+  typedef boost::unordered_map< key_type, list_type::iterator, boost::hash<key_type> > map_type;
+
+  list_type _entries; // entries ordered from most to least recently used
+  map_type _lookup; // position of each key in _entries
+
+  integer_t _capacity;
+  real_t _tolerance;
+};
+
+#endif
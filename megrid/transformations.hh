@@ -6,6 +6,7 @@
 #include <vector>
 #include <string>
 #include <set>
+#include <iostream>
 
 class igrid_base;
 
@@ -28,11 +29,39 @@ namespace transform
     
     virtual bool configure(const igrid_base*, bool force=false) = 0;
 
+    //
+    // true if configure(...) may read the grid data, i.e., the transformation must 
+    // be configured on the grid as transformed by the preceding transformations;
+    // megrid::apply_transformations only fuses a transformation into the pass of
+    // those before it if this is false, so override it to return false only if 
+    // configure(...) never reads the grid data (regardless of force)
+    //
+    virtual bool needs_data() const { return true; }
+
+    //
+    // get the transformation as an affine map xp = A x + b, with A stored row by 
+    // row (out_dim x in_dim); returns false if the transformation is not affine
+    //
+    virtual bool get_affine(std::vector<double>& A, std::vector<double>& b) const { return false; }
+
     virtual bool operator==(const itransformation_base* t) const = 0;
     
     virtual unsigned get_in_dim() const { return _in_dim; }
     virtual unsigned get_out_dim() const { return _out_dim; }
     
+    //
+    // name that identifies the type of transformation in a stream
+    //
+    virtual std::string get_name() const = 0;
+    
+    //
+    // write the state of the transformation to a stream as text, and read it 
+    // back (after the name, see transform::read); a transformation that is read
+    // back does not need to be re-configured on a grid
+    //
+    virtual void write(std::ostream& os) const;
+    virtual bool read(std::istream& is);
+    
   protected:
     void set_in_dim(unsigned n) { _in_dim = n; }
     void set_out_dim(unsigned n) { _out_dim = n; }
@@ -69,9 +98,14 @@ namespace transform
     virtual void operator()(const real_t* x, real_t* xp) const;
     
     virtual bool configure(const igrid_base*, bool force=false);
+    virtual bool needs_data() const { return false; }
 
     virtual bool operator==(const itransformation_base* t) const;
 
+    virtual std::string get_name() const { return "rotate_phi"; }
+    virtual void write(std::ostream& os) const;
+    virtual bool read(std::istream& is);
+
     const std::vector< std::pair<unsigned,unsigned> >& get_vector_indices() const { return _i_pairs; }
 
   private:
@@ -97,6 +131,11 @@ namespace transform
     virtual bool configure(const igrid_base*, bool force=false);
 
     virtual bool operator==(const itransformation_base* t) const;
+    virtual bool get_affine(std::vector<double>& A, std::vector<double>& b) const;
+
+    virtual std::string get_name() const { return "norm_gauss"; }
+    virtual void write(std::ostream& os) const;
+    virtual bool read(std::istream& is);
 
     const std::vector<real_t>& get_std_deviations() const { return _std_deviations; }
     const std::vector<real_t>& get_means() const { return _means; }
@@ -111,9 +150,18 @@ namespace transform
   class norm_range : public itransformation_base
   {
   public:
-    norm_range(unsigned idim, unsigned sampling_frequency = 1) : 
+    //
+    // map each coordinate to its cumulative fraction in the grid, s.t. the 
+    // transformed grid is uniform in [0,1] along each axis
+    //
+    // the cumulative distribution is stored as a table of nknots quantiles 
+    // per axis (from every sampling_frequency'th grid point) & interpolated
+    // linearly between them
+    //
+    norm_range(unsigned idim, unsigned sampling_frequency = 1, unsigned nknots = 2048) : 
       itransformation_base(idim, idim),
-      _sampling_frequency(sampling_frequency) { }
+      _sampling_frequency(sampling_frequency > 0 ? sampling_frequency : 1),
+      _nknots(nknots > 1 ? nknots : 2) { }
     virtual ~norm_range() { }
     
     virtual real_t* operator()(const real_t* x) const;
@@ -123,12 +171,21 @@ namespace transform
 
     virtual bool operator==(const itransformation_base* t) const;
 
-    const std::vector< std::vector<real_t> >& get_cdf() const { return _sorted_data; }
+    virtual std::string get_name() const { return "norm_range"; }
+    virtual void write(std::ostream& os) const;
+    virtual bool read(std::istream& is);
+
+    //
+    // get the quantiles of each axis, at equally spaced cumulative fractions from 0 to 1
+    //
+    const std::vector< std::vector<real_t> >& get_cdf() const { return _quantiles; }
     unsigned get_sampling_frequency() const { return _sampling_frequency; }
+    unsigned get_nknots() const { return _nknots; }
     
   private:
     unsigned _sampling_frequency;
-    std::vector< std::vector<real_t> > _sorted_data;
+    unsigned _nknots;
+    std::vector< std::vector<real_t> > _quantiles;
   };
 
   //////////////////////////////////////////////////////////////////////////////////
@@ -148,8 +205,14 @@ namespace transform
     virtual void operator()(const real_t* x, real_t* xp) const;
     
     virtual bool configure(const igrid_base*, bool force=false);
+    virtual bool needs_data() const { return false; }
 
     virtual bool operator==(const itransformation_base* t) const;
+    virtual bool get_affine(std::vector<double>& A, std::vector<double>& b) const;
+
+    virtual std::string get_name() const { return "scale_fixed"; }
+    virtual void write(std::ostream& os) const;
+    virtual bool read(std::istream& is);
 
     const std::vector<real_t> get_scale_factors() const { return _scales; }
     
@@ -157,6 +220,55 @@ namespace transform
     std::vector<real_t> _scales;
   };
 
+  //////////////////////////////////////////////////////////////////////////////////
+  
+  class affine : public itransformation_base
+  {
+  public:
+    //
+    // the affine map xp = A x + b, with A stored row by row (out_dim x in_dim)
+    //
+    affine(unsigned in_dim, unsigned out_dim, const std::vector<double>& A, const std::vector<double>& b);
+    
+    //
+    // the composition of a chain of affine transformations, applied in order
+    // (i.e., each transformation returns true from get_affine)
+    //
+    affine(const std::vector<const itransformation_base*>& chain);
+    virtual ~affine() { }
+    
+    virtual real_t* operator()(const real_t* x) const;
+    virtual void operator()(const real_t* x, real_t* xp) const;
+    
+    virtual bool configure(const igrid_base*, bool force=false);
+    virtual bool needs_data() const { return false; }
+
+    virtual bool operator==(const itransformation_base* t) const;
+    virtual bool get_affine(std::vector<double>& A, std::vector<double>& b) const;
+
+    virtual std::string get_name() const { return "affine"; }
+    virtual void write(std::ostream& os) const;
+    virtual bool read(std::istream& is);
+
+    const std::vector<double>& get_matrix() const { return _matrix; }
+    const std::vector<double>& get_offset() const { return _offset; }
+    
+  private:
+    void set_diagonal();
+    
+    std::vector<double> _matrix;
+    std::vector<double> _offset;
+    bool _diagonal; // A is diagonal, s.t. xp_i = A_ii x_i + b_i
+  };
+
+  //////////////////////////////////////////////////////////////////////////////////
+  
+  //
+  // create a transformation from its state written to a stream with write(...),
+  // returns NULL if the stream does not hold a known, valid transformation
+  //
+  itransformation_base* read(std::istream& is);
+
 }
 
 #endif
@@ -6,10 +6,7 @@
 
 #include <halffloat.hh>
 
-// @TODO use halffloat for grid data 
-
-// typedef half* smallreal_array_t;
-// typedef half  smallreal_t;
+// NB grids can be stored in half precision, see megrid::precision_type
 
 typedef float* real_array_t; 
 typedef float  real_t;
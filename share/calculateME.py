@@ -39,10 +39,12 @@ randomseed  = 0
 cfgmodules  = []
 cfgexec     = ''
 itreen      = 'HWWTree'
+cachedir    = os.environ.get( 'MEGRID_CACHE', '' )
+statsmode   = []
 
 def usage():
     print 'USAGE: [-v] [-a] [-u] --cfg=cfg.py [--exec="mehndl.setX()"] --input=ww.root --output=me_ww.root'
-    print '       [--begin=0] [--end=0] [--random=0] [--seed=0]'
+    print '       [--begin=0] [--end=0] [--random=0] [--seed=0] [--cache=/tmp/megrid] [--stats=extra,summary]'
     sys.exit( -1 )
 
 try:
@@ -56,7 +58,9 @@ try:
                                  'end=',
                                  'random=',
                                  'seed=',
-                                 'tree='] )
+                                 'tree=',
+                                 'cache=',
+                                 'stats='] )
 except getopt.GetoptError, error:
     print str( error )
     usage()
@@ -86,6 +90,10 @@ for o, a in opts:
         randomseed = int( a )
     if o in ( '-q', '--tree' ):
         itreen = a
+    if o in ( '--cache', ):
+        cachedir = a
+    if o in ( '--stats', ):
+        statsmode = a.split( ',' )
 
 if len(cfgmodules)==0 or ofilen==None or ifilen==None:
     usage()    
@@ -189,6 +197,14 @@ if update and len( ifilen )>1:
 selection            = None   # selection cuts to apply to events before calculating the ME
 boostCalculator      = None   # name of python file containing code to estimate system recoil for each event
     
+if len( cachedir ) > 0:
+    # loaded and transformed grids are cached, s.t. later jobs skip the rebuild
+    if not os.path.isdir( cachedir ):
+        os.makedirs( cachedir )
+    import megrid # loads the megrid library
+    ROOT.megrid.set_cache_directory( cachedir )
+    log.info( 'caching ME grid(s) in [%s]'%( cachedir ) )
+
 log.info( 'start initializing ME grid(s)' )
 timer.Start()
 for module in cfgmodules:
@@ -324,6 +340,16 @@ if b <= 0:
 
 entries = range( a, b )
 
+#
+# the grid counters (see megrid::statistics) are taken per event, and either
+# appended to the extra branch (after the recoil, if any) in the order of 
+# megrid.stat_names, or summed into a histogram written at job end
+#
+
+stats_total = None
+if 'summary' in statsmode:
+    stats_total = dict( ( name, 0 ) for name in mehndl.stat_names )
+
 elist = None
 if selection != None and len(selection) > 0:
     itree.Draw( ">>entrylist", selection )
@@ -461,6 +487,9 @@ for ientry in entries:
     # start integrating the ME calculation
     # ------------------------------------------------------------------------
     
+    if len( statsmode ) > 0:
+        mehndl.reset_stats( )
+    
     timer.Start( )
 
     result['me'] = mehndl( [measured_lp, measured_lm], measured_jets, measured_met, measured_recoil )
@@ -469,6 +498,16 @@ for ientry in entries:
     timer.Stop( )
     
     result['time'] = timer.CpuTime()
+
+    if len( statsmode ) > 0:
+        stats = mehndl.stats( )
+        log.debug( 'ME grid counters: %s'%( str(stats) ) )
+        if 'extra' in statsmode:
+            for name in mehndl.stat_names:
+                me_extra.push_back( stats[name] )
+        if stats_total != None:
+            for name in mehndl.stat_names:
+                stats_total[name] += stats[name]
     
     log.info( 'ME result:', result )
     
@@ -505,6 +544,16 @@ if append:
         clone.Write( )
 
 otree.Write( )
+
+if stats_total != None:
+    ofile.cd( )
+    hstats = ROOT.TH1D( 'stats_%s'%( otreename ), 'ME grid counters', len( mehndl.stat_names ), 0, len( mehndl.stat_names ) )
+    for ibin, name in enumerate( mehndl.stat_names ):
+        hstats.GetXaxis().SetBinLabel( ibin + 1, name )
+        hstats.SetBinContent( ibin + 1, stats_total[name] )
+        log.info( 'ME grid counter [%s] = %g'%( name, stats_total[name] ) )
+    hstats.Write( )
+
 ofile.Close( )
 
 if update:
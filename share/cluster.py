@@ -19,6 +19,12 @@
 # perform clustering on subsets of the grids and combine results
 # such that the global clustering is ~ equivalent to the sum of clustered subsets
 #
+# mini-batch k-means (--algorithm=minibatch) scales to whole grids; it updates
+# the clusters from --batch random grid points at a time, for --iterations batches
+#
+# hierarchical clustering of reciprocal nearest neighbours (--algorithm=rnn) also
+# runs on whole grids, in memory linear in the grid size (no --min/--max chunks)
+#
 
 import ROOT
 
@@ -35,6 +41,7 @@ from megrid import transform
 def usage():
     print 'USAGE: cluster [-v,--verbose] --input=/path/to/file:tree --output=/path/to/file:tree'
     print '                              --nclusters=N --coords=A:B:C --min=N --max=N [--algorithm=KMEANS]'
+    print '                              [--batch=N --iterations=N --threads=N]'
     sys.exit( -1 )
 
 def normalize( s ):
@@ -54,6 +61,9 @@ try:
                                  'min=',
                                  'max=',
                                  'algorithm=',
+                                 'batch=',
+                                 'iterations=',
+                                 'threads=',
                                  'coords='] )
 except getopt.GetoptError, error:
     print str( error )
@@ -68,6 +78,9 @@ alg       = None
 method    = None
 imin      = -1
 imax      = -1
+batch     = None
+niter     = None
+nthreads  = 1
 
 for o, a in opts:
     if o in ( '-v', '--verbose' ):
@@ -82,6 +95,12 @@ for o, a in opts:
         imin = int( a )
     elif o in ( '--max' ):
         imax = int( a )
+    elif o in ( '--batch' ):
+        batch = int( a )
+    elif o in ( '--iterations' ):
+        niter = int( a )
+    elif o in ( '--threads' ):
+        nthreads = int( a )
     elif o in ( '-c', '--coords' ):
         coords = a
     elif o in ( '-a', '--algorithm' ):
@@ -91,6 +110,12 @@ for o, a in opts:
         if a.lower() in [ 'tree', 'hierarchical' ]:
             alg = megrid.HIERARCHICAL
             method = 'a'
+        if a.lower() in [ 'rnn', 'hierarchical_rnn' ]:
+            alg = megrid.HIERARCHICAL_RNN
+            method = 'a'
+        if a.lower() in [ 'minibatch', 'minibatch_kmeans' ]:
+            alg = megrid.MINIBATCH_KMEANS
+            method = 'a'
     else:
         usage()
 
@@ -119,6 +144,11 @@ if imin < 0:
 ihndl.Close()
 
 grid = megrid( 'grid', ifilen, itreen, coords, '(Entry$ >= %d)&&(Entry$ < %d)'%( imin, imax ), abs(imax-imin) )
+grid.set_nthreads( nthreads )
+if batch != None:
+    grid.set_cluster_batch_size( batch )
+if niter != None:
+    grid.set_cluster_iterations( niter )
 grid.cluster( alg, nclusters, method, 'e' )
 grid.store( ofilen, otreen, normalize(coords) )
 
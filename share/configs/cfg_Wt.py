@@ -32,14 +32,15 @@ mehndl.set_option_pdf( megrid.AGF )
 
 # scale and normalize the grid axes
 scale_tfm = transform.scale_fixed( array('f', [1.0/GeV for idim in xrange( ndim )]), ndim )
-mehndl.apply_transformation( scale_tfm, False ) # convert grid to units of GeV
+mehndl.queue_transformation( scale_tfm, False ) # convert grid to units of GeV
 
 norm_tfm = transform.norm_gauss( ndim  )
-mehndl.apply_transformation( norm_tfm )
+mehndl.queue_transformation( norm_tfm )
 
 # rotate away one of the azimuthal degrees of freedom
 rotate_tfm = transform.rotate_phi( 'X0:Y0:Z0:X1:Y1:Z1:X2:Y2:Z2:X3:Y3:Z3' )
-mehndl.apply_transformation( rotate_tfm )
+mehndl.queue_transformation( rotate_tfm )
+mehndl.apply_transformations() # fused into as few passes over the grid as possible
 
 # no recoil calculation
 boostCalculator = None
@@ -36,10 +36,11 @@ gb_grid = lvlvjj( 'tT_gb', '/global/dschouten/grids/outputs/merged/tT/pythia/tT_
 gg_grid = lvlvjj( 'tT_gb', '/global/dschouten/grids/outputs/merged/tT/pythia/tT_gg.root', 'grid', coords, max_size=-1 )
 
 mehndl = lvlvjj( 'tT', ndim=len(coords.split('|')) )
-mehndl += bg_grid
-mehndl += gb_grid
-mehndl += gg_grid
-mehndl += bb_grid
+# the storage of each grid is moved, not copied, so the points are never held twice
+mehndl.move_grid( bg_grid )
+mehndl.move_grid( gb_grid )
+mehndl.move_grid( gg_grid )
+mehndl.move_grid( bb_grid )
 
 del bg_grid
 del gb_grid
@@ -59,14 +60,15 @@ mehndl.set_option_pdf( megrid.AGF )
 
 # scale and normalize the grid axes
 scale_tfm = transform.scale_fixed( array('f', [1.0/GeV for idim in xrange( ndim )]), ndim )
-mehndl.apply_transformation( scale_tfm, False ) # convert grid to units of GeV
+mehndl.queue_transformation( scale_tfm, False ) # convert grid to units of GeV
 
 norm_tfm = transform.norm_gauss( ndim  )
-mehndl.apply_transformation( norm_tfm )
+mehndl.queue_transformation( norm_tfm )
 
 # rotate away one of the azimuthal degrees of freedom
 rotate_tfm = transform.rotate_phi( 'X0:Y0:Z0:X1:Y1:Z1:X2:Y2:Z2:X3:Y3:Z3' )
-mehndl.apply_transformation( rotate_tfm )
+mehndl.queue_transformation( rotate_tfm )
+mehndl.apply_transformations() # fused into as few passes over the grid as possible
 
 # no recoil calculation
 boostCalculator = None
@@ -9,29 +9,68 @@ gSystem.Load( 'libTMVA' )
 gSystem.Load( 'libmegrid' )
 gSystem.Load( 'libmegrid_dict' )
 
-transform = ROOT.transform
-megrid    = ROOT.megrid
+transform  = ROOT.transform
+megrid     = ROOT.megrid
+megrid_set = ROOT.megrid_set
 
 class megrid( ROOT.megrid ):
     __valid_objects = [ 'leadj', 'subleadj', 'lp', 'lm', 'recoil', 'met' ]
     __valid_attrs   = [ 'X()', 'Y()', 'Z()', 'Px()', 'Py()', 'Pz()' ]
+
+    # see megrid::statistics
+    stat_names = [ 'nqueries', 'niterations', 'nexpansions', 'ncache_hits', 'ncache_misses', 't_transform', 't_scan', 't_select', 't_optimize' ]
     
-    def __init__( self, name, gridfile_pattern=None, tree_name=None, coord_definition=None, weights_expression='', max_size=-1, ndim=-1 ):
-        if( gridfile_pattern != None ):
+    def __init__( self, name, gridfile_pattern=None, tree_name=None, coord_definition=None, weights_expression='', max_size=-1, ndim=-1, precision=ROOT.megrid.SINGLE ):
+        if( gridfile_pattern != None and tree_name == None and coord_definition == None ):
+            # binary grid file written with megrid.save
+            ROOT.megrid.__init__( self, name, gridfile_pattern )
+        elif( gridfile_pattern != None ):
             if not ( tree_name != None and \
                      coord_definition != None ):
                 raise RuntimeError
-            ROOT.megrid.__init__( self, name, gridfile_pattern, tree_name, coord_definition, weights_expression, max_size )
+            ROOT.megrid.__init__( self, name, gridfile_pattern, tree_name, coord_definition, weights_expression, max_size, precision )
         else:
             if ndim == 0:
                 raise RuntimeError
-            ROOT.megrid.__init__( self, name, ndim )
+            ROOT.megrid.__init__( self, name, ndim, precision )
         self._exprs = []
         pass
 
     def __call__( self, leptons, jets, met, recoil ):
+        return self.pdf( *self.coordinates( leptons, jets, met, recoil ) )
+
+    def coordinates( self, leptons, jets, met, recoil ):
         raise NotImplementedError
 
+    def pdf_batch( self, points ):
+        # evaluate the pdf for an (M x ndim) array of test points in one call
+        import numpy
+        points = numpy.ascontiguousarray( points, dtype=numpy.float32 )
+        if points.ndim == 1:
+            points = points.reshape( 1, -1 )
+        if points.ndim != 2 or points.shape[1] != self.get_ndim_effective():
+            raise RuntimeError
+        result = numpy.empty( points.shape[0], dtype=numpy.float32 )
+        ROOT.megrid.pdf_batch( self, points.ravel(), points.shape[0], result )
+        return result
+
+    def progressive( self, leptons, jets, met, recoil, tolerance, budget=0 ):
+        # coarse-to-fine estimate, returns ( pdf, estimated relative error, pyramid level )
+        point = ROOT.std.vector('float')()
+        for x in self.coordinates( leptons, jets, met, recoil ):
+            point.push_back( x )
+        pdf = self.pdf_progressive( point, tolerance, budget )
+        return ( pdf, self.get_progressive_error(), self.get_progressive_level() )
+
+    def batch( self, events ):
+        # evaluate the pdf for a list of ( leptons, jets, met, recoil ) tuples
+        return self.pdf_batch( [ self.coordinates( *event ) for event in events ] )
+
+    def stats( self ):
+        # counters accumulated over the pdf calculations since the last reset_stats
+        s = self.get_stats()
+        return dict( ( name, getattr( s, name ) ) for name in self.stat_names )
+
     def set_expressions( self, exprs ):
         for expr in exprs:
             if sum( [ expr.count( obj ) for obj in self.__valid_objects ] ) == 0 or \
@@ -41,8 +80,8 @@ class megrid( ROOT.megrid ):
         pass
 
 class lvlv( megrid ):
-    def __init__( self, name, gridfile_pattern=None, tree_name=None, coord_definition=None, weights_expression='', max_size=-1, ndim=-1 ):
-        megrid.__init__( self, name, gridfile_pattern, tree_name, coord_definition, weights_expression, max_size, ndim )
+    def __init__( self, name, gridfile_pattern=None, tree_name=None, coord_definition=None, weights_expression='', max_size=-1, ndim=-1, precision=ROOT.megrid.SINGLE ):
+        megrid.__init__( self, name, gridfile_pattern, tree_name, coord_definition, weights_expression, max_size, ndim, precision )
         pass
 
     def _parse_leptons( self, leptons ):
@@ -56,30 +95,53 @@ class lvlv( megrid ):
             lp, lm = lm, lp
         return lp, lm
     
-    def __call__( self, leptons, jets, met, recoil ):
+    def coordinates( self, leptons, jets, met, recoil ):
         lp, lm = self._parse_leptons( leptons )
-        args = [ eval(expr) for expr in self._exprs ]
-        return self.pdf( *args )
+        return [ eval(expr) for expr in self._exprs ]
 
 class lvlvj( lvlv ):
-    def __init__( self, name, gridfile_pattern=None, tree_name=None, coord_definition=None, weights_expression='', max_size=-1, ndim=-1 ):
-        lvlv.__init__( self, name, gridfile_pattern, tree_name, coord_definition, weights_expression, max_size, ndim )
+    def __init__( self, name, gridfile_pattern=None, tree_name=None, coord_definition=None, weights_expression='', max_size=-1, ndim=-1, precision=ROOT.megrid.SINGLE ):
+        lvlv.__init__( self, name, gridfile_pattern, tree_name, coord_definition, weights_expression, max_size, ndim, precision )
         pass
 
-    def __call__( self, leptons, jets, met, recoil ):
+    def coordinates( self, leptons, jets, met, recoil ):
         lp, lm = self._parse_leptons( leptons )
         leadj = jets[0]
-        args = [ eval(expr) for expr in self._exprs ]
-        return self.pdf( *args )
+        return [ eval(expr) for expr in self._exprs ]
 
 class lvlvjj( lvlv ):
-    def __init__( self, name, gridfile_pattern=None, tree_name=None, coord_definition=None, weights_expression='', max_size=-1, ndim=-1 ):
-        lvlv.__init__( self, name, gridfile_pattern, tree_name, coord_definition, weights_expression, max_size, ndim )
+    def __init__( self, name, gridfile_pattern=None, tree_name=None, coord_definition=None, weights_expression='', max_size=-1, ndim=-1, precision=ROOT.megrid.SINGLE ):
+        lvlv.__init__( self, name, gridfile_pattern, tree_name, coord_definition, weights_expression, max_size, ndim, precision )
         pass
 
-    def __call__( self, leptons, jets, met, recoil ):
+    def coordinates( self, leptons, jets, met, recoil ):
         lp, lm = self._parse_leptons( leptons )
         leadj = jets[0]
         subleadj = jets[1]
-        args = [ eval(expr) for expr in self._exprs ]
-        return self.pdf( *args )
+        return [ eval(expr) for expr in self._exprs ]
+
+class megrid_set( ROOT.megrid_set ):
+    def __init__( self, name, grids=[] ):
+        ROOT.megrid_set.__init__( self, name )
+        self._grids = [] # keeps the grids alive as long as the set
+        for grid in grids:
+            self.add( grid )
+        pass
+
+    def add( self, grid ):
+        if not self.add_grid( grid ):
+            raise RuntimeError
+        self._grids.append( grid )
+
+    def __call__( self, leptons, jets, met, recoil ):
+        # densities of all grids, with the coordinates defined by the first grid
+        return list( self.pdf( self._point( leptons, jets, met, recoil ) ) )
+
+    def ratios( self, leptons, jets, met, recoil, iref=0 ):
+        return list( self.likelihood_ratios( self._point( leptons, jets, met, recoil ), iref ) )
+
+    def _point( self, leptons, jets, met, recoil ):
+        point = ROOT.std.vector('float')()
+        for x in self._grids[0].coordinates( leptons, jets, met, recoil ):
+            point.push_back( x )
+        return point
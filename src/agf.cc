@@ -9,9 +9,14 @@
 #include <string>
 #include <cmath>
 #include <iterator>
+#include <vector>
 
 #include <gsl/gsl_sf_gamma.h>
 
+#ifdef __SSE2__
+#include <emmintrin.h>
+#endif
+
 #include "agf.hh"
 #include "logger.hh"
 #include "numerical.hh"
@@ -35,6 +40,7 @@ namespace agf
   real_t      configuration::MINFILTERW		= 1.0e-3;
   real_t      configuration::MAXFILTERW		= 1.0e+3;
   integer_t   configuration::KMIN               = 10;
+  integer_t   configuration::_SOLVER_MAXITER    = 30;
   
   template <typename FLOAT_T>
   void deltaw( FLOAT_T var, void* param, FLOAT_T* wdiff, FLOAT_T* dWdv )
@@ -76,7 +82,8 @@ namespace agf
 		      FLOAT_T varhi,  
 		      FLOAT_T* weight, // returned weights
 		      FLOAT_T& var_f,  // returned final filter variance
-		      FLOAT_T* clwts ) // point weights    
+		      FLOAT_T* clwts,  // point weights    
+		      integer_t* nmoved ) // returned number of times the bracket was moved
   {
     long niter; // number of iterations to find optimal filter width
     long nmov;  // number of times bracket has been moved
@@ -98,7 +105,7 @@ namespace agf
       if (wlo <= Wc) break;
       if (varlo <= configuration::MINFILTERW ) break;
       varlo = varlo/2;
-      logger::log() << msg::WARN << "agf::optimize: lower bracket decreased to " << varlo;
+      LOG_WARN_LIMITED( "agf::optimize: lower bracket decreased to " << varlo );
     }
     for ( ; nmov<configuration::_WEIGHTS_MAXITER; ++nmov )
     {
@@ -106,11 +113,16 @@ namespace agf
       if (whi >= Wc) break;
       if (varhi >= configuration::MAXFILTERW ) break;
       varhi = varhi*2;
-      logger::log() << msg::WARN << "agf::optimize: upper bracket increased to " << varhi;
+      LOG_WARN_LIMITED( "agf::optimize: upper bracket increased to " << varhi );
     }
     
     // fprintf( stderr, "whi = %g, Wc = %g, wlo = %g", whi, Wc, wlo );
     
+    if( nmoved != NULL )
+    {
+      *nmoved = nmov;
+    }
+    
     if( wlo > Wc || whi < Wc )
     {
       logger::log() << msg::ERROR << "agf::optimize: failed to bracket root";
@@ -129,6 +141,383 @@ namespace agf
     return niter+nmov;
   }
   
+  ////////////////////////////////////////////////////////////////////////////////
+  //
+  // y_{i} = exp(x_{i}) for i < n (in place if x == y)
+  //
+  template <typename FLOAT_T>
+  void vexp( const FLOAT_T* x, FLOAT_T* y, integer_t n )
+  {
+    for( integer_t i=0; i<n; ++i )
+    {
+      y[i] = std::exp(x[i]);
+    }
+  }
+  
+#ifdef __SSE2__
+  //
+  // single precision version, 4 values at a time: exp(x) = 2^{n} exp(r) with 
+  // r = x - n ln(2) in [-ln(2)/2, ln(2)/2], and exp(r) from the Cephes polynomial
+  // (relative error ~1e-7, arguments below -87 give ~1e-38 rather than 0)
+  //
+  template <>
+  void vexp<float>( const float* x, float* y, integer_t n )
+  {
+    const __m128 xmax = _mm_set1_ps( 88.3762626647949f );
+    const __m128 xmin = _mm_set1_ps( -87.3365447504019f );
+    const __m128 log2e = _mm_set1_ps( 1.44269504088896341f );
+    const __m128 c1 = _mm_set1_ps( 0.693359375f );
+    const __m128 c2 = _mm_set1_ps( -2.12194440e-4f );
+    const __m128 half = _mm_set1_ps( 0.5f );
+    const __m128 one = _mm_set1_ps( 1.0f );
+    
+    integer_t i=0;
+    for( ; i+4<=n; i+=4 )
+    {
+      __m128 v = _mm_min_ps( _mm_max_ps( _mm_loadu_ps(x + i), xmin ), xmax );
+      
+      // n = floor(x log2(e) + 1/2)
+      __m128 fx = _mm_add_ps( _mm_mul_ps( v, log2e ), half );
+      __m128 tx = _mm_cvtepi32_ps( _mm_cvttps_epi32(fx) );
+      fx = _mm_sub_ps( tx, _mm_and_ps( _mm_cmpgt_ps(tx, fx), one ) );
+      
+      v = _mm_sub_ps( _mm_sub_ps( v, _mm_mul_ps(fx, c1) ), _mm_mul_ps(fx, c2) );
+      __m128 z = _mm_mul_ps( v, v );
+      
+      __m128 p = _mm_set1_ps( 1.9875691500e-4f );
+      p = _mm_add_ps( _mm_mul_ps(p, v), _mm_set1_ps(1.3981999507e-3f) );
+      p = _mm_add_ps( _mm_mul_ps(p, v), _mm_set1_ps(8.3334519073e-3f) );
+      p = _mm_add_ps( _mm_mul_ps(p, v), _mm_set1_ps(4.1665795894e-2f) );
+      p = _mm_add_ps( _mm_mul_ps(p, v), _mm_set1_ps(1.6666665459e-1f) );
+      p = _mm_add_ps( _mm_mul_ps(p, v), _mm_set1_ps(5.0000001201e-1f) );
+      p = _mm_add_ps( _mm_add_ps( _mm_mul_ps(p, z), v ), one );
+      
+      // scale by 2^{n}, built directly in the exponent bits
+      __m128i e = _mm_slli_epi32( _mm_add_epi32( _mm_cvttps_epi32(fx), _mm_set1_epi32(127) ), 23 );
+      _mm_storeu_ps( y + i, _mm_mul_ps( p, _mm_castsi128_ps(e) ) );
+    }
+    for( ; i<n; ++i )
+    {
+      y[i] = std::exp(x[i]);
+    }
+  }
+#endif
+  
+  ////////////////////////////////////////////////////////////////////////////////
+  //
+  // the total weight W(var) = sum_{i} w_{i} exp(-d_{i}/2var) and its derivative,
+  // filling the weights of each neighbour
+  //
+  template <typename FLOAT_T>
+  void total_weight( FLOAT_T var, const FLOAT_T* dsqr, const FLOAT_T* clwts, integer_t k, 
+		     FLOAT_T* wts, double& W, double& dWdv )
+  {
+    FLOAT_T scale = -0.5 / var;
+    for( integer_t i=0; i<k; ++i )
+    {
+      wts[i] = dsqr[i] * scale;
+    }
+    vexp<FLOAT_T>( wts, wts, k );
+    
+    double sumwd = 0;
+    W = 0;
+    for( integer_t i=0; i<k; ++i )
+    {
+      wts[i] *= clwts[i];
+      W += wts[i];
+      sumwd += dsqr[i] * wts[i];
+    }
+    dWdv = sumwd / var / var / 2;
+  }
+  
+  ////////////////////////////////////////////////////////////////////////////////
+  
+  template <typename FLOAT_T>
+  integer_t optimize_bracketed( FLOAT_T* dsqr,   // distances squared (ascending)
+				integer_t npts,  // number of distances
+				FLOAT_T Wc,      // objective total weight
+				FLOAT_T* weight, // returned weights
+				FLOAT_T& var_f,  // returned final filter variance
+				FLOAT_T* clwts ) // point weights    
+  {
+    //
+    // with S_{i} the summed weight of the i nearest neighbours & C the total, for any i
+    //
+    //  W(var) <= S_{i} + (C - S_{i}) exp(-d_{i}/2var)  (the others are no closer than d_{i})
+    //  W(var) >= S_{i+1} exp(-d_{i}/2var)             (the first i+1 are no further than d_{i})
+    //
+    // so each i gives a lower (upper) bound on the variance if S_{i} < W_{c} (S_{i+1} > W_{c});
+    // the bounds are only evaluated for i close to the crossing S_{i} ~ W_{c} and 
+    // at geometrically spaced i beyond it, which is where the tightest bounds lie
+    //
+    double C = 0;
+    for( integer_t i=0; i<npts; ++i )
+    {
+      C += clwts[i];
+    }
+    
+    double varlo = 0;
+    double varhi = -1;
+    double S = 0;
+    integer_t inext = 0; // next index at which the bounds are evaluated
+    for( integer_t i=0; i<npts; ++i )
+    {
+      bool crossing = (S < Wc && S + clwts[i] >= Wc);
+      if( crossing || i == inext || i == npts - 1 )
+      {
+	if( S < Wc && dsqr[i] > 0 )
+	{
+	  varlo = std::max( varlo, dsqr[i] / (2 * std::log( (C - S) / (Wc - S) )) );
+	}
+	if( S + clwts[i] > Wc )
+	{
+	  double v = dsqr[i] / (2 * std::log( (S + clwts[i]) / Wc ));
+	  varhi = (varhi < 0 ? v : std::min( varhi, v ));
+	}
+	if( crossing || i == inext )
+	{
+	  inext = i + std::max( (integer_t)1, i / 8 );
+	}
+      }
+      S += clwts[i];
+    }
+    
+    double W, dWdv;
+    
+    if( !(C > Wc) || !(varhi > 0) )
+    {
+      //
+      // the total weight is reached at no (or any) filter width 
+      //
+      var_f = (varhi > 0 ? varhi : configuration::MINFILTERW);
+      total_weight<FLOAT_T>( var_f, dsqr, clwts, npts, weight, W, dWdv );
+      logger::log() << msg::ERROR << "agf::optimize_bracketed: no filter width gives W=" << Wc << " (total weight is " << C << ")";
+      return -1;
+    }
+    varlo = std::min( varlo, varhi );
+    
+    //
+    // Newton iterations in t = ln(var), where W is close to linear, falling back to 
+    // bisection whenever a step leaves the bracket
+    //
+    double tlo = std::log( std::max( varlo, varhi * 1e-12 ) );
+    double thi = std::log( varhi );
+    double t = (tlo + thi) / 2;
+    
+    integer_t niter = 0;
+    while( true )
+    {
+      ++niter;
+      double var = std::exp( t );
+      total_weight<FLOAT_T>( (FLOAT_T)var, dsqr, clwts, npts, weight, W, dWdv );
+      var_f = var;
+      
+      double f = W - Wc;
+      if( std::fabs(f) < configuration::_WEIGHTS_TOL || thi - tlo < 1e-6 )
+      {
+	break;
+      }
+      if( niter >= configuration::_SOLVER_MAXITER )
+      {
+	LOG_WARN_LIMITED( "agf::optimize_bracketed: maximum number of iterations reached, |W-Wc|=" << std::fabs(f) );
+	break;
+      }
+      
+      if( f > 0 )
+	thi = t;
+      else
+	tlo = t;
+      
+      double dfdt = dWdv * var;
+      double tn = (dfdt > 0 ? t - f / dfdt : thi + 1);
+      t = (tn > tlo && tn < thi ? tn : (tlo + thi) / 2);
+    }
+    
+    return niter;
+  }
+  
+  ////////////////////////////////////////////////////////////////////////////////
+  //
+  // access to the grid points stored as an array of pointers to rows
+  //
+  template <typename FLOAT_T>
+  class row_table
+  {
+  public:
+    row_table( FLOAT_T** grid ) : _grid( grid ) { }
+    const FLOAT_T* operator()( integer_t ipt ) const { return _grid[ipt]; }
+  private:
+    FLOAT_T** _grid;
+  };
+  
+  //
+  // access to the grid points stored row-by-row in one contiguous block
+  //
+  template <typename STORAGE_T>
+  class packed_rows
+  {
+  public:
+    packed_rows( const STORAGE_T* grid, integer_t ndim ) : _grid( grid ), _ndim( ndim ) { }
+    const STORAGE_T* operator()( integer_t ipt ) const { return _grid + (size_t)ipt * _ndim; }
+  private:
+    const STORAGE_T* _grid;
+    integer_t _ndim;
+  };
+  
+  ////////////////////////////////////////////////////////////////////////////////
+  //
+  // find the k nearest neighbours of a test point by brute-force search over 
+  // all grid points
+  //
+  // knearest and clwtnearest are filled with the distances squared and the 
+  // weights of the neighbours, ordered by ascending distance
+  //
+  // with nthreads > 1 the grid is split into contiguous chunks, the k nearest 
+  // are selected in each chunk in parallel, and the partial lists are merged;
+  // neighbours are ordered by (distance, weight) s.t. the result is identical 
+  // to the single-threaded scan
+  //
+  // if diag is not NULL, the time spent in the scan (including the selection
+  // within each chunk) and in the final selection is filled
+  //
+  template <typename FLOAT_T, typename ROWS_T>
+  void scan( const ROWS_T& grid, 
+	     FLOAT_T* clwts, 
+	     integer_t ndim, 
+	     integer_t npts, 
+	     FLOAT_T* vec, 
+	     integer_t k, 
+	     FLOAT_T* knearest, 
+	     FLOAT_T* clwtnearest,
+	     integer_t nthreads,
+	     std::pair<FLOAT_T, FLOAT_T>* buffer,
+	     diagnostics* diag )
+  {
+    k = std::min( k, npts );
+    
+    double t0 = (diag != NULL ? wall_time() : 0);
+    
+    std::vector< std::pair<FLOAT_T, FLOAT_T> > local_buffer;
+    if( buffer == NULL )
+    {
+      local_buffer.resize( npts );
+      buffer = &(local_buffer[0]);
+    }
+    
+    std::pair<FLOAT_T, FLOAT_T>* dsqr = buffer;	// distances squared & weights
+    integer_t ndsqr = npts;			// number of candidate neighbours in dsqr
+    
+    if( nthreads <= 1 || npts < 2 * nthreads * k )
+    {
+      for( integer_t i=0; i<npts; ++i ) 
+      {
+	dsqr[i] = std::pair<FLOAT_T,FLOAT_T>( metric(vec, grid(i), ndim), clwts[i] );
+      }
+    }
+    else
+    {
+#pragma omp parallel for num_threads(nthreads) schedule(static, 1)
+      for( integer_t ichunk=0; ichunk<nthreads; ++ichunk )
+      {
+	integer_t begin = (integer_t)(((long long)npts * ichunk) / nthreads);
+	integer_t end   = (integer_t)(((long long)npts * (ichunk+1)) / nthreads);
+	
+	for( integer_t i=begin; i<end; ++i ) 
+	{
+	  dsqr[i] = std::pair<FLOAT_T,FLOAT_T>( metric(vec, grid(i), ndim), clwts[i] );
+	}
+	std::partial_sort( dsqr + begin, dsqr + begin + k, dsqr + end ); 
+      }
+      
+      //
+      // gather the k nearest of each chunk at the front of the buffer (each 
+      // chunk holds at least 2k points, so the destination never overtakes the source)
+      //
+      for( integer_t ichunk=1; ichunk<nthreads; ++ichunk )
+      {
+	integer_t begin = (integer_t)(((long long)npts * ichunk) / nthreads);
+	std::copy( dsqr + begin, dsqr + begin + k, dsqr + ichunk * k );
+      }
+      ndsqr = nthreads * k;
+    }
+    
+    double t1 = (diag != NULL ? wall_time() : 0);
+    
+    std::partial_sort( dsqr, dsqr + k, dsqr + ndsqr ); 
+    
+    for( integer_t i=0; i<k; ++i )
+    {
+      knearest[i] = dsqr[i].first;
+      clwtnearest[i] = dsqr[i].second;
+    }
+    
+    if( diag != NULL )
+    {
+      diag->t_scan = t1 - t0;
+      diag->t_select = wall_time() - t1;
+    }
+  }
+  
+  ////////////////////////////////////////////////////////////////////////////////
+  
+  template <typename FLOAT_T>
+  void nearest( FLOAT_T** grid, 
+		FLOAT_T* clwts, 
+		integer_t ndim, 
+		integer_t npts, 
+		FLOAT_T* vec, 
+		integer_t k, 
+		FLOAT_T* knearest, 
+		FLOAT_T* clwtnearest,
+		integer_t nthreads,
+		std::pair<FLOAT_T, FLOAT_T>* buffer,
+		diagnostics* diag )
+  {
+    scan( row_table<FLOAT_T>( grid ), clwts, ndim, npts, vec, k, knearest, clwtnearest, nthreads, buffer, diag );
+  }
+  
+  ////////////////////////////////////////////////////////////////////////////////
+  
+  template <typename FLOAT_T>
+  void nearest( const half* grid, 
+		FLOAT_T* clwts, 
+		integer_t ndim, 
+		integer_t npts, 
+		FLOAT_T* vec, 
+		integer_t k, 
+		FLOAT_T* knearest, 
+		FLOAT_T* clwtnearest,
+		integer_t nthreads,
+		std::pair<FLOAT_T, FLOAT_T>* buffer,
+		diagnostics* diag )
+  {
+    scan( packed_rows<half>( grid, ndim ), clwts, ndim, npts, vec, k, knearest, clwtnearest, nthreads, buffer, diag );
+  }
+  
+  template void nearest<real_t>( real_t** grid, 
+				 real_t* clwts, 
+				 integer_t ndim, 
+				 integer_t npts, 
+				 real_t* vec, 
+				 integer_t k, 
+				 real_t* knearest, 
+				 real_t* clwtnearest,
+				 integer_t nthreads,
+				 std::pair<real_t, real_t>* buffer,
+				 diagnostics* diag );
+  
+  template void nearest<real_t>( const half* grid, 
+				 real_t* clwts, 
+				 integer_t ndim, 
+				 integer_t npts, 
+				 real_t* vec, 
+				 integer_t k, 
+				 real_t* knearest, 
+				 real_t* clwtnearest,
+				 integer_t nthreads,
+				 std::pair<real_t, real_t>* buffer,
+				 diagnostics* diag );
+  
   namespace pdf 
   {
     
@@ -154,42 +543,69 @@ namespace agf
 		      FLOAT_T varhi, 
 		      integer_t k, 
 		      FLOAT_T Wc, 
-		      diagnostics* diag_param )
+		      diagnostics* diag_param,
+		      integer_t nthreads )
+    {
+      FLOAT_T pdf;		// final calculated value of pdf
+      
+      k = std::min( k, npts );
+      
+      std::vector<FLOAT_T> knearest( k );	// distances of k nearest neighbours
+      std::vector<FLOAT_T> clwtnearest( k );	// cluster/point weights of k nearest neighbours
+      
+      nearest( grid, clwts, ndim, npts, vec, k, &(knearest[0]), &(clwtnearest[0]), nthreads );
+      
+      pdf = adaptive( &(knearest[0]), &(clwtnearest[0]), ndim, npts, varlo, varhi, k, Wc, diag_param );
+      
+      return pdf;
+    }
+    
+    ////////////////////////////////////////////////////////////////////////////////
+    //
+    // estimates the pdf at a test point from its k nearest neighbours 
+    //
+    // knearest    : the distances squared of the k nearest neighbours (ascending)
+    // clwtnearest : the weights of the k nearest neighbours
+    // npts        : the total number of grid points
+    //
+    // returns the esimated pdf using the adaptive Gaussian filter technique
+    //
+    template <typename FLOAT_T>
+    FLOAT_T adaptive( FLOAT_T* knearest, 
+		      FLOAT_T* clwtnearest, 
+		      integer_t ndim, 
+		      integer_t npts, 
+		      FLOAT_T varlo, 
+		      FLOAT_T varhi, 
+		      integer_t k, 
+		      FLOAT_T Wc, 
+		      diagnostics* diag_param,
+		      FLOAT_T* weight,
+		      solver_type solver )
     {
       FLOAT_T var_f;		// final value of the filter width (as variance)
       FLOAT_T totw;		// total weight
-      FLOAT_T* knearest;	// distances of k nearest neighbours
-      FLOAT_T* clwtnearest;     // cluster/point weights of k nearest neighbours
-      FLOAT_T* weight;		// the current value for the weights
       FLOAT_T scale, norm;	// normalisation coeff.
       FLOAT_T pdf;		// final calculated value of pdf
       
-      // first we calculate all the distances:
-      std::vector< std::pair<FLOAT_T, FLOAT_T> > dsqr;
-      
-      for( integer_t i=0; i<npts; ++i ) 
+      std::vector<FLOAT_T> local_weight; // the current value for the weights (if not provided)
+      if( weight == NULL )
       {
-	dsqr.push_back( std::pair<FLOAT_T,FLOAT_T>( metric(vec, grid[i], ndim), clwts[i] ) );
+	local_weight.resize( k );
+	weight = &(local_weight[0]);
       }
       
-      knearest    = new FLOAT_T[k]; 
-      clwtnearest = new FLOAT_T[k];
+      // calculate the weights using the central "engine":
       
-      if( k < npts )
+      diag_param->nb = 0;
+      if( solver == BRACKETED )
       {
-	std::partial_sort( dsqr.begin(), dsqr.begin() + k, dsqr.end() ); 
+	diag_param->nd = optimize_bracketed(knearest, k, Wc, weight, var_f, clwtnearest);
       }
-
-      for( integer_t i=0; i<k; ++i )
+      else
       {
-	knearest[i] = dsqr[i].first;
-	clwtnearest[i] = dsqr[i].second;
+	diag_param->nd = optimize(knearest, k, Wc, varlo, varhi, weight, var_f, clwtnearest, &(diag_param->nb));
       }
-      
-      // calculate the weights using the central "engine":
-      
-      weight = new FLOAT_T[k];
-      diag_param->nd = optimize(knearest, k, Wc, varlo, varhi, weight, var_f, clwtnearest);
       totw = 0;
       for( integer_t i=0; i<k; ++i ) 
       {
@@ -216,10 +632,7 @@ namespace agf
       diag_param->f = weight[k-1]/weight[0];
       diag_param->W = totw;
       diag_param->V = var_f;
-      
-      delete [] knearest;
-      delete [] clwtnearest;
-      delete [] weight;
+      diag_param->dp = 0;
       
       return pdf;  
     }
@@ -233,7 +646,20 @@ namespace agf
 				      real_t varhi, 
 				      integer_t k, 
 				      real_t Wc, 
-				      diagnostics* diag_param );
+				      diagnostics* diag_param,
+				      integer_t nthreads );
+    
+    template real_t adaptive<real_t>( real_t* knearest,
+				      real_t* clwtnearest, 
+				      integer_t ndim, 
+				      integer_t n, 
+				      real_t varlo,
+				      real_t varhi, 
+				      integer_t k, 
+				      real_t Wc, 
+				      diagnostics* diag_param,
+				      real_t* weight,
+				      solver_type solver );
     
     ////////////////////////////////////////////////////////////////////////////////
     //
@@ -254,26 +680,14 @@ namespace agf
 		 integer_t npts,
 		 FLOAT_T* vec,
 		 integer_t k,
-		 const FLOAT_T* dimensions )
+		 const FLOAT_T* dimensions,
+		 integer_t nthreads )
     {
-      FLOAT_T* knearest;		// distances of k nearest neighbours
-      FLOAT_T* clwtnearest;             // cluster/point weights of k nearest neighbours
-      FLOAT_T pdf;			// final calculated value of pdf
-
-      long double totw;			// total weight
-      long double volume;               // volume of n-ball containing the k-nearest points
-      long double norm;                 // volume of entire grid
-
-      std::vector< std::pair<FLOAT_T, FLOAT_T> > dsqr; // weighted distances to all grid points
-
-      for( integer_t i=0; i<npts; ++i ) 
-      {
-	dsqr.push_back( std::pair<FLOAT_T,FLOAT_T>( metric(vec, grid[i], ndim), clwts[i] ) );
-      }
+      k = std::min( k, npts );
+      
+      std::vector<FLOAT_T> knearest( k );	// distances of k nearest neighbours
+      std::vector<FLOAT_T> clwtnearest( k );	// cluster/point weights of k nearest neighbours
       
-      knearest    = new FLOAT_T[k]; 
-      clwtnearest = new FLOAT_T[k];
-
       std::vector<FLOAT_T> ldim( ndim, 1 ); // length scale for each dimension
       if( dimensions == NULL )
       {
@@ -288,13 +702,33 @@ namespace agf
 	std::copy( dimensions, dimensions + ndim, ldim.begin() );
       }
       
-      std::partial_sort( dsqr.begin(), dsqr.begin() + k, dsqr.end() ); 
+      nearest( grid, clwts, ndim, npts, vec, k, &(knearest[0]), &(clwtnearest[0]), nthreads );
       
-      for( integer_t i=0; i<k; ++i )
-      {
-	knearest[i] = dsqr[i].first;
-	clwtnearest[i] = dsqr[i].second;
-      }
+      return knn( &(knearest[0]), &(clwtnearest[0]), ndim, k, &(ldim[0]) );
+    }
+    
+    ////////////////////////////////////////////////////////////////////////////////
+    //
+    // estimates the pdf at a test point from its k nearest neighbours
+    //
+    // knearest    : the distances squared of the k nearest neighbours (ascending)
+    // clwtnearest : the weights of the k nearest neighbours
+    // dimensions  : the length scale of each grid axis
+    //
+    // returns the esimated pdf using the k-nearest neighbours
+    //
+    template <typename FLOAT_T>
+    FLOAT_T knn( FLOAT_T* knearest,
+		 FLOAT_T* clwtnearest,
+		 integer_t ndim, 
+		 integer_t k,
+		 const FLOAT_T* dimensions )
+    {
+      FLOAT_T pdf;			// final calculated value of pdf
+
+      long double totw;			// total weight
+      long double volume;               // volume of n-ball containing the k-nearest points
+      long double norm;                 // volume of entire grid
       
       // calculate the weights of the k-nearest neighbours
       totw = 0.;
@@ -310,14 +744,11 @@ namespace agf
       for( integer_t i=0; i<ndim; ++i )
       {
 	volume *= std::sqrt(knearest[k-1]); // volume of the n-ball containing nearest neighbours
-	norm *= ldim[i]; // total volume of grid
+	norm *= dimensions[i]; // total volume of grid
       }
             
       pdf = (FLOAT_T)(totw/volume/norm);
       
-      delete [] knearest;
-      delete [] clwtnearest;
-      
       return pdf;  
     }
     
@@ -327,6 +758,13 @@ namespace agf
 				 integer_t n, 
 				 real_t *vec, 
 				 integer_t k, 
+				 const real_t* dimensions,
+				 integer_t nthreads );
+    
+    template real_t knn<real_t>( real_t* knearest, 
+				 real_t* clwtnearest, 
+				 integer_t ndim, 
+				 integer_t k, 
 				 const real_t* dimensions );
   }
   
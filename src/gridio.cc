@@ -0,0 +1,256 @@
+#include "gridio.hh"
+#include "logger.hh"
+
+#include <cstring>
+#include <cstdio>
+#include <fstream>
+#include <sstream>
+#include <iomanip>
+#include <vector>
+
+#include <fcntl.h>
+#include <unistd.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+
+using std::string;
+
+namespace
+{
+  //
+  // round offset up to a multiple of alignment
+  //
+  uint64_t align(uint64_t offset, uint64_t alignment)
+  {
+    return ((offset + alignment - 1) / alignment) * alignment;
+  }
+
+  //
+  // check that the block [offset, offset+size) lies within a file of length file_size
+  //
+  bool in_file(uint64_t offset, uint64_t size, uint64_t file_size)
+  {
+    return offset <= file_size && size <= file_size - offset;
+  }
+}
+
+//////////////////////////////////////////////////////////////////////
+
+gridio::mapped_file::mapped_file() :
+  _addr(NULL),
+  _size(0)
+{
+
+}
+
+//////////////////////////////////////////////////////////////////////
+
+gridio::mapped_file::~mapped_file()
+{
+  close();
+}
+
+//////////////////////////////////////////////////////////////////////
+
+bool gridio::mapped_file::open(const string& file_name)
+{
+  close();
+
+  int fd = ::open(file_name.c_str(), O_RDONLY);
+  if(fd < 0)
+  {
+    logger::log() << msg::ERROR << "could not open file [" << file_name << "] for reading";
+    return false;
+  }
+
+  struct stat st;
+  if(fstat(fd, &st) != 0 || (size_t)st.st_size < sizeof(binary_header))
+  {
+    logger::log() << msg::ERROR << "file [" << file_name << "] is not a binary grid file";
+    ::close(fd);
+    return false;
+  }
+
+  //
+  // map privately & writable, s.t. the grid may still be modified in memory
+  // (pages are shared with other processes until they are written to)
+  //
+  void* addr = mmap(NULL, st.st_size, PROT_READ | PROT_WRITE, MAP_PRIVATE, fd, 0);
+  ::close(fd);
+  if(addr == MAP_FAILED)
+  {
+    logger::log() << msg::ERROR << "could not map file [" << file_name << "] into memory";
+    return false;
+  }
+  _addr = addr;
+  _size = st.st_size;
+
+  const binary_header& h = get_header();
+  if(strncmp(h.magic, GRIDIO_MAGIC, sizeof(h.magic)) != 0 || h.version != GRIDIO_VERSION)
+  {
+    logger::log() << msg::ERROR << "file [" << file_name << "] is not a binary grid file (or has an unsupported version)";
+    close();
+    return false;
+  }
+  if(h.byte_order != GRIDIO_BYTE_ORDER)
+  {
+    logger::log() << msg::ERROR << "file [" << file_name << "] was written with a different byte order";
+    close();
+    return false;
+  }
+  if(h.file_size != _size                                                   ||
+     !in_file(h.names_offset, h.names_size, _size)                          ||
+     !in_file(h.transformations_offset, h.transformations_size, _size)      ||
+     !in_file(h.weights_offset, h.npoints * sizeof(real_t), _size)          ||
+     !in_file(h.data_offset, h.data_size, _size)                            ||
+     h.weights_offset % sizeof(real_t) != 0                                 ||
+     h.data_offset % GRIDIO_PAGE_SIZE != 0)
+  {
+    logger::log() << msg::ERROR << "file [" << file_name << "] is truncated or corrupt";
+    close();
+    return false;
+  }
+
+  logger::log() << msg::DEBUG << "mapped [" << _size << "] bytes of file [" << file_name << "]";
+
+  return true;
+}
+
+//////////////////////////////////////////////////////////////////////
+
+void gridio::mapped_file::close()
+{
+  if(_addr != NULL)
+  {
+    munmap(_addr, _size);
+  }
+  _addr = NULL;
+  _size = 0;
+}
+
+//////////////////////////////////////////////////////////////////////
+
+bool gridio::mapped_file::contains(const void* p) const
+{
+  const char* c = static_cast<const char*>(p);
+  const char* a = static_cast<const char*>(_addr);
+  return _addr != NULL && c >= a && c < a + _size;
+}
+
+//////////////////////////////////////////////////////////////////////
+
+string gridio::mapped_file::get_axis_names() const
+{
+  const binary_header& h = get_header();
+  return string(static_cast<const char*>(_addr) + h.names_offset, h.names_size);
+}
+
+//////////////////////////////////////////////////////////////////////
+
+string gridio::mapped_file::get_transformations() const
+{
+  const binary_header& h = get_header();
+  return string(static_cast<const char*>(_addr) + h.transformations_offset, h.transformations_size);
+}
+
+//////////////////////////////////////////////////////////////////////
+
+const real_t* gridio::mapped_file::get_weights() const
+{
+  return reinterpret_cast<const real_t*>(static_cast<const char*>(_addr) + get_header().weights_offset);
+}
+
+//////////////////////////////////////////////////////////////////////
+
+void* gridio::mapped_file::get_data() const
+{
+  return static_cast<char*>(_addr) + get_header().data_offset;
+}
+
+//////////////////////////////////////////////////////////////////////
+
+bool gridio::write_binary(const string& file_name,
+			  binary_header& header,
+			  const string& axis_names,
+			  const string& transformations,
+			  const real_t* weights,
+			  const void* data)
+{
+  memset(header.magic, 0, sizeof(header.magic));
+  strncpy(header.magic, GRIDIO_MAGIC, sizeof(header.magic));
+  header.version = GRIDIO_VERSION;
+  header.byte_order = GRIDIO_BYTE_ORDER;
+
+  header.names_offset = sizeof(binary_header);
+  header.names_size = axis_names.size();
+  header.transformations_offset = header.names_offset + header.names_size;
+  header.transformations_size = transformations.size();
+  header.weights_offset = align(header.transformations_offset + header.transformations_size, sizeof(real_t));
+  header.data_offset = align(header.weights_offset + header.npoints * sizeof(real_t), GRIDIO_PAGE_SIZE);
+  header.file_size = header.data_offset + header.data_size;
+
+  std::stringstream tmp_name_sstr;
+  tmp_name_sstr << file_name << ".tmp" << getpid();
+  string tmp_name = tmp_name_sstr.str();
+  std::ofstream ofs(tmp_name.c_str(), std::ios::out | std::ios::binary | std::ios::trunc);
+  if(!ofs)
+  {
+    logger::log() << msg::ERROR << "could not open file [" << tmp_name << "] for writing";
+    return false;
+  }
+
+  std::vector<char> padding(GRIDIO_PAGE_SIZE, 0);
+
+  ofs.write(reinterpret_cast<const char*>(&header), sizeof(binary_header));
+  ofs.write(axis_names.data(), axis_names.size());
+  ofs.write(transformations.data(), transformations.size());
+  ofs.write(&(padding[0]), header.weights_offset - (header.transformations_offset + header.transformations_size));
+  ofs.write(reinterpret_cast<const char*>(weights), header.npoints * sizeof(real_t));
+  ofs.write(&(padding[0]), header.data_offset - (header.weights_offset + header.npoints * sizeof(real_t)));
+  ofs.write(static_cast<const char*>(data), header.data_size);
+  ofs.close();
+
+  if(!ofs || rename(tmp_name.c_str(), file_name.c_str()) != 0)
+  {
+    logger::log() << msg::ERROR << "failed to write file [" << file_name << "]";
+    remove(tmp_name.c_str());
+    return false;
+  }
+
+  logger::log() << msg::INFO << "wrote [" << header.npoints << "] grid points to [" << file_name << "]";
+
+  return true;
+}
+
+//////////////////////////////////////////////////////////////////////
+
+string gridio::fingerprint(const string& description)
+{
+  //
+  // 64-bit FNV-1a hash
+  //
+  uint64_t h = 14695981039346656037ULL;
+  for(size_t i=0; i<description.size(); ++i)
+  {
+    h ^= (unsigned char)description[i];
+    h *= 1099511628211ULL;
+  }
+  std::stringstream sstr;
+  sstr << std::hex << std::setw(16) << std::setfill('0') << h;
+  return sstr.str();
+}
+
+//////////////////////////////////////////////////////////////////////
+
+bool gridio::file_status(const string& file_name, string& status)
+{
+  struct stat st;
+  if(stat(file_name.c_str(), &st) != 0)
+  {
+    return false;
+  }
+  std::stringstream sstr;
+  sstr << st.st_size << " " << st.st_mtime;
+  status = sstr.str();
+  return true;
+}
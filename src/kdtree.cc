@@ -0,0 +1,426 @@
+#include "kdtree.hh"
+#include "agf.hh"
+#include "logger.hh"
+
+#include <algorithm>
+#include <vector>
+#include <cmath>
+#include <limits>
+
+//
+// relative slack on the pruning bound, s.t. rounding in the incremental
+// distance never discards a node that holds one of the exact k nearest points
+//
+#define KDTREE_PRUNE_TOL 1.0e-5
+
+//////////////////////////////////////////////////////////////////////
+
+namespace
+{
+  //
+  // orders point indices along one dimension of the grid
+  //
+  class coordinate_less
+  {
+  public:
+    coordinate_less( const real_array_t* data, integer_t idim ) :
+      _data( data ),
+      _idim( idim ) { }
+    bool operator()( integer_t a, integer_t b ) const { return _data[a][_idim] < _data[b][_idim]; }
+  private:
+    const real_array_t* _data;
+    integer_t _idim;
+  };
+}
+
+//////////////////////////////////////////////////////////////////////
+
+kdtree::kdtree(const real_array_t* data,
+	       const real_t* weights,
+	       integer_t ndim,
+	       integer_t npts,
+	       integer_t leaf_size) :
+  _data(data),
+  _wgts(weights),
+  _ndim(ndim),
+  _npts(npts),
+  _leaf_size(leaf_size > 0 ? leaf_size : KDTREE_LEAF_SIZE),
+  _perm(npts, 0),
+  _nodes(),
+  _removed(),
+  _alive(),
+  _parent(),
+  _leaf()
+{
+  for(integer_t ipt=0; ipt<_npts; ++ipt)
+  {
+    _perm[ipt] = ipt;
+  }
+  _nodes.reserve(2 * (_npts / _leaf_size + 1));
+  if(_npts > 0)
+  {
+    build(0, _npts);
+  }
+  LOG_DEBUG( "built k-d tree with [" << _nodes.size() << "] nodes over [" << _npts << "] points" );
+}
+
+//////////////////////////////////////////////////////////////////////
+
+kdtree::~kdtree()
+{
+
+}
+
+//////////////////////////////////////////////////////////////////////
+
+integer_t kdtree::build(integer_t begin, integer_t end)
+{
+  integer_t inode = _nodes.size();
+  node n;
+  n.begin = begin;
+  n.end = end;
+  n.left = -1;
+  n.right = -1;
+  n.dim = 0;
+  n.split = 0;
+  _nodes.push_back(n);
+
+  if(end - begin <= _leaf_size)
+  {
+    return inode;
+  }
+
+  //
+  // split along the dimension with the largest spread
+  //
+  real_t spread = -1;
+  for(integer_t idim=0; idim<_ndim; ++idim)
+  {
+    real_t lo = _data[_perm[begin]][idim];
+    real_t hi = lo;
+    for(integer_t i=begin+1; i<end; ++i)
+    {
+      real_t x = _data[_perm[i]][idim];
+      if(x < lo) lo = x;
+      if(x > hi) hi = x;
+    }
+    if(hi - lo > spread)
+    {
+      spread = hi - lo;
+      n.dim = idim;
+    }
+  }
+
+  if(spread <= 0)
+  {
+    return inode; // all points coincide, keep as a leaf
+  }
+
+  integer_t mid = begin + (end - begin) / 2;
+  std::nth_element(_perm.begin() + begin, _perm.begin() + mid, _perm.begin() + end, coordinate_less(_data, n.dim));
+  n.split = _data[_perm[mid]][n.dim];
+
+  n.left = build(begin, mid);
+  n.right = build(mid, end);
+
+  _nodes[inode] = n;
+
+  return inode;
+}
+
+//////////////////////////////////////////////////////////////////////
+
+integer_t kdtree::nearest(const real_t* vec, integer_t k, real_t* knearest, real_t* clwtnearest) const
+{
+  agf::workspace ws;
+  return nearest(vec, k, knearest, clwtnearest, ws);
+}
+
+//////////////////////////////////////////////////////////////////////
+
+integer_t kdtree::nearest(const real_t* vec, integer_t k, real_t* knearest, real_t* clwtnearest, agf::workspace& ws) const
+{
+  k = std::min(k, _npts);
+  if(k <= 0)
+  {
+    return 0;
+  }
+
+  std::vector<neighbour_t>& heap = ws.dsqr;
+  heap.clear();
+  heap.reserve(k);
+  
+  std::vector<double>& offsets = ws.offsets;
+  offsets.assign(_ndim, 0.);
+
+  search(0, 0., offsets, vec, k, heap);
+
+  std::sort_heap(heap.begin(), heap.end());
+  k = heap.size(); // fewer than k if points were removed
+
+  for(integer_t i=0; i<k; ++i)
+  {
+    knearest[i] = heap[i].first;
+    clwtnearest[i] = heap[i].second;
+  }
+
+  return k;
+}
+
+//////////////////////////////////////////////////////////////////////
+
+void kdtree::search(integer_t inode,
+		    double rd,
+		    std::vector<double>& offsets,
+		    const real_t* vec,
+		    integer_t k,
+		    std::vector<neighbour_t>& heap) const
+{
+  const node& n = _nodes[inode];
+
+  if(!_removed.empty() && _alive[inode] == 0)
+  {
+    return;
+  }
+
+  if(n.left < 0)
+  {
+    for(integer_t i=n.begin; i<n.end; ++i)
+    {
+      integer_t ipt = _perm[i];
+      if(!_removed.empty() && _removed[ipt])
+      {
+	continue;
+      }
+      neighbour_t p(agf::metric<real_t>(vec, _data[ipt], _ndim), _wgts[ipt]);
+      if((integer_t)heap.size() < k)
+      {
+	heap.push_back(p);
+	std::push_heap(heap.begin(), heap.end());
+      }
+      else if(p < heap.front())
+      {
+	std::pop_heap(heap.begin(), heap.end());
+	heap.back() = p;
+	std::push_heap(heap.begin(), heap.end());
+      }
+    }
+    return;
+  }
+
+  //
+  // descend into the near side first, then visit the far side only if the
+  // (incrementally updated) lower bound on its distance can beat the current k'th
+  //
+  double d = (double)vec[n.dim] - (double)n.split;
+  integer_t near_node = d <= 0 ? n.left : n.right;
+  integer_t far_node  = d <= 0 ? n.right : n.left;
+
+  search(near_node, rd, offsets, vec, k, heap);
+
+  double old_offset = offsets[n.dim];
+  double far_rd = rd - old_offset * old_offset + d * d;
+
+  if((integer_t)heap.size() < k || far_rd * (1. - KDTREE_PRUNE_TOL) <= heap.front().first)
+  {
+    offsets[n.dim] = d;
+    search(far_node, far_rd, offsets, vec, k, heap);
+    offsets[n.dim] = old_offset;
+  }
+}
+
+//////////////////////////////////////////////////////////////////////
+
+integer_t kdtree::range(const real_t* vec, real_t r2, neighbour_t* neighbours, agf::workspace& ws) const
+{
+  integer_t n = 0;
+  if(_npts == 0)
+  {
+    return n;
+  }
+
+  std::vector<double>& offsets = ws.offsets;
+  offsets.assign(_ndim, 0.);
+
+  collect(0, 0., offsets, vec, r2, neighbours, n);
+
+  return n;
+}
+
+//////////////////////////////////////////////////////////////////////
+
+void kdtree::collect(integer_t inode,
+		     double rd,
+		     std::vector<double>& offsets,
+		     const real_t* vec,
+		     real_t r2,
+		     neighbour_t* neighbours,
+		     integer_t& n) const
+{
+  const node& nd = _nodes[inode];
+
+  if(!_removed.empty() && _alive[inode] == 0)
+  {
+    return;
+  }
+
+  if(nd.left < 0)
+  {
+    for(integer_t i=nd.begin; i<nd.end; ++i)
+    {
+      integer_t ipt = _perm[i];
+      if(!_removed.empty() && _removed[ipt])
+      {
+	continue;
+      }
+      real_t d = agf::metric<real_t>(vec, _data[ipt], _ndim);
+      if(d <= r2)
+      {
+	neighbours[n++] = neighbour_t(d, _wgts[ipt]);
+      }
+    }
+    return;
+  }
+
+  //
+  // as in search, with the radius as the (fixed) bound on the far side
+  //
+  double d = (double)vec[nd.dim] - (double)nd.split;
+  integer_t near_node = d <= 0 ? nd.left : nd.right;
+  integer_t far_node  = d <= 0 ? nd.right : nd.left;
+
+  collect(near_node, rd, offsets, vec, r2, neighbours, n);
+
+  double old_offset = offsets[nd.dim];
+  double far_rd = rd - old_offset * old_offset + d * d;
+
+  if(far_rd * (1. - KDTREE_PRUNE_TOL) <= r2)
+  {
+    offsets[nd.dim] = d;
+    collect(far_node, far_rd, offsets, vec, r2, neighbours, n);
+    offsets[nd.dim] = old_offset;
+  }
+}
+
+//////////////////////////////////////////////////////////////////////
+
+integer_t kdtree::nearest_index(const real_t* vec, real_t& d2, agf::workspace& ws, integer_t exclude) const
+{
+  integer_t best = -1;
+  d2 = (std::numeric_limits<real_t>::max)();
+  if(_npts == 0)
+  {
+    return best;
+  }
+
+  std::vector<double>& offsets = ws.offsets;
+  offsets.assign(_ndim, 0.);
+
+  find(0, 0., offsets, vec, exclude, best, d2);
+
+  return best;
+}
+
+//////////////////////////////////////////////////////////////////////
+
+void kdtree::find(integer_t inode,
+		  double rd,
+		  std::vector<double>& offsets,
+		  const real_t* vec,
+		  integer_t exclude,
+		  integer_t& best,
+		  real_t& bestd) const
+{
+  const node& nd = _nodes[inode];
+
+  if(!_removed.empty() && _alive[inode] == 0)
+  {
+    return;
+  }
+
+  if(nd.left < 0)
+  {
+    for(integer_t i=nd.begin; i<nd.end; ++i)
+    {
+      integer_t ipt = _perm[i];
+      if(ipt == exclude || (!_removed.empty() && _removed[ipt]))
+      {
+	continue;
+      }
+      real_t d = agf::metric<real_t>(vec, _data[ipt], _ndim);
+      if(d < bestd || (d == bestd && ipt < best))
+      {
+	bestd = d;
+	best = ipt;
+      }
+    }
+    return;
+  }
+
+  //
+  // as in search, with the current nearest as the bound on the far side
+  //
+  double d = (double)vec[nd.dim] - (double)nd.split;
+  integer_t near_node = d <= 0 ? nd.left : nd.right;
+  integer_t far_node  = d <= 0 ? nd.right : nd.left;
+
+  find(near_node, rd, offsets, vec, exclude, best, bestd);
+
+  double old_offset = offsets[nd.dim];
+  double far_rd = rd - old_offset * old_offset + d * d;
+
+  if(best < 0 || far_rd * (1. - KDTREE_PRUNE_TOL) <= bestd)
+  {
+    offsets[nd.dim] = d;
+    find(far_node, far_rd, offsets, vec, exclude, best, bestd);
+    offsets[nd.dim] = old_offset;
+  }
+}
+
+//////////////////////////////////////////////////////////////////////
+
+void kdtree::remove(integer_t ipt)
+{
+  if(ipt < 0 || ipt >= _npts)
+  {
+    return;
+  }
+  
+  if(_removed.empty())
+  {
+    //
+    // the bookkeeping for removals is only set up once the first point is removed
+    //
+    _removed.assign(_npts, 0);
+    _alive.assign(_nodes.size(), 0);
+    _parent.assign(_nodes.size(), -1);
+    _leaf.assign(_npts, -1);
+    for(integer_t inode=0; inode<(integer_t)_nodes.size(); ++inode)
+    {
+      const node& nd = _nodes[inode];
+      _alive[inode] = nd.end - nd.begin;
+      if(nd.left < 0)
+      {
+	for(integer_t i=nd.begin; i<nd.end; ++i)
+	{
+	  _leaf[_perm[i]] = inode;
+	}
+      }
+      else
+      {
+	_parent[nd.left] = inode;
+	_parent[nd.right] = inode;
+      }
+    }
+  }
+  
+  if(_removed[ipt])
+  {
+    return;
+  }
+  _removed[ipt] = 1;
+  for(integer_t inode=_leaf[ipt]; inode>=0; inode=_parent[inode])
+  {
+    --_alive[inode];
+  }
+}
@@ -1,10 +1,160 @@
 #include "logger.hh"
 
+#include "log4cpp/AppenderSkeleton.hh"
+#include "log4cpp/LoggingEvent.hh"
+
+#include <deque>
+#include <sstream>
+#include <cstdlib>
+
+#include <pthread.h>
+
 priority_t logger::msg_level = log4cpp::Priority::DEBUG;
 
 log4cpp::Appender* logger::_stream = NULL;
 log4cpp::Appender* logger::_file = NULL;
 
+std::string logger::_logfile = "";
+bool logger::_async = false;
+
+namespace
+{
+  //
+  // appender that queues the logging events and passes them to another 
+  // appender from a background thread (the caller only blocks if the queue 
+  // holds LOG_ASYNC_CAPACITY events)
+  //
+  class async_appender : public log4cpp::AppenderSkeleton
+  {
+  public:
+    async_appender( log4cpp::Appender* target ) :
+      log4cpp::AppenderSkeleton( "async" ),
+      _target( target ),
+      _busy( false ),
+      _stop( false )
+    {
+      pthread_mutex_init( &_mutex, NULL );
+      pthread_cond_init( &_changed, NULL );
+      pthread_create( &_thread, NULL, &async_appender::run, this );
+    }
+    
+    virtual ~async_appender( )
+    {
+      close();
+      pthread_cond_destroy( &_changed );
+      pthread_mutex_destroy( &_mutex );
+      delete _target;
+    }
+    
+    //
+    // wait until all queued events are written
+    //
+    void flush( )
+    {
+      pthread_mutex_lock( &_mutex );
+      while( !_queue.empty() || _busy )
+      {
+	pthread_cond_wait( &_changed, &_mutex );
+      }
+      pthread_mutex_unlock( &_mutex );
+    }
+    
+    virtual bool reopen( ) { return _target->reopen(); }
+    
+    virtual void close( )
+    {
+      pthread_mutex_lock( &_mutex );
+      bool running = !_stop;
+      _stop = true;
+      pthread_cond_broadcast( &_changed );
+      pthread_mutex_unlock( &_mutex );
+      if( running )
+      {
+	pthread_join( _thread, NULL );
+      }
+      _target->close();
+    }
+    
+    virtual bool requiresLayout( ) const { return false; }
+    virtual void setLayout( log4cpp::Layout* layout ) { _target->setLayout( layout ); }
+    
+  protected:
+    virtual void _append( const log4cpp::LoggingEvent& event )
+    {
+      pthread_mutex_lock( &_mutex );
+      while( _queue.size() >= LOG_ASYNC_CAPACITY && !_stop )
+      {
+	pthread_cond_wait( &_changed, &_mutex );
+      }
+      if( _stop )
+      {
+	pthread_mutex_unlock( &_mutex );
+	_target->doAppend( event ); // the background thread has finished
+	return;
+      }
+      _queue.push_back( event );
+      pthread_cond_broadcast( &_changed );
+      pthread_mutex_unlock( &_mutex );
+    }
+    
+  private:
+    static void* run( void* self )
+    {
+      async_appender* a = static_cast<async_appender*>( self );
+      pthread_mutex_lock( &a->_mutex );
+      while( true )
+      {
+	while( a->_queue.empty() && !a->_stop )
+	{
+	  pthread_cond_wait( &a->_changed, &a->_mutex );
+	}
+	if( a->_queue.empty() )
+	{
+	  break; // stopped & drained
+	}
+	
+	//
+	// write the queued events without holding the lock
+	//
+	std::deque<log4cpp::LoggingEvent> events;
+	events.swap( a->_queue );
+	a->_busy = true;
+	pthread_cond_broadcast( &a->_changed );
+	pthread_mutex_unlock( &a->_mutex );
+	
+	for( std::deque<log4cpp::LoggingEvent>::const_iterator it = events.begin(); it != events.end(); ++it )
+	{
+	  a->_target->doAppend( *it );
+	}
+	
+	pthread_mutex_lock( &a->_mutex );
+	a->_busy = false;
+	pthread_cond_broadcast( &a->_changed );
+      }
+      pthread_mutex_unlock( &a->_mutex );
+      return NULL;
+    }
+    
+    log4cpp::Appender* _target;
+    
+    std::deque<log4cpp::LoggingEvent> _queue;
+    bool _busy; // the background thread is writing events
+    bool _stop;
+    
+    pthread_t _thread;
+    pthread_mutex_t _mutex;
+    pthread_cond_t _changed; // signals any change to the queue or state
+  };
+  
+  //
+  // flush the asynchronous appenders at exit
+  //
+  void flush_at_exit( )
+  {
+    logger::flush();
+  }
+}
+
 logger::logger() { }
 
 logger::~logger() 
@@ -25,14 +175,17 @@ void logger::initialize( priority_t lvl,
   {
     _stream = new log4cpp::OstreamAppender("console", &std::cout);
     _stream->setLayout( new log4cpp::SimpleLayout() );
+    if( _async ) _stream = new async_appender( _stream );
     root.addAppender( _stream );
   }
   if( _file==0x0 )
   {
     if( logfile != "" )
     {
+      _logfile = logfile;
       _file = new log4cpp::FileAppender("default", logfile.c_str());
       _file->setLayout( new log4cpp::SimpleLayout() );
+      if( _async ) _file = new async_appender( _file );
       root.addAppender( _file );
     }
   }
@@ -48,6 +201,42 @@ void logger::set_level( priority_t lvl )
   msg_level = lvl;
 }
 
+void logger::set_async( bool async )
+{
+  if( async == _async )
+  {
+    return;
+  }
+  
+  static bool registered = false;
+  if( async && !registered )
+  {
+    atexit( &flush_at_exit );
+    registered = true;
+  }
+  
+  _async = async;
+  
+  //
+  // re-create the appenders (the category owns, and deletes, the current ones)
+  //
+  if( _stream!=0x0 )
+  {
+    log4cpp::Category::getRoot().removeAllAppenders();
+    _stream = NULL;
+    _file = NULL;
+    initialize( msg_level, _logfile );
+  }
+}
+
+void logger::flush( )
+{
+  async_appender* a = dynamic_cast<async_appender*>( _stream );
+  if( a ) a->flush();
+  a = dynamic_cast<async_appender*>( _file );
+  if( a ) a->flush();
+}
+
 log4cpp::Category& logger::log()
 {
   if( _stream==0x0 )
@@ -56,3 +245,14 @@ log4cpp::Category& logger::log()
   }
   return log4cpp::Category::getRoot();
 }
+
+std::string logger::rate_limit::get_suffix( ) const
+{
+  if( _count <= LOG_RATE_BURST )
+  {
+    return "";
+  }
+  std::stringstream sstr;
+  sstr << " (repeated [" << _count << "] times)";
+  return sstr.str();
+}
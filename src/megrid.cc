@@ -1,59 +1,306 @@
 #include "megrid.hh"
 #include "foam.hh"
 
-#include <list>
+#include <algorithm>
+#include <new>
+#include <cstdlib>
+#include <cstring>
+#include <cctype>
+#include <cstdio>
+#include <unistd.h>
 #include <limits>
 #include <memory>
 #include <cmath>
 #include <sstream>
+#include <fstream>
 #include <iostream>
 #include <iomanip>
 #include <numeric>
+#include <functional>
 #include <stdexcept>
 
 #include <boost/shared_ptr.hpp>
 #include <boost/tokenizer.hpp>
+#include <boost/static_assert.hpp>
 
 #include <TFile.h>
 #include <TTree.h>
 #include <TChain.h>
 #include <TTreeFormula.h>
+#include <TLeaf.h>
+#include <TLeafElement.h>
+#include <TBranch.h>
+#include <TObjArray.h>
 #include <TROOT.h>
 #include <TDirectory.h>
 #include <TEventList.h>
 
 #include "agf.hh"
+#include "kdtree.hh"
+#include "pdfcache.hh"
+#include "gridio.hh"
 #include "cluster.hh" 
 
 // #include "agf_lib.h"
 
 #define INIT_RESERVE 1000
+#define GRID_ALIGNMENT 64 // alignment (in bytes) of the grid data, i.e. one cache line
+#define LOAD_CACHE_SIZE 30000000 // size (in bytes) of the tree cache used when loading a grid
+#define KMEANS_SAMPLE_FACTOR 10 // size of the sample for the mini-batch k-means seeding, in units of the number of clusters
+#define KMEANS_SEED_ROUNDS 5 // number of rounds of candidates drawn by the k-means|| seeding
+#define KMEANS_SEED_ITERATIONS 5 // number of Lloyd iterations over the candidates of the k-means|| seeding
+#define AGF_RADIUS_CUT 36. // radius (as distance squared, in units of the filter variance) beyond which AGF weights are below float precision
 
 using std::string;
 using std::vector;
 using std::pair;
-using std::list;
+
+//
+// megrid::solver_type mirrors agf::solver_type (the dictionary is built from 
+// megrid.hh, which does not include agf.hh), and is cast to it in evaluate
+//
+BOOST_STATIC_ASSERT( (int)megrid::SUPERNEWTON == (int)agf::SUPERNEWTON );
+BOOST_STATIC_ASSERT( (int)megrid::BRACKETED   == (int)agf::BRACKETED );
+
+namespace
+{
+  //
+  // allocate an aligned block of memory for grid data (to be released with free)
+  //
+  void* allocate_block(size_t nbytes)
+  {
+    void* mem = NULL;
+    if(posix_memalign(&mem, GRID_ALIGNMENT, nbytes) != 0)
+    {
+      logger::log() << msg::ERROR << "failed to allocate [" << nbytes << "] bytes for grid data";
+      throw std::bad_alloc();
+    }
+    return mem;
+  }
+  
+  //
+  // a grid coordinate (or weight) that is read directly from a leaf rather than 
+  // through a TTreeFormula, i.e., a plain branch or an element of an array 
+  // branch like 'jet_px[0]' (elements beyond the length of the array read as 
+  // zero, as in TTreeFormula)
+  //
+  class leaf_column
+  {
+  public:
+    leaf_column(const string& name, integer_t index) : _name(name), _index(index), _leaf(NULL) { }
+    
+    //
+    // split expr into a leaf name & array index, returns false for other expressions
+    //
+    static bool parse(const string& expr, string& name, integer_t& index)
+    {
+      string::size_type n = expr.find('[');
+      name = expr.substr(0, n);
+      index = 0;
+      if(name.size() == 0 || !(isalpha(name[0]) || name[0] == '_'))
+	return false;
+      for(unsigned i=0; i<name.size(); ++i)
+      {
+	if(!(isalnum(name[i]) || name[i] == '_' || name[i] == '.'))
+	  return false;
+      }
+      if(n == string::npos)
+	return true;
+      if(expr.size() < n + 3 || expr[expr.size()-1] != ']')
+	return false;
+      for(unsigned i=n+1; i<expr.size()-1; ++i)
+      {
+	if(!isdigit(expr[i]))
+	  return false;
+	index = 10 * index + (expr[i] - '0');
+      }
+      return true;
+    }
+    
+    //
+    // look up the leaf in the current tree of the chain (objects stored in 
+    // TBranchElements are left to TTreeFormula)
+    //
+    bool update(TTree* t)
+    {
+      _leaf = t->GetLeaf(_name.c_str());
+      return _leaf != NULL && dynamic_cast<TLeafElement*>(_leaf) == NULL;
+    }
+    
+    TLeaf* get_leaf() const { return _leaf; }
+    
+    real_t value() const { return _index < _leaf->GetLen() ? _leaf->GetValue(_index) : 0; }
+    
+  private:
+    string _name;
+    integer_t _index;
+    TLeaf* _leaf;
+  };
+  
+  //
+  // check that a value was not converted to infinity in half precision
+  //
+  bool is_representable(real_t x, half h)
+  {
+    const real_t xmax = (std::numeric_limits<real_t>::max)();
+    return std::fabs((float)h) <= xmax || !(std::fabs(x) <= xmax);
+  }
+  
+  //
+  // random integers in [0, n) from a seeded linear congruential generator, for 
+  // std::random_shuffle (s.t. the global state of rand() is left untouched),
+  // & random reals in [0, 1)
+  //
+  class random_index
+  {
+  public:
+    random_index(unsigned long long seed) : _state(seed) { }
+    std::ptrdiff_t operator()(std::ptrdiff_t n)
+    {
+      _state = _state * 6364136223846793005ULL + 1442695040888963407ULL;
+      return (std::ptrdiff_t)((_state >> 33) % (unsigned long long)n);
+    }
+    double uniform()
+    {
+      _state = _state * 6364136223846793005ULL + 1442695040888963407ULL;
+      return (_state >> 11) * (1.0 / 9007199254740992.0);
+    }
+  private:
+    unsigned long long _state;
+  };
+  
+  //
+  // reduce the weighted k-means|| candidates (grid points data[sample[candidates[i]]]) 
+  // to K cluster centers
+  //
+  void reduce_candidates(const real_array_t* data,
+			   integer_t ndim,
+			   const std::vector<integer_t>& sample,
+			   const std::vector<integer_t>& candidates,
+			   const std::vector<double>& candidates_wgts,
+			   real_array_t* centers,
+			   integer_t K,
+			   random_index& rnd,
+			   integer_t nthreads)
+  {
+    //
+    // K of the candidates are drawn by weight without replacement (the K largest 
+    // keys log(u)/w), then moved by a few weighted Lloyd iterations over the candidates
+    //
+    integer_t ncandidates = candidates.size();
+    std::vector< pair<double, integer_t> > keys(ncandidates);
+    for(integer_t i=0; i<ncandidates; ++i)
+    {
+      double u = rnd.uniform();
+      keys[i].first = (candidates_wgts[i] > 0 && u > 0 ? std::log(u) / candidates_wgts[i] : -(std::numeric_limits<double>::max)());
+      keys[i].second = i;
+    }
+    std::nth_element(keys.begin(), keys.begin() + K, keys.end(), std::greater< pair<double, integer_t> >());
+    for(integer_t icl=0; icl<K; ++icl)
+    {
+      const real_t* x = data[sample[candidates[keys[icl].second]]];
+      std::copy(x, x + ndim, centers[icl]);
+    }
+    
+    std::vector<real_t> centers_wgts(K, 0.);
+    std::vector<integer_t> assigned(ncandidates, -1);
+    std::vector<double> sums((size_t)K * ndim);
+    std::vector<double> sumw(K);
+    for(integer_t iter=0; iter<KMEANS_SEED_ITERATIONS; ++iter)
+    {
+      {
+	kdtree index(centers, &(centers_wgts[0]), ndim, K);
+#pragma omp parallel num_threads(nthreads)
+	{
+	  agf::workspace ws;
+	  real_t d;
+#pragma omp for schedule(static)
+	  for(integer_t i=0; i<ncandidates; ++i)
+	  {
+	    assigned[i] = index.nearest_index(data[sample[candidates[i]]], d, ws);
+	  }
+	}
+      }
+      
+      std::fill(sums.begin(), sums.end(), 0.);
+      std::fill(sumw.begin(), sumw.end(), 0.);
+      for(integer_t i=0; i<ncandidates; ++i)
+      {
+	integer_t icl = assigned[i];
+	if(icl < 0 || candidates_wgts[i] <= 0)
+	{
+	  continue;
+	}
+	const real_t* x = data[sample[candidates[i]]];
+	for(integer_t idim=0; idim<ndim; ++idim)
+	{
+	  sums[(size_t)icl * ndim + idim] += candidates_wgts[i] * x[idim];
+	}
+	sumw[icl] += candidates_wgts[i];
+      }
+      for(integer_t icl=0; icl<K; ++icl)
+      {
+	if(sumw[icl] > 0)
+	{
+	  for(integer_t idim=0; idim<ndim; ++idim)
+	  {
+	    centers[icl][idim] = sums[(size_t)icl * ndim + idim] / sumw[icl];
+	  }
+	}
+      }
+    }
+  }
+}
+
+//////////////////////////////////////////////////////////////////////
+
+string megrid::_cache_directory = "";
 
 //////////////////////////////////////////////////////////////////////
 
-megrid::megrid(string name, integer_t ndim) : 
+megrid::megrid(string name, integer_t ndim, precision_type precision) : 
   igrid_base(),
   _name (name),
   _wc (WC_DEFAULT),
   _mindelta(-1),
   _maxk(0),
   _option_pdf(AGF),
+  _option_index(BRUTE_FORCE),
+  _option_precision(SINGLE),
+  _option_solver(SUPERNEWTON),
+  _index(NULL),
+  _pdf_cache(NULL),
+  _pdf_cache_size(0),
+  _pdf_cache_tolerance(0.),
+  _pyramid(),
+  _pyramid_levels(2),
+  _pyramid_ratio(0.1),
+  _progressive_error(0.),
+  _progressive_level(0),
+  _nthreads(1),
+  _cluster_batch_size(10000),
+  _cluster_iterations(100),
+  _queued_transformations(),
+  _workspace(new agf::workspace()),
   _is_locked (false),
   _wgts (NULL),
   _data (NULL),
+  _buffer (NULL),
+  _segments(),
+  _hbuffer (NULL),
+  _mapping (NULL),
+  _precision_sumsq(0.),
   _grid_dimensions(ndim, 1),
+  _grid_min(ndim, (std::numeric_limits<real_t>::max)()),
+  _grid_max(ndim, (std::numeric_limits<real_t>::min)()),
+  _moment1(ndim, 0.),
+  _moment2(0.),
   _sum_wgts(0.),
   _ndim(ndim),
   _npoints(0),
   _nreserved(0)
 {               
-  
-  
+  set_option_precision(precision);
 }
 
 //////////////////////////////////////////////////////////////////////
@@ -63,23 +310,98 @@ megrid::megrid(string name,
 	       string tree_name, 
 	       string branch_names, 
 	       string weight_expression,
-	       integer_t max_entries) :
+	       integer_t max_entries,
+	       precision_type precision) :
   igrid_base(),
   _name (name),
   _wc (WC_DEFAULT),
   _mindelta(-1),
   _maxk(0),
   _option_pdf(AGF),
+  _option_index(BRUTE_FORCE),
+  _option_precision(SINGLE),
+  _option_solver(SUPERNEWTON),
+  _index(NULL),
+  _pdf_cache(NULL),
+  _pdf_cache_size(0),
+  _pdf_cache_tolerance(0.),
+  _pyramid(),
+  _pyramid_levels(2),
+  _pyramid_ratio(0.1),
+  _progressive_error(0.),
+  _progressive_level(0),
+  _nthreads(1),
+  _cluster_batch_size(10000),
+  _cluster_iterations(100),
+  _queued_transformations(),
+  _workspace(new agf::workspace()),
   _is_locked (false),
   _wgts (NULL),
   _data (NULL),
+  _buffer (NULL),
+  _segments(),
+  _hbuffer (NULL),
+  _mapping (NULL),
+  _precision_sumsq(0.),
   _grid_dimensions(0),
+  _grid_min(0),
+  _grid_max(0),
+  _moment1(0),
+  _moment2(0.),
   _sum_wgts(0.),
   _ndim(0),
   _npoints(0),
   _nreserved(0)
 { 
   if(!load(file_pattern, tree_name, branch_names, weight_expression, max_entries)) clear(); 
+  set_option_precision(precision);
+}
+
+//////////////////////////////////////////////////////////////////////
+
+megrid::megrid(string name, string file_name) :
+  igrid_base(),
+  _name (name),
+  _wc (WC_DEFAULT),
+  _mindelta(-1),
+  _maxk(0),
+  _option_pdf(AGF),
+  _option_index(BRUTE_FORCE),
+  _option_precision(SINGLE),
+  _option_solver(SUPERNEWTON),
+  _index(NULL),
+  _pdf_cache(NULL),
+  _pdf_cache_size(0),
+  _pdf_cache_tolerance(0.),
+  _pyramid(),
+  _pyramid_levels(2),
+  _pyramid_ratio(0.1),
+  _progressive_error(0.),
+  _progressive_level(0),
+  _nthreads(1),
+  _cluster_batch_size(10000),
+  _cluster_iterations(100),
+  _queued_transformations(),
+  _workspace(new agf::workspace()),
+  _is_locked (false),
+  _wgts (NULL),
+  _data (NULL),
+  _buffer (NULL),
+  _segments(),
+  _hbuffer (NULL),
+  _mapping (NULL),
+  _precision_sumsq(0.),
+  _grid_dimensions(0),
+  _grid_min(0),
+  _grid_max(0),
+  _moment1(0),
+  _moment2(0.),
+  _sum_wgts(0.),
+  _ndim(0),
+  _npoints(0),
+  _nreserved(0)
+{ 
+  if(!open(file_name)) clear(); 
 }
 
 //////////////////////////////////////////////////////////////////////
@@ -87,6 +409,16 @@ megrid::megrid(string name,
 megrid::~megrid() 
 {
   clear();
+  for(unsigned it=0; it<_owned_transformations.size(); ++it)
+  {
+    delete _owned_transformations[it];
+  }
+  for(unsigned it=0; it<_composed_transformations.size(); ++it)
+  {
+    delete _composed_transformations[it];
+  }
+  delete _pdf_cache;
+  delete _workspace;
 }
 
 //////////////////////////////////////////////////////////////////////
@@ -117,20 +449,48 @@ bool megrid::load(string file_pattern,
   tptr->Add(file_pattern.c_str());  
   tptr->SetBranchStatus("*", true);
   
-  logger::log() << msg::INFO << "begin reading in grid data" ;  
-  
-  if(weight_expression.size() == 0)
+  //
+  // open the cached grid if the same inputs were loaded before
+  //
+  string cache_key;
+  if(_cache_directory.size() > 0)
   {
-    weight_expression = "1.00";
+    std::stringstream description;
+    description << "load " << tree_name << "\n" << branch_names << "\n" << weight_expression << "\n" << max_entries << "\n";
+    TObjArray* files = tptr->GetListOfFiles();
+    bool is_valid = (files->GetEntries() > 0);
+    for(integer_t ifile = 0; is_valid && ifile < files->GetEntries(); ++ifile)
+    {
+      string status;
+      is_valid = gridio::file_status(files->At(ifile)->GetTitle(), status);
+      description << files->At(ifile)->GetTitle() << " " << status << "\n";
+    }
+    if(is_valid)
+    {
+      cache_key = gridio::fingerprint(description.str());
+    }
+    else
+    {
+      logger::log() << msg::WARN << "can not check input files [" << file_pattern << "] for changes, grid will not be cached";
+    }
+    
+    string status;
+    string cache_file = get_cache_file(cache_key);
+    if(cache_file.size() > 0 && gridio::file_status(cache_file, status) && open(cache_file, false))
+    {
+      _cache_key = cache_key;
+      logger::log() << msg::INFO << "opened cached grid [" << cache_file << "] for [" << file_pattern << "]";
+      return true;
+    }
   }
   
+  logger::log() << msg::INFO << "begin reading in grid data" ;  
+  
   max_entries = min(max_entries, tptr->GetEntries());
   if(max_entries <= 0)
   {
     max_entries = tptr->GetEntries();
   }
-  reserve(max_entries + INIT_RESERVE); 
-  
   // _npoints = min(tptr->Draw("", weight_expression.c_str(), "goff"), max_entries);
   
   logger::log() << msg::INFO << "will read in maximum [" << max_entries << "] points" ;
@@ -140,20 +500,132 @@ bool megrid::load(string file_pattern,
   boost::tokenizer< boost::char_separator<char> > tokens(branch_names, sep);
   std::copy(tokens.begin(), tokens.end(), std::back_inserter(dim_exprs));     
   _ndim = dim_exprs.size();
-  vector< boost::shared_ptr<TTreeFormula> > dim_formulas;  
-  for(unsigned ibr = 0; ibr < (unsigned) _ndim; ++ibr)
+  _axis_names = dim_exprs;
+  reserve(max_entries + INIT_RESERVE); 
+  
+  //
+  // plain branches & array elements are read straight from their leaves (only 
+  // loading the branches that are needed, through the tree cache), any other 
+  // expression falls back to a TTreeFormula
+  //
+  tptr->SetCacheSize(LOAD_CACHE_SIZE);
+  if(tptr->LoadTree(0) < 0)
   {
-    logger::log() << msg::INFO << "set dimension " << ibr << " to [" << dim_exprs[ibr] << "]" ;
-    dim_formulas.push_back(boost::shared_ptr<TTreeFormula>(new TTreeFormula(Form("br_%i", ibr), dim_exprs[ibr].c_str(), tptr.get())));
-    dim_formulas.back()->SetQuickLoad(true);
+    logger::log() << msg::ERROR << "could not read tree [" << tree_name << "] from [" << file_pattern << "]" ;
+    return false;
+  }
+  
+  bool unit_weights = (weight_expression.size() == 0);
+  vector<string> exprs(dim_exprs);
+  if(!unit_weights)
+  {
+    exprs.push_back(weight_expression);
+  }
+  
+  vector< boost::shared_ptr<leaf_column> > columns(exprs.size());
+  vector< boost::shared_ptr<TTreeFormula> > formulas(exprs.size());
+  bool use_formulas = false;
+  for(unsigned iexpr = 0; iexpr < exprs.size(); ++iexpr)
+  {
+    string name;
+    integer_t index = 0;
+    if(leaf_column::parse(exprs[iexpr], name, index))
+    {
+      columns[iexpr].reset(new leaf_column(name, index));
+      if(!columns[iexpr]->update(tptr.get()))
+      {
+	columns[iexpr].reset();
+      }
+    }
+    if(!columns[iexpr])
+    {
+      formulas[iexpr].reset(new TTreeFormula(Form("br_%i", iexpr), exprs[iexpr].c_str(), tptr.get()));
+      formulas[iexpr]->SetQuickLoad(true);
+      use_formulas = true;
+    }
+    if(iexpr < (unsigned)_ndim)
+    {
+      logger::log() << msg::INFO << "set dimension " << iexpr << " to [" << exprs[iexpr] << "]" 
+		    << (columns[iexpr] ? "" : " (formula)");
+    }
+  }
+  
+  //
+  // without formulas only the branches holding the leaves (and the array lengths) 
+  // need to be read
+  //
+  if(!use_formulas)
+  {
+    tptr->SetBranchStatus("*", false);
+    for(unsigned iexpr = 0; iexpr < exprs.size(); ++iexpr)
+    {
+      TLeaf* leaf = columns[iexpr]->get_leaf();
+      if(leaf->GetLeafCount() != NULL)
+      {
+	tptr->SetBranchStatus(leaf->GetLeafCount()->GetBranch()->GetName(), true);
+      }
+      tptr->SetBranchStatus(leaf->GetBranch()->GetName(), true);
+    }
   }
-  boost::shared_ptr<TTreeFormula> wgt_formula(new TTreeFormula("weight", weight_expression.c_str(), tptr.get()));
-  wgt_formula->SetQuickLoad(true);
+  tptr->AddBranchToCache("*", true);
+  
+  vector<TBranch*> branches;
+  integer_t itree = -1;
   
   integer_t ipt = 0;
   for(integer_t ientry = 0; ientry < max_entries; ++ientry)
   {    
-    int nb = tptr->GetEntry((int)ientry);
+    Long64_t ilocal = tptr->LoadTree(ientry);
+    if(ilocal < 0)
+    {
+      logger::log() << msg::ERROR << "error reading entry #" << ientry << " in ntuple" ;
+      return false;
+    }
+    
+    if(tptr->GetTreeNumber() != itree)
+    {
+      //
+      // the leaves (and the formulas) refer to the tree that was just opened
+      //
+      itree = tptr->GetTreeNumber();
+      branches.clear();
+      for(unsigned iexpr = 0; iexpr < exprs.size(); ++iexpr)
+      {
+	if(formulas[iexpr])
+	{
+	  formulas[iexpr]->UpdateFormulaLeaves();
+	  continue;
+	}
+	if(!columns[iexpr]->update(tptr->GetTree()))
+	{
+	  logger::log() << msg::ERROR << "could not find leaf for [" << exprs[iexpr] << "] in tree #" << itree ;
+	  return false;
+	}
+	TLeaf* leaf = columns[iexpr]->get_leaf();
+	if(leaf->GetLeafCount() != NULL && 
+	   std::find(branches.begin(), branches.end(), leaf->GetLeafCount()->GetBranch()) == branches.end())
+	{
+	  branches.push_back(leaf->GetLeafCount()->GetBranch()); // array length is read before the array
+	}
+	if(std::find(branches.begin(), branches.end(), leaf->GetBranch()) == branches.end())
+	{
+	  branches.push_back(leaf->GetBranch());
+	}
+      }
+    }
+    
+    int nb = 0;
+    if(use_formulas)
+    {
+      nb = tptr->GetEntry(ientry);
+    }
+    else
+    {
+      for(unsigned ibr = 0; ibr < branches.size() && nb >= 0; ++ibr)
+      {
+	nb = branches[ibr]->GetEntry(ilocal);
+      }
+    }
     if(nb < 0)
     {
       logger::log() << msg::ERROR << "error reading entry #" << ientry << " in ntuple" ;
@@ -166,17 +638,22 @@ bool megrid::load(string file_pattern,
       logger::log() << msg::INFO << "stored [" << ipt << "] grid points" ;
     }
     
-    if(wgt_formula->EvalInstance(0) == 0)
+    real_t w = 1;
+    if(!unit_weights)
+    {
+      w = columns[_ndim] ? columns[_ndim]->value() : formulas[_ndim]->EvalInstance(0);
+    }
+    if(w == 0)
     {
       continue;
     }
     
-    _wgts[ipt] = wgt_formula->EvalInstance(0);
+    _wgts[ipt] = w;
     
-    _data[ipt] = new real_t[_ndim];
+    real_t* x = _buffer + (size_t)ipt * _ndim;
     for(integer_t idim = 0; idim < _ndim; ++idim)
     {
-      _data[ipt][idim] = dim_formulas[idim]->EvalInstance(0);
+      x[idim] = columns[idim] ? columns[idim]->value() : formulas[idim]->EvalInstance(0);
     }
     ipt += 1;
   }
@@ -188,6 +665,9 @@ bool megrid::load(string file_pattern,
   logger::log() << msg::INFO << "stored [" << ipt << "] grid points in total" ;
   logger::log() << msg::INFO << "successfully loaded " << _ndim << "-dimensional grid from [" << file_pattern << "]";
   
+  _cache_key = cache_key;
+  save_cache(_cache_key);
+  
   return true;
 }
 
@@ -197,478 +677,1630 @@ real_t megrid::pdf(real_t  x0, real_t  x1, real_t  x2, real_t  x3, real_t  x4,
 		   real_t  x5, real_t  x6, real_t  x7, real_t  x8, real_t  x9, 
 		   real_t x10, real_t x11, real_t x12, real_t x13, real_t x14) const
 {
-  if(_ndim > 15) 
+  if(get_ndim_effective() > 15) 
   {
     logger::log() << msg::ERROR << "too many dimensions, used pdf(vector<double>) method instead" ;
     return -1;
   } 
   
-  integer_t _ndim_in = get_ndim_effective();
-  
-  vector<real_t> vec; 
-  if(_ndim_in >= 1) vec.push_back(x0);
-  if(_ndim_in >= 2) vec.push_back(x1);
-  if(_ndim_in >= 3) vec.push_back(x2);
-  if(_ndim_in >= 4) vec.push_back(x3);
-  if(_ndim_in >= 5) vec.push_back(x4);
-  if(_ndim_in >= 6) vec.push_back(x5);
-  if(_ndim_in >= 7) vec.push_back(x6);
-  if(_ndim_in >= 8) vec.push_back(x7);
-  if(_ndim_in >= 9) vec.push_back(x8);
-  if(_ndim_in >= 10) vec.push_back(x9);
-  if(_ndim_in >= 11) vec.push_back(x10);
-  if(_ndim_in >= 12) vec.push_back(x11);
-  if(_ndim_in >= 13) vec.push_back(x12);
-  if(_ndim_in >= 14) vec.push_back(x13);
-  if(_ndim_in >= 15) vec.push_back(x14);
-  return pdf(vec);
+  real_t vec[15] = { x0, x1, x2, x3, x4, x5, x6, x7, x8, x9, x10, x11, x12, x13, x14 };
+  return pdf(vec, *_workspace);
 }
 
 //////////////////////////////////////////////////////////////////////
 
 real_t megrid::pdf(const vector<real_t>& vec) const
 {
-  if(_npoints == 0 || _data == NULL || _wgts == NULL)
+  if((integer_t) vec.size() != get_ndim_effective())
+  {
+    logger::log() << msg::ERROR << "dimension mismatch in test point" ;
+    return -1;
+  }    
+  
+  return pdf(&(vec[0]), *_workspace);
+}
+
+//////////////////////////////////////////////////////////////////////
+
+real_t megrid::pdf(const real_t* x, agf::workspace& ws) const
+{
+  if(_npoints == 0 || (_data == NULL && _hbuffer == NULL) || _wgts == NULL)
   {
     logger::log() << msg::ERROR << "grid not loaded" ;
     return -1;
   }
   
-  vector<real_t> xarr;
-  std::copy(vec.begin(), vec.end(), back_inserter(xarr));
+  ws.reserve(_npoints, (_maxk == 0 ? _npoints : _maxk) + agf::configuration::KMIN, _ndim, get_ndim_effective());
+  
+  statistics stats;
+  stats.nqueries = 1;
+  
+  double t0 = agf::wall_time();
+  get_transformed_point(x, &(ws.point[0]), ws.buffer);
+  stats.t_transform = agf::wall_time() - t0;
+  
+  real_t pdf = -1;
+  bool cached = false;
+  pdfcache::value_type value;
   
-  if((integer_t) xarr.size() != get_ndim_effective())
+  if(_pdf_cache != NULL)
   {
-    logger::log() << msg::ERROR << "dimension mismatch in test point" ;
-    return -1;
-  }    
+    //
+    // the key includes the settings that change the estimate, s.t. values 
+    // calculated with other settings are never returned (and age out)
+    //
+    double tags[] = { _wc, (double)_maxk, _mindelta, (double)_option_pdf, (double)_option_solver, (double)_option_precision };
+    _pdf_cache->make_key(&(ws.point[0]), _ndim, tags, sizeof(tags) / sizeof(double), ws.key);
+#pragma omp critical(megrid_pdf_cache)
+    cached = _pdf_cache->find(ws.key, value);
+  }
+  
+  if(cached)
+  {
+    pdf = value.pdf;
+    ws.diag = value.diag;
+    ws.diag.t_scan = 0;
+    ws.diag.t_select = 0;
+    stats.ncache_hits = 1;
+  }
+  else
+  {
+    pdf = evaluate(&(ws.point[0]), ws, stats);
+    if(_pdf_cache != NULL && pdf >= 0)
+    {
+      value.pdf = pdf;
+      value.diag = ws.diag;
+      stats.ncache_misses = 1;
+#pragma omp critical(megrid_pdf_cache)
+      _pdf_cache->insert(ws.key, value);
+    }
+  }
   
-  xarr = get_transformed_point(xarr);
+  //
+  // callers with their own workspace may run concurrently
+  //
+#pragma omp critical(megrid_stats)
+  _stats += stats;
   
-  if((integer_t) xarr.size() != get_ndim())
+  return pdf;
+}
+
+//////////////////////////////////////////////////////////////////////
+
+real_t megrid::pdf_progressive(const vector<real_t>& vec, real_t tolerance, real_t budget) const
+{
+  if((integer_t) vec.size() != get_ndim_effective())
   {
     logger::log() << msg::ERROR << "dimension mismatch in test point" ;
     return -1;
+  }    
+  if(!build_pyramid())
+  {
+    logger::log() << msg::ERROR << "grid not loaded" ;
+    return -1;
   }
   
-  real_t* ptr_vec = &(xarr[0]);
+  agf::workspace& ws = *_workspace;
+  ws.reserve(_npoints, (_maxk == 0 ? _npoints : _maxk) + agf::configuration::KMIN, _ndim, get_ndim_effective());
   
-  integer_t kmax = (_maxk == 0 ? _npoints : _maxk);
+  statistics stats;
+  stats.nqueries = 1;
   
-  if(_option_pdf == AGF)
-  {    
-    real_t d=0;
-    real_t w=0;
-    for(integer_t ipt=0; ipt<_npoints; ++ipt)
+  double t0 = agf::wall_time();
+  get_transformed_point(&(vec[0]), &(ws.point[0]), ws.buffer);
+  stats.t_transform = agf::wall_time() - t0;
+  
+  real_t pdf = -1;
+  _progressive_error = 1;
+  _progressive_level = 0;
+  
+  double tlast = 0.; // time spent on the last level
+  integer_t nlast = 0; // number of points in the last level
+  
+  for(integer_t ilevel=0; ilevel<=(integer_t)_pyramid.size(); ++ilevel)
+  {
+    const megrid* level = this;
+    if(ilevel < (integer_t)_pyramid.size())
     {
-      d += agf::metric(_data[ipt], ptr_vec, _ndim); 
-      w += _wgts[ipt];
+      configure_level(_pyramid[ilevel]);
+      level = _pyramid[ilevel];
     }
-    if(w > 0)
-      d /= w; // total variance
-    else
-      return -1;
-    
-    double vlo = d / pow(_npoints, 2.0/_ndim) / 32.0; // NB the division factor is empirical
-    double vhi = d; 
-    
-    logger::log() << msg::DEBUG << "using variance bounds [" << vlo << "," << vhi << "]";
     
-    agf::diagnostics diag_params;
-    
-    if(_mindelta < 0)
+    if(pdf >= 0)
     {
-      double pdf = agf::pdf::adaptive<real_t>(_data, _wgts, _ndim, _npoints, ptr_vec, vlo, vhi, kmax, _wc, &diag_params);
-      logger::log() << msg::DEBUG << "filter width: " << diag_params.V << ", total W: " << diag_params.W;
-      
-      // real_t varbnds[2] = { vlo, vhi };
-      // agf_diag_param dpar;
-      // real_t pdf = agf_calc_pdf<real_t>(_data, _ndim, _npoints, ptr_vec, varbnds, kmax, _wc, &dpar); 
+      if(_progressive_error <= tolerance)
+	break;
       
-      return pdf;
+      //
+      // the time per level is taken to grow linearly with the number of points
+      // (levels are only skipped once an estimate is available)
+      //
+      double tnext = tlast * level->get_npoints() / nlast;
+      if(budget > 0 && agf::wall_time() - t0 + tnext > budget)
+	break;
     }
-    else
+    
+    double t1 = agf::wall_time();
+    real_t p = level->evaluate(&(ws.point[0]), ws, stats);
+    tlast = agf::wall_time() - t1;
+    nlast = level->get_npoints();
+    
+    if(p < 0)
     {
-      std::vector<real_t> testpdf(kmax, -1);
-      for(integer_t k=0; k<kmax; ++k)
-      {
-      	testpdf[k] = agf::pdf::adaptive<real_t>(_data, _wgts, _ndim, _npoints, ptr_vec, vlo, vhi, k + agf::configuration::KMIN, _wc, &diag_params);
-      	if(k > 0)
-      	{
-      	  if(std::fabs(testpdf[k] - testpdf[k-1]) / (testpdf[k] + testpdf[k-1]) < _mindelta)
-      	    return testpdf[k];
-      	}
-      }
-      logger::log() << msg::INFO << "failed to find k within bounds [" << agf::configuration::KMIN << "," << kmax << "]";
-      return testpdf.back();
+      LOG_RATE_LIMITED( msg::WARN, "failed to evaluate the pdf at pyramid level [" << ilevel << "]" );
+      continue;
     }
-  }
-  else
-  {    
-    if(_mindelta < 0)
+    if(_option_pdf == KNN && level != this && level->_sum_wgts > 0)
     {
-      return agf::pdf::knn<real_t>(_data, _wgts, _ndim, _npoints, ptr_vec, kmax, &(_grid_dimensions[0]));
+      //
+      // the KNN estimate is not divided by the number of grid points (unlike 
+      // AGF), so it is scaled by the fraction of the total weight in the level
+      //
+      p *= _sum_wgts / level->_sum_wgts;
     }
-    else
+    if(pdf >= 0)
     {
-      std::vector<real_t> testpdf(kmax, -1);
-      for(integer_t k=0; k<kmax; ++k)
-      {
-	testpdf[k] = agf::pdf::knn<real_t>(_data, _wgts, _ndim, _npoints, ptr_vec, k + agf::configuration::KMIN, &(_grid_dimensions[0]));
-	if(k > 0)
-	{
-	  if(std::fabs(testpdf[k] - testpdf[k-1]) / (testpdf[k] + testpdf[k-1]) < _mindelta)
-	    return testpdf[k];
-	}
-      }
-      logger::log() << msg::INFO << "failed to find k within bounds [" << agf::configuration::KMIN << "," << kmax << "]";
-      return testpdf.back();
+      _progressive_error = (p > 0 ? std::fabs(p - pdf) / p : (pdf > 0 ? 1 : 0));
     }
+    pdf = p;
+    _progressive_level = ilevel;
   }
-}
+  
+  LOG_DEBUG( "progressive pdf: " << pdf << " at level [" << _progressive_level << "] with estimated error " << _progressive_error );
+  
+#pragma omp critical(megrid_stats)
+  _stats += stats;
+  
+  return pdf;
+}
+
+//////////////////////////////////////////////////////////////////////
+
+bool megrid::pdf_batch(const real_t* points, size_t n, real_t* out) const
+{
+  if(_npoints == 0 || (_data == NULL && _hbuffer == NULL) || _wgts == NULL)
+  {
+    logger::log() << msg::ERROR << "grid not loaded" ;
+    return false;
+  }
+  
+  integer_t ndim_in = get_ndim_effective();
+  
+  bool status = true;
+  for(size_t ipt=0; ipt<n; ++ipt)
+  {
+    out[ipt] = pdf(points + ipt * ndim_in, *_workspace);
+    if(out[ipt] < 0)
+    {
+      status = false;
+    }
+  }
+  
+  LOG_DEBUG( "evaluated pdf for batch of [" << n << "] points" );
+  
+  return status;
+}
+
+//////////////////////////////////////////////////////////////////////
+
+real_t megrid::evaluate(real_t* ptr_vec, agf::workspace& ws, statistics& stats) const
+{
+  integer_t kmax = (_maxk == 0 ? _npoints : min(_maxk, _npoints));
+  
+  agf::diagnostics& diag_params = ws.diag;
+  diag_params.nd = 0;
+  diag_params.f = 0;
+  diag_params.W = 0;
+  diag_params.V = 0;
+  diag_params.dp = 0;
+  diag_params.nb = 0;
+  diag_params.t_scan = 0;
+  diag_params.t_select = 0;
+  
+  double t0 = agf::wall_time();
+  
+  real_t pdf = -1;
+  integer_t k = kmax; // number of neighbours used in the final estimate
+  
+  if(_option_pdf != KNN)
+  {    
+    //
+    // sum_{i} |x_{i} - v|^{2} = sum_{i} |x_{i}|^{2} - 2 v.sum_{i} x_{i} + N |v|^{2}
+    //
+    double d=_moment2;
+    double w=_sum_wgts;
+    for(integer_t idim=0; idim<_ndim; ++idim)
+    {
+      d += (_npoints * (double)ptr_vec[idim] - 2 * _moment1[idim]) * ptr_vec[idim];
+    }
+    if(w > 0)
+      d = (d > 0 ? d : 0) / w; // total variance
+    else
+      return -1;
+    
+    double vlo = d / pow(_npoints, 2.0/_ndim) / 32.0; // NB the division factor is empirical
+    double vhi = d; 
+    
+    LOG_DEBUG( "using variance bounds [" << vlo << "," << vhi << "]" );
+    
+    if(_mindelta < 0 && _option_pdf == AGF_RADIUS)
+    {
+      //
+      // start from the radius at which the weights vanish for the lower bound on 
+      // the filter width; the radius is expanded while the points within it can
+      // not reach W_{c} (within the bracket on the filter width), and once more if
+      // the solution still has weights above precision at the radius (adding 
+      // points only lowers the solution, so that pass is final)
+      //
+      double r2 = AGF_RADIUS_CUT * vlo;
+      while(true)
+      {
+	k = nearest_within(ptr_vec, kmax, r2, ws);
+	bool complete = (k == kmax); // the radius holds all k_{max} nearest neighbours, as for AGF
+	if(!complete)
+	{
+	  double sumw = 0.;
+	  for(integer_t i=0; i<k; ++i)
+	  {
+	    sumw += ws.clwtnearest[i];
+	  }
+	  if(sumw <= _wc)
+	  {
+	    r2 = (r2 > 0 ? 4 * r2 : (std::numeric_limits<double>::max)());
+	    continue;
+	  }
+	}
+	
+	pdf = agf::pdf::adaptive<real_t>(&(ws.knearest[0]), &(ws.clwtnearest[0]), _ndim, _npoints, vlo, vhi, k, _wc, &diag_params, &(ws.weight[0]), 
+					 (agf::solver_type)_option_solver);
+	stats.niterations += max(diag_params.nd, 0);
+	stats.nexpansions += diag_params.nb;
+	
+	if(complete)
+	  break;
+	if(diag_params.nd < 0)
+	{
+	  //
+	  // W_{c} is only reached beyond the bracket on the filter width, so the 
+	  // radius is too small in any case
+	  //
+	  r2 = (r2 > 0 ? 4 * r2 : (std::numeric_limits<double>::max)());
+	  continue;
+	}
+	double r2min = AGF_RADIUS_CUT * diag_params.V;
+	if(r2min <= r2)
+	  break;
+	r2 = r2min;
+      }
+      LOG_DEBUG( "filter width: " << diag_params.V << ", total W: " << diag_params.W << " from [" << k << "] points within the radius" );
+    }
+    else if(_mindelta < 0)
+    {
+      nearest(ptr_vec, kmax, ws);
+      
+      pdf = agf::pdf::adaptive<real_t>(&(ws.knearest[0]), &(ws.clwtnearest[0]), _ndim, _npoints, vlo, vhi, kmax, _wc, &diag_params, &(ws.weight[0]), 
+					 (agf::solver_type)_option_solver);
+      stats.niterations += max(diag_params.nd, 0);
+      stats.nexpansions += diag_params.nb;
+      LOG_DEBUG( "filter width: " << diag_params.V << ", total W: " << diag_params.W );
+      
+      // real_t varbnds[2] = { vlo, vhi };
+      // agf_diag_param dpar;
+      // real_t pdf = agf_calc_pdf<real_t>(_data, _ndim, _npoints, ptr_vec, varbnds, kmax, _wc, &dpar); 
+    }
+    else
+    {
+      //
+      // the neighbours are found once for the largest k, and the pdf is evaluated
+      // on growing prefixes of the (ordered) list; adding a neighbour can only increase
+      // the total weight at a fixed filter width, so the previous solution is used to
+      // tighten the upper bracket of the next
+      //
+      integer_t nk = min(kmax + agf::configuration::KMIN - 1, _npoints);
+      nearest(ptr_vec, nk, ws);
+      
+      double hi = vhi;
+      real_t lastpdf = -1;
+      for(integer_t ik=0; ik<kmax; ++ik)
+      {
+	k = min(ik + agf::configuration::KMIN, nk);
+	pdf = agf::pdf::adaptive<real_t>(&(ws.knearest[0]), &(ws.clwtnearest[0]), _ndim, _npoints, vlo, hi, k, _wc, &diag_params, &(ws.weight[0]), 
+				       (agf::solver_type)_option_solver);
+	stats.niterations += max(diag_params.nd, 0);
+	stats.nexpansions += diag_params.nb;
+	if(diag_params.nd >= 0 && diag_params.V > vlo)
+	{
+	  hi = min(2 * diag_params.V, vhi);
+	}
+	if(ik > 0)
+	{
+	  if(std::fabs(pdf - lastpdf) / (pdf + lastpdf) < _mindelta)
+	    break;
+	}
+	lastpdf = pdf;
+	if(ik == kmax - 1)
+	{
+	  LOG_RATE_LIMITED( msg::INFO, "failed to find k within bounds [" << agf::configuration::KMIN << "," << kmax << "]" );
+	}
+      }
+    }
+  }
+  else
+  {    
+    if(_mindelta < 0)
+    {
+      nearest(ptr_vec, kmax, ws);
+      
+      pdf = agf::pdf::knn<real_t>(&(ws.knearest[0]), &(ws.clwtnearest[0]), _ndim, kmax, &(_grid_dimensions[0]));
+    }
+    else
+    {
+      integer_t nk = min(kmax + agf::configuration::KMIN - 1, _npoints);
+      nearest(ptr_vec, nk, ws);
+      
+      real_t lastpdf = -1;
+      for(integer_t ik=0; ik<kmax; ++ik)
+      {
+	k = min(ik + agf::configuration::KMIN, nk);
+	pdf = agf::pdf::knn<real_t>(&(ws.knearest[0]), &(ws.clwtnearest[0]), _ndim, k, &(_grid_dimensions[0]));
+	if(ik > 0)
+	{
+	  if(std::fabs(pdf - lastpdf) / (pdf + lastpdf) < _mindelta)
+	    break;
+	}
+	lastpdf = pdf;
+	if(ik == kmax - 1)
+	{
+	  LOG_RATE_LIMITED( msg::INFO, "failed to find k within bounds [" << agf::configuration::KMIN << "," << kmax << "]" );
+	}
+      }
+    }
+  }
+  
+  if(_option_precision == HALF && k > 0)
+  {
+    //
+    // first order estimate of the relative change in the pdf if each neighbour
+    // is moved by the RMS rounding distance of the grid points
+    //
+    double delta = get_precision_error();
+    if(_option_pdf != KNN)
+    {
+      double sumw = 0., sumwd = 0.;
+      for(integer_t i=0; i<k; ++i)
+      {
+	sumw += ws.weight[i];
+	sumwd += ws.weight[i] * std::sqrt(ws.knearest[i]);
+      }
+      if(sumw > 0 && diag_params.V > 0)
+      {
+	diag_params.dp = delta * sumwd / sumw / diag_params.V;
+      }
+    }
+    else if(ws.knearest[k-1] > 0)
+    {
+      diag_params.dp = _ndim * delta / std::sqrt(ws.knearest[k-1]);
+    }
+    LOG_DEBUG( "estimated relative error due to half precision grid: " << diag_params.dp );
+  }
+  
+  stats.t_scan += diag_params.t_scan;
+  stats.t_select += diag_params.t_select;
+  stats.t_optimize += agf::wall_time() - t0 - diag_params.t_scan - diag_params.t_select;
+  
+  return pdf;
+}
+
+//////////////////////////////////////////////////////////////////////
+
+void megrid::nearest(real_t* x, integer_t k, agf::workspace& ws) const
+{
+  //
+  // the spatial index is only worth it if a subset of the grid is used
+  //
+  if(_option_index == KDTREE && k < _npoints && build_index())
+  {
+    //
+    // the search & selection are interleaved, so both are counted as the scan
+    //
+    double t0 = agf::wall_time();
+    _index->nearest(x, k, &(ws.knearest[0]), &(ws.clwtnearest[0]), ws);
+    ws.diag.t_scan = agf::wall_time() - t0;
+    ws.diag.t_select = 0;
+  }
+  else if(_option_precision == HALF)
+  {
+    agf::nearest<real_t>(_hbuffer, _wgts, _ndim, _npoints, x, k, &(ws.knearest[0]), &(ws.clwtnearest[0]), _nthreads, &(ws.dsqr[0]), &(ws.diag));
+  }
+  else
+  {
+    agf::nearest<real_t>(_data, _wgts, _ndim, _npoints, x, k, &(ws.knearest[0]), &(ws.clwtnearest[0]), _nthreads, &(ws.dsqr[0]), &(ws.diag));
+  }
+}
+
+//////////////////////////////////////////////////////////////////////
+
+integer_t megrid::nearest_within(real_t* x, integer_t k, double r2, agf::workspace& ws) const
+{
+  double t0 = agf::wall_time();
+  
+  real_t r = r2 < (std::numeric_limits<real_t>::max)() ? (real_t)r2 : (std::numeric_limits<real_t>::max)();
+  std::pair<real_t, real_t>* dsqr = &(ws.dsqr[0]);
+  integer_t n = 0;
+  
+  if(_option_index == KDTREE && build_index())
+  {
+    n = _index->range(x, r, dsqr, ws);
+  }
+  else if(_option_precision == HALF)
+  {
+    for(integer_t ipt=0; ipt<_npoints; ++ipt)
+    {
+      real_t d = agf::metric<real_t>(x, _hbuffer + (size_t)ipt * _ndim, _ndim);
+      if(d <= r)
+      {
+	dsqr[n++] = std::pair<real_t, real_t>(d, _wgts[ipt]);
+      }
+    }
+  }
+  else
+  {
+    for(integer_t ipt=0; ipt<_npoints; ++ipt)
+    {
+      real_t d = agf::metric<real_t>(x, _data[ipt], _ndim);
+      if(d <= r)
+      {
+	dsqr[n++] = std::pair<real_t, real_t>(d, _wgts[ipt]);
+      }
+    }
+  }
+  
+  double t1 = agf::wall_time();
+  
+  //
+  // order by (distance, weight) as in agf::nearest, s.t. with at least k points 
+  // within the radius the neighbours are identical
+  //
+  k = min(k, n);
+  std::partial_sort(dsqr, dsqr + k, dsqr + n);
+  for(integer_t i=0; i<k; ++i)
+  {
+    ws.knearest[i] = dsqr[i].first;
+    ws.clwtnearest[i] = dsqr[i].second;
+  }
+  
+  ws.diag.t_scan += t1 - t0;
+  ws.diag.t_select += agf::wall_time() - t1;
+  
+  return k;
+}
+
+//////////////////////////////////////////////////////////////////////
+
+void megrid::clear() 
+{
+  invalidate();
+  release_data();
+  release(_hbuffer);
+  release<real_t>(_wgts);
+  unmap(NULL);
+  
+  _npoints   = 0;
+  _nreserved = 0;
+  _precision_sumsq = 0.;
+  _cache_key = "";
+  
+  _is_locked = false;
+}
+
+//////////////////////////////////////////////////////////////////////
+
+void megrid::release_index() const
+{
+  if(_index != NULL)
+  {
+    delete _index;
+  }
+  _index = NULL;
+}
+
+//////////////////////////////////////////////////////////////////////
+
+void megrid::release_pyramid() const
+{
+  for(unsigned ilevel=0; ilevel<_pyramid.size(); ++ilevel)
+  {
+    delete _pyramid[ilevel];
+  }
+  _pyramid.clear();
+}
+
+//////////////////////////////////////////////////////////////////////
+
+void megrid::invalidate() const
+{
+  release_index();
+  release_pyramid();
+  
+  if(_pdf_cache != NULL)
+  {
+    _pdf_cache->clear();
+  }
+}
+
+//////////////////////////////////////////////////////////////////////
+
+void megrid::set_pdf_cache_size(integer_t n)
+{
+  _pdf_cache_size = n > 0 ? n : 0;
+  delete _pdf_cache;
+  _pdf_cache = (_pdf_cache_size > 0 ? new pdfcache(_pdf_cache_size, _pdf_cache_tolerance) : NULL);
+}
+
+//////////////////////////////////////////////////////////////////////
+
+void megrid::set_pdf_cache_tolerance(real_t tol)
+{
+  _pdf_cache_tolerance = tol > 0 ? tol : 0;
+  set_pdf_cache_size(_pdf_cache_size); // cached values were matched with the old tolerance
+}
+
+//////////////////////////////////////////////////////////////////////
+
+void megrid::set_pyramid_levels(integer_t n)
+{
+  _pyramid_levels = n > 0 ? n : 0;
+  release_pyramid();
+}
+
+//////////////////////////////////////////////////////////////////////
+
+void megrid::set_pyramid_ratio(real_t r)
+{
+  if(!(r > 0 && r < 1))
+  {
+    logger::log() << msg::ERROR << "pyramid ratio [" << r << "] must lie in (0, 1)";
+    return;
+  }
+  _pyramid_ratio = r;
+  release_pyramid();
+}
+
+//////////////////////////////////////////////////////////////////////
+
+bool megrid::build_pyramid() const
+{
+  if(_npoints == 0 || (_data == NULL && _hbuffer == NULL) || _wgts == NULL)
+  {
+    return false;
+  }
+  if(!_pyramid.empty() || _pyramid_levels == 0)
+  {
+    return true;
+  }
+  
+  //
+  // each level takes the first points of one random permutation of the grid, 
+  // so the levels are nested (the points are taken from the transformed grid, 
+  // with their weights unchanged; KNN estimates from a level are rescaled to 
+  // the total weight of the grid in pdf_progressive)
+  //
+  vector<integer_t> perm(_npoints);
+  for(integer_t ipt=0; ipt<_npoints; ++ipt)
+  {
+    perm[ipt] = ipt;
+  }
+  random_index rnd(_npoints);
+  std::random_shuffle(perm.begin(), perm.end(), rnd);
+  
+  vector<real_t> p(_ndim);
+  for(integer_t ilevel=_pyramid_levels; ilevel>0; --ilevel)
+  {
+    integer_t n = max((integer_t)(std::pow((double)_pyramid_ratio, ilevel) * _npoints), agf::configuration::KMIN);
+    if(n >= _npoints || (!_pyramid.empty() && n <= _pyramid.back()->get_npoints()))
+    {
+      continue;
+    }
+    
+    std::stringstream name_sstr;
+    name_sstr << _name << "_pyramid" << _pyramid.size();
+    megrid* level = new megrid(name_sstr.str(), _ndim, _option_precision);
+    level->reserve(n);
+    for(integer_t ipt=0; ipt<n; ++ipt)
+    {
+      get_point(perm[ipt], &(p[0]));
+      level->add_point(p, _wgts[perm[ipt]]);
+    }
+    configure_level(level);
+    _pyramid.push_back(level);
+    
+    LOG_DEBUG( "built pyramid level [" << _pyramid.size() - 1 << "] with [" << n << "] grid points" );
+  }
+  
+  return true;
+}
+
+//////////////////////////////////////////////////////////////////////
+
+void megrid::configure_level(megrid* level) const
+{
+  level->set_wc(_wc);
+  level->set_maxk(_maxk);
+  level->set_mindelta(_mindelta);
+  level->set_option_pdf(_option_pdf);
+  level->set_option_solver(_option_solver);
+  level->set_nthreads(_nthreads);
+  level->_grid_dimensions = _grid_dimensions; // KNN estimates are normalised to the extent of the full grid
+  if(level->get_option_index() != _option_index)
+  {
+    level->set_option_index(_option_index);
+  }
+}
+
+//////////////////////////////////////////////////////////////////////
+
+void megrid::set_option_index(index_type t)
+{
+  if(t != _option_index)
+  {
+    release_index();
+  }
+  _option_index = t;
+}
+
+//////////////////////////////////////////////////////////////////////
+
+bool megrid::build_index() const
+{
+  if(_option_index != KDTREE || _npoints == 0 || _data == NULL)
+  {
+    return false;
+  }
+  if(_index == NULL)
+  {
+    logger::log() << msg::INFO << "building k-d tree index over [" << _npoints << "] grid points";
+    _index = new kdtree(_data, _wgts, _ndim, _npoints);
+  }
+  return true;
+}
+
+//////////////////////////////////////////////////////////////////////
+
+bool megrid::set_option_precision(precision_type t)
+{
+  if(t == _option_precision)
+  {
+    return true;
+  }
+  
+  if(t == HALF)
+  {
+    half* local_hbuffer = NULL;
+    allocate(local_hbuffer, _nreserved, _ndim);
+    
+    double sumsq = 0.;
+    double maxsq = 0.;
+    for(integer_t ipt=0; ipt<_npoints; ++ipt)
+    {
+      double dsq = 0.;
+      half* hp = local_hbuffer + (size_t)ipt * _ndim;
+      for(integer_t idim=0; idim<_ndim; ++idim)
+      {
+	hp[idim] = half(_data[ipt][idim]);
+	if(!is_representable(_data[ipt][idim], hp[idim]))
+	{
+	  logger::log() << msg::ERROR << "grid coordinate [" << _data[ipt][idim] << "] is out of range for half precision, " 
+			<< "keeping single precision (apply a transformation to normalise the grid first)";
+	  release(local_hbuffer);
+	  return false;
+	}
+	dsq += std::pow((double)_data[ipt][idim] - (float)hp[idim], 2);
+      }
+      sumsq += dsq;
+      maxsq = max(maxsq, dsq);
+    }
+    
+    release_data();
+    _hbuffer = local_hbuffer;
+    _precision_sumsq = sumsq;
+    _option_precision = HALF;
+    
+    logger::log() << msg::INFO << "stored grid in half precision, RMS (max) distance moved by grid points is [" 
+		  << get_precision_error() << "] ([" << std::sqrt(maxsq) << "])";
+    if(_option_index == KDTREE)
+    {
+      logger::log() << msg::WARN << "spatial index is not available for half precision grids, using brute-force search";
+    }
+  }
+  else
+  {
+    real_array_t* local_data = NULL;
+    real_t* local_buffer = NULL;
+    allocate(local_data, local_buffer, _nreserved, _ndim);
+    
+    for(size_t i=0; i<(size_t)_npoints * _ndim; ++i)
+    {
+      local_buffer[i] = _hbuffer[i];
+    }
+    
+    release(_hbuffer);
+    _data = local_data;
+    _buffer = local_buffer;
+    _precision_sumsq = 0.;
+    _option_precision = SINGLE;
+    
+    logger::log() << msg::INFO << "stored grid in single precision";
+  }
+  
+  set_metadata();
+  
+  return true;
+}
+
+//////////////////////////////////////////////////////////////////////
+
+real_t megrid::get_precision_error() const
+{
+  return _npoints > 0 ? std::sqrt(_precision_sumsq / _npoints) : 0;
+}
+
+//////////////////////////////////////////////////////////////////////
+
+real_t megrid::get_pdf_precision_error() const
+{
+  return _workspace->diag.dp;
+}
+
+//////////////////////////////////////////////////////////////////////
+
+real_t megrid::get_coordinate(integer_t ipt, integer_t idim) const
+{
+  if(_option_precision == HALF)
+  {
+    return _hbuffer[(size_t)ipt * _ndim + idim];
+  }
+  return _data[ipt][idim];
+}
+
+//////////////////////////////////////////////////////////////////////
+
+void megrid::get_point(integer_t ipt, real_t* x) const
+{
+  if(_option_precision == HALF)
+  {
+    const half* hp = _hbuffer + (size_t)ipt * _ndim;
+    for(integer_t idim=0; idim<_ndim; ++idim)
+    {
+      x[idim] = hp[idim];
+    }
+  }
+  else
+  {
+    std::copy(_data[ipt], _data[ipt] + _ndim, x);
+  }
+}
+
+//////////////////////////////////////////////////////////////////////
+
+template<typename T>
+void megrid::release(T*& arr) const
+{
+  if(arr != 0x0)
+  {
+    delete[] arr;
+  }
+  arr = 0x0;
+}
+
+//////////////////////////////////////////////////////////////////////
+
+void megrid::allocate(real_array_t*& arr, real_t*& buffer, integer_t len, integer_t dim) const
+{
+  arr = NULL;
+  buffer = NULL;
+  if(len <= 0 || dim <= 0)
+  {
+    return;
+  }
+  
+  buffer = static_cast<real_t*>(allocate_block((size_t)len * dim * sizeof(real_t)));
+  
+  arr = new real_array_t[len];
+  for(integer_t irow = 0; irow < len; ++irow) 
+  {
+    arr[irow] = buffer + (size_t)irow * dim;
+  }
+}
+
+//////////////////////////////////////////////////////////////////////
+
+void megrid::allocate(half*& buffer, integer_t len, integer_t dim) const
+{
+  buffer = NULL;
+  if(len <= 0 || dim <= 0)
+  {
+    return;
+  }
+  buffer = static_cast<half*>(allocate_block((size_t)len * dim * sizeof(half)));
+}
+
+//////////////////////////////////////////////////////////////////////
+
+void megrid::release(real_array_t*& arr, real_t*& buffer) const
+{
+  release<real_array_t>(arr);
+  if(buffer != NULL && !unmap(buffer))
+  {
+    free(buffer);
+  }
+  buffer = NULL;
+}
+
+//////////////////////////////////////////////////////////////////////
+
+void megrid::release(half*& buffer) const
+{
+  if(buffer != NULL && !unmap(buffer))
+  {
+    free(buffer);
+  }
+  buffer = NULL;
+}
+
+//////////////////////////////////////////////////////////////////////
+
+void megrid::release_data()
+{
+  release(_data, _buffer);
+  for(unsigned iseg=0; iseg<_segments.size(); ++iseg)
+  {
+    free(_segments[iseg]);
+  }
+  _segments.clear();
+}
+
+//////////////////////////////////////////////////////////////////////
+
+bool megrid::unmap(const void* buffer) const
+{
+  if(_mapping != NULL && (buffer == NULL || _mapping->contains(buffer)))
+  {
+    delete _mapping;
+    _mapping = NULL;
+    return true;
+  }
+  return false;
+}
+
+//////////////////////////////////////////////////////////////////////
+
+bool megrid::resample(unsigned int nsample, double dmax)
+{
+  if(_option_precision == HALF)
+  {
+    set_option_precision(SINGLE);
+    bool status = resample(nsample, dmax);
+    set_option_precision(HALF);
+    return status;
+  }
+  
+  // if(_is_locked)
+  // {
+  //   logger::log() << msg::ERROR << "grid is locked, cannot resample";
+  //   return false;
+  // }
+  
+  if(_npoints < (integer_t)nsample)
+  {
+    logger::log() << msg::ERROR << "grid size too small, cannot resample";
+    return false;
+  }
+  
+  _cache_key = ""; // modified grids are not cached
+  
+  invalidate(); // the points are modified in place
+  
+  for(unsigned isample=0; isample < nsample && _npoints > 1; ++isample)
+  {
+    //
+    // in each iteration every point is merged at most once: the pairs of points 
+    // that are each other's nearest neighbour are merged & removed from the index,
+    // then the points whose nearest neighbour was removed look for a new one among
+    // the points left, until no pairs are found
+    //
+    kdtree index(_data, _wgts, _ndim, _npoints);
+    
+    std::vector<integer_t> nn(_npoints, -1);
+    std::vector<real_t> nnd(_npoints, 0.);
+    std::vector<char> done(_npoints, 0); // merged in this iteration
+    std::vector<char> merged(_npoints, 0); // merged into another point (to be dropped)
+    
+    std::vector<integer_t> query(index.get_permutation()); // nearby points are queried together
+    
+    integer_t nmerged = 0;
+    while(!query.empty())
+    {
+      integer_t nquery = query.size();
+#pragma omp parallel num_threads(_nthreads)
+      {
+	agf::workspace ws;
+#pragma omp for schedule(static)
+	for(integer_t iq=0; iq<nquery; ++iq)
+	{
+	  integer_t ipt = query[iq];
+	  nn[ipt] = index.nearest_index(_data[ipt], nnd[ipt], ws, ipt);
+	}
+      }
+      
+      integer_t npairs = 0;
+      for(integer_t ipt=0; ipt<_npoints; ++ipt)
+      {
+	integer_t jpt = nn[ipt];
+	if(done[ipt] || jpt <= ipt || nn[jpt] != ipt || !(dmax <= 0 || nnd[ipt] < dmax) || nnd[ipt] <= 0)
+	{
+	  continue;
+	}
+	merge_points(ipt, jpt);
+	done[ipt] = done[jpt] = 1;
+	merged[jpt] = 1;
+	index.remove(ipt);
+	index.remove(jpt);
+	++npairs;
+      }
+      if(npairs == 0)
+      {
+	break;
+      }
+      nmerged += npairs;
+      
+      query.clear();
+      for(integer_t ipt=0; ipt<_npoints; ++ipt)
+      {
+	if(!done[ipt] && nn[ipt] >= 0 && done[nn[ipt]])
+	{
+	  query.push_back(ipt);
+	}
+      }
+    }
+    
+    drop_points(merged);
+    
+    logger::log() << msg::INFO << "resampling iteration " << isample << ", merged [" << nmerged << "] pairs, new grid population is " << _npoints;
+    
+    if(nmerged == 0)
+    {
+      break;
+    }
+  } // loop over re-sampling iterations
+  
+  set_metadata();
+  
+  return true;
+}
+
+//////////////////////////////////////////////////////////////////////
+
+bool megrid::apply_transformation(transform::itransformation_base* t, bool retain, bool force_configure)
+{
+  if(_option_precision == HALF)
+  {
+    //
+    // the transformations work on (and are configured from) single precision data
+    //
+    set_option_precision(SINGLE);
+    bool status = apply_transformation(t, retain, force_configure);
+    set_option_precision(HALF);
+    return status;
+  }
+  
+  //
+  // open the cached result if the same transformation was applied to this grid before
+  //
+  string cache_key;
+  if(_cache_key.size() > 0)
+  {
+    std::stringstream description;
+    description << _cache_key << "\n" << retain << " " << force_configure << " ";
+    t->write(description);
+    cache_key = gridio::fingerprint(description.str());
+    
+    string status;
+    string name;
+    string cache_file = get_cache_file(cache_key);
+    std::ifstream ifs((cache_file + ".transform").c_str());
+    if(ifs && gridio::file_status(cache_file, status) && 
+       (ifs >> name) && name == t->get_name() && t->read(ifs) &&
+       open(cache_file, false))
+    {
+      if(retain)
+      {
+	_transformations.push_back(t);
+	compile_transformations();
+      }
+      _cache_key = cache_key;
+      _is_locked = true;
+      logger::log() << msg::INFO << "opened cached grid [" << cache_file << "] after [" << name << "] transformation";
+      return true;
+    }
+  }
+  
+  if(t->configure(this, force_configure) &&
+     t->get_out_dim() != 0                 &&
+     (integer_t)t->get_in_dim() == get_ndim())
+  {
+    transform_data(std::vector<transform::itransformation_base*>(1, t));
+    
+    logger::log() << msg::INFO << "applied transformation to grid with dimension [" 
+		  << get_ndim() << "], final grid has dimension [" << t->get_out_dim() << "]";
+    
+    _ndim = t->get_out_dim();
+    
+    set_metadata();
+    
+    if(retain)
+    {
+      _transformations.push_back(t);
+      compile_transformations();
+    }
+    _is_locked = true;
+    
+    _cache_key = cache_key;
+    save_cache(_cache_key, t);
+    
+    return true;
+  }
+  else
+  {
+    logger::log() << msg::WARN << "failed to configure transformation";
+    return false;
+  }
+}
 
 //////////////////////////////////////////////////////////////////////
 
-void megrid::clear() 
+void megrid::queue_transformation(transform::itransformation_base* t, bool retain, bool force_configure)
 {
-  release<real_array_t>(_data, _nreserved);
-  release<real_t>(_wgts);
-  
-  _npoints   = 0;
-  _nreserved = 0;
-  
-  _is_locked = false;
+  queued_transformation q;
+  q.t = t;
+  q.retain = retain;
+  q.force_configure = force_configure;
+  _queued_transformations.push_back(q);
 }
 
 //////////////////////////////////////////////////////////////////////
 
-template<typename T>
-void megrid::release(T*& arr, integer_t len) const
+bool megrid::apply_transformations()
 {
-  // logger::log() << msg::DEBUG << "clearing array @ " << arr << " of size [" << len << "]";
-  if(arr != 0x0)
+  if(_option_precision == HALF)
+  {
+    //
+    // the transformations work on (and are configured from) single precision data
+    //
+    set_option_precision(SINGLE);
+    bool status = apply_transformations();
+    set_option_precision(HALF);
+    return status;
+  }
+  
+  std::vector<queued_transformation> queue;
+  queue.swap(_queued_transformations);
+  
+  if(_cache_key.size() > 0)
   {
-    for(integer_t irow = 0; irow < len; ++irow) 
+    //
+    // the transformations are applied one by one, s.t. each result is cached
+    //
+    unsigned iq = 0;
+    for(; iq<queue.size(); ++iq)
     {
-      // std::cout << irow << std::endl;
-      delete[] arr[irow]; 
+      if(!apply_transformation(queue[iq].t, queue[iq].retain, queue[iq].force_configure))
+      {
+	break;
+      }
     }
-    delete[] arr;
-    // logger::log() << msg::DEBUG << "cleared grid with space for [" << len << "] points";
+    return requeue_transformations(queue, iq);
   }
-  arr = 0x0;
+  
+  unsigned iq = 0;
+  while(iq < queue.size())
+  {
+    //
+    // the first transformation of each pass is configured on the grid as transformed so far
+    //
+    transform::itransformation_base* t = queue[iq].t;
+    if(!(t->configure(this, queue[iq].force_configure) &&
+	 t->get_out_dim() != 0                           &&
+	 (integer_t)t->get_in_dim() == get_ndim()))
+    {
+      logger::log() << msg::WARN << "failed to configure transformation";
+      break;
+    }
+    
+    //
+    // the transformations that follow are fused into the same pass if they can be 
+    // configured without the grid data & the dimension is unchanged up to them
+    //
+    std::vector<transform::itransformation_base*> chain(1, t);
+    unsigned jq = iq + 1;
+    for(; jq<queue.size(); ++jq)
+    {
+      transform::itransformation_base* u = queue[jq].t;
+      if(u->needs_data() || (integer_t)chain.back()->get_out_dim() != get_ndim())
+      {
+	break;
+      }
+      if(!(u->configure(this, queue[jq].force_configure) &&
+	   u->get_out_dim() != 0                           &&
+	   (integer_t)u->get_in_dim() == get_ndim()))
+      {
+	break;
+      }
+      chain.push_back(u);
+    }
+    
+    transform_data(chain);
+    
+    logger::log() << msg::INFO << "applied [" << chain.size() << "] transformation(s) to grid with dimension [" 
+		  << get_ndim() << "], final grid has dimension [" << chain.back()->get_out_dim() << "]";
+    
+    _ndim = chain.back()->get_out_dim();
+    
+    set_metadata();
+    
+    for(; iq<jq; ++iq)
+    {
+      if(queue[iq].retain)
+      {
+	_transformations.push_back(queue[iq].t);
+      }
+    }
+    _is_locked = true;
+  }
+  
+  compile_transformations();
+  
+  return requeue_transformations(queue, iq);
 }
 
 //////////////////////////////////////////////////////////////////////
 
-template<typename T>
-void megrid::release(T*& arr) const
+bool megrid::requeue_transformations(const std::vector<queued_transformation>& queue, unsigned iq)
 {
-  if(arr != 0x0)
+  if(iq >= queue.size())
   {
-    delete[] arr;
+    return true;
   }
-  arr = 0x0;
+  
+  //
+  // the transformations that were not applied are put back in front of any queued since
+  //
+  logger::log() << msg::WARN << "[" << queue.size() - iq << "] of [" << queue.size() 
+		<< "] queued transformation(s) not applied, left in queue";
+  _queued_transformations.insert(_queued_transformations.begin(), queue.begin() + iq, queue.end());
+  return false;
 }
 
 //////////////////////////////////////////////////////////////////////
 
-real_array_t* megrid::copy(const real_array_t* arr, integer_t len, integer_t dim) const
+void megrid::transform_data(const std::vector<transform::itransformation_base*>& chain)
 {
-  if(arr != 0x0)
+  invalidate(); // the index refers to the current data
+  
+  integer_t nout = chain.back()->get_out_dim();
+  bool in_place = (nout == _ndim);
+  
+  real_array_t* local_data = NULL;
+  real_t* local_buffer = NULL;
+  if(!in_place)
+  {
+    allocate(local_data, local_buffer, _nreserved, nout);
+  }
+  
+#pragma omp parallel num_threads(_nthreads)
+  {
+    std::vector<real_t> buffer;
+    std::vector<real_t> xp(nout);
+    
+#pragma omp for schedule(static)
+    for(integer_t ipt=0; ipt<_npoints; ++ipt)
+    {
+      if(in_place)
+      {
+	transform_point(chain, _data[ipt], &(xp[0]), buffer);
+	std::copy(xp.begin(), xp.end(), _data[ipt]);
+      }
+      else
+      {
+	transform_point(chain, _data[ipt], local_data[ipt], buffer);
+      }
+    }
+  }
+  
+  if(!in_place)
+  {
+    release_data();
+    _data = local_data;    
+    _buffer = local_buffer;
+  }
+  
+  if(logger::is_enabled(msg::DEBUG))
   {
-    real_array_t* clone = new real_array_t[len]; 
-    for(integer_t irow = 0; irow < len; ++irow) 
+    for(integer_t ipt=0; ipt<_npoints; ipt += max(1, _npoints / 10))
     {
-      clone[irow] = new real_t[dim];
-      std::copy(arr[irow], arr[irow] + dim, clone[irow]);
+      std::stringstream sstr;
+      for(integer_t idim=0; idim<nout; ++idim)
+      {
+	sstr << _data[ipt][idim] << " ";
+      }
+      logger::log() << msg::DEBUG << "transformed [" << ipt << "] of [" << _npoints << "]: " << sstr.str();
     }
-    return clone;
   }
-  return 0x0;
 }
 
 //////////////////////////////////////////////////////////////////////
 
-bool megrid::resample(unsigned int nsample, double dmax)
+std::vector<const transform::itransformation_base*> megrid::get_transformations() const
 {
-  // if(_is_locked)
-  // {
-  //   logger::log() << msg::ERROR << "grid is locked, cannot resample";
-  //   return false;
-  // }
+  std::vector<const transform::itransformation_base*> buff;
+  for(unsigned int it=0; it<_transformations.size(); ++it)
+  {
+    buff.push_back(_transformations[it]);
+  }
+  return buff;
+}
+
+//////////////////////////////////////////////////////////////////////
+
+bool megrid::store(const string& file_name,
+		   const string& tree_name,
+		   const string& branch_names /* bool cached */)
+{
+  if(_npoints == 0)
+  {
+    logger::log() << msg::ERROR << "grid not defined, not saving to output file";
+    return false;
+  }
   
-  if(_npoints < (integer_t)nsample)
+  TFile* fptr = new TFile(file_name.c_str(), "recreate");
+  if(fptr->IsZombie())
   {
-    logger::log() << msg::ERROR << "grid size too small, cannot resample";
+    logger::log() << msg::ERROR << "could not open file [" << file_name << "] for reading" ;
+    delete fptr;
     return false;
   }
   
-  real_t dmin, dbuf=0;
+  TTree* tptr = new TTree(tree_name.c_str(), "");
+  
+  vector<string> br_names(_ndim, "");
+  vector<real_t> br_refs(_ndim, 0.0);
   
-  list< pair< vector<real_t>, real_t> > output_cache;
-  list< pair< vector<real_t>, real_t> > local_cache;
-  list< pair< vector<real_t>, real_t> >::iterator iitr;
-  list< pair< vector<real_t>, real_t> >::iterator jitr;
-  list< pair< vector<real_t>, real_t> >::iterator jitr_min;
+  real_t weight = 0.0;
   
-  vector<real_t> apoint(_ndim, 0);
-  vector<real_t> bpoint(_ndim, 0);
+  boost::char_separator<char> sep("|");
+  boost::tokenizer< boost::char_separator<char> > tokens(branch_names, sep);
+  std::copy(tokens.begin(), tokens.end(), br_names.begin());
   
-  for(integer_t ipt=0; ipt<_npoints; ++ipt) 
+  for(integer_t ibr = 0; ibr < _ndim; ++ibr)
   {
-    std::copy(_data[ipt], _data[ipt] + _ndim, apoint.begin());
-    local_cache.push_back(pair< vector<real_t>, real_t>(apoint, _wgts[ipt]));
+    tptr->Branch(br_names[ibr].c_str(), &(br_refs[ibr]), (br_names[ibr] + "/F").c_str());
   }
+  tptr->Branch("weight", &weight, "weight/F");
   
-  logger::log() << msg::DEBUG << "created local cache of size " << local_cache.size();
+  real_array_t xarr[1];
+  xarr[0] = new real_t[_ndim];
   
-  for(unsigned isample=0; isample < nsample; ++isample)
+  for(integer_t ipt = 0; ipt < _npoints; ++ipt)
   {
-    output_cache.clear();
-    
-    iitr = local_cache.begin();
-    jitr = local_cache.begin();
-    
-    integer_t ipt = 0;
-    while(iitr != local_cache.end())
-    {
-      dmin = -1;
-      for(jitr = local_cache.begin(); jitr != local_cache.end(); ++jitr)
-      {
-	if(jitr == iitr) 
-	  continue;
-        dbuf = agf::metric<real_t>(&((*iitr).first[0]), &((*jitr).first[0]), _ndim);
-	if(dbuf < dmin || dmin < 0)
-	{
-	  dmin = dbuf;
-	  jitr_min = jitr;
-	}
-      } // nested loop over grid points
-      if((dmax <= 0 || dmin < dmax) && dmin > 0)
-      {
-	apoint = (*iitr).first;
-	bpoint = (*jitr_min).first;
-	
-	double weight = (*iitr).second + (*jitr_min).second;
-	
-	jitr = local_cache.erase(jitr_min);
-	iitr = local_cache.erase(iitr);
-	
-	for(unsigned int ix = 0; ix < (unsigned)_ndim; ++ix)
-	{
-	  apoint[ix] = (apoint[ix] + bpoint[ix]) / 2.0;
-	}
-	
-	output_cache.push_back(pair<vector<real_t>, real_t>(apoint, weight));
-      }
-      else
-      {
-	++iitr;
-      }
-      
-      if((++ipt) % (_npoints / 20) == 0)
-	logger::log() << msg::DEBUG << "processed " << (real_t(ipt)/_npoints)*200 << "% of grid points";
-      
-    } // loop over grid points
-    
-    std::copy(output_cache.begin(), output_cache.end(), std::back_inserter(local_cache));
+    weight = _wgts[ipt];
     
-    logger::log() << msg::INFO << "resampling iteration " << isample << ", new grid population is " << local_cache.size();
+    //
+    // @FIXME get un-transformed points ... (?)
+    //
     
-  } // loop over re-sampling iterations
+    get_point(ipt, &(br_refs[0]));
+    tptr->Fill();
+  }
   
-  _npoints = local_cache.size();
+  delete[] xarr[0];
   
-  release<real_array_t>(_data, _nreserved);
-  release<real_t>(_wgts);
+  tptr->Write();
+  fptr->Close();
+  
+  gROOT->cd();
+  
+  return true;
+}
+
+//////////////////////////////////////////////////////////////////////
+
+bool megrid::save(const string& file_name) const
+{
+  if(_npoints == 0)
+  {
+    logger::log() << msg::ERROR << "grid not defined, not saving to output file";
+    return false;
+  }
   
-  _nreserved = _npoints + INIT_RESERVE;
+  gridio::binary_header header;
+  memset(&header, 0, sizeof(header));
+  header.precision = _option_precision;
+  header.ndim = _ndim;
+  header.npoints = _npoints;
+  header.data_size = (uint64_t)_npoints * _ndim * (_option_precision == HALF ? sizeof(half) : sizeof(real_t));
+  header.precision_sumsq = _precision_sumsq;
   
-  _data = new real_array_t[_nreserved];
-  _wgts = new real_t[_nreserved];
+  std::stringstream names;
+  for(unsigned idim=0; idim<_axis_names.size(); ++idim)
+  {
+    names << (idim > 0 ? "\n" : "") << _axis_names[idim];
+  }
   
-  integer_t ipt = 0;
-  for(iitr = local_cache.begin(); iitr != local_cache.end(); ++iitr)
+  std::stringstream transformations;
+  for(unsigned it=0; it<_transformations.size(); ++it)
   {
-    _wgts[ipt] = iitr->second;
-    _data[ipt] = new real_t[_ndim];
-    std::copy(iitr->first.begin(), iitr->first.end(), (_data[ipt++]));
-  } // reconstruct the grid
+    _transformations[it]->write(transformations);
+    transformations << "\n";
+  }
   
-  set_metadata();
+  const void* data = (_option_precision == HALF ? (const void*)_hbuffer : (const void*)_buffer);
   
-  return true;
+  //
+  // the rows of a grid combined with move_grid are not contiguous, so they are gathered first
+  //
+  vector<real_t> gathered;
+  if(!_segments.empty())
+  {
+    gathered.resize((size_t)_npoints * _ndim);
+    for(integer_t ipt=0; ipt<_npoints; ++ipt)
+    {
+      std::copy(_data[ipt], _data[ipt] + _ndim, gathered.begin() + (size_t)ipt * _ndim);
+    }
+    data = &(gathered[0]);
+  }
+  
+  return gridio::write_binary(file_name, header, names.str(), transformations.str(), _wgts, data);
 }
 
 //////////////////////////////////////////////////////////////////////
 
-bool megrid::apply_transformation(transform::itransformation_base* t, bool retain, bool force_configure)
+bool megrid::open(const string& file_name, bool restore_transformations)
 {
-  if(t->configure(this, force_configure) &&
-     t->get_out_dim() != 0                 &&
-     (integer_t)t->get_in_dim() == get_ndim())
+  gridio::mapped_file* mapping = new gridio::mapped_file();
+  if(!mapping->open(file_name))
   {
-    real_array_t* local_data = new real_array_t[_nreserved];
-    for(integer_t ipt=0; ipt<_nreserved; ++ipt)
-    {
-      local_data[ipt] = new real_t[t->get_out_dim()];
-      if(ipt<_npoints)
-      {
-	(*t)(_data[ipt], local_data[ipt]);
-	if(logger::msg_level >= msg::DEBUG)
-	{
-	  if(_npoints <= 10 || ipt % (_npoints / 10) == 0)
-	  {
-	    logger::log() << msg::DEBUG << "transformed [" << ipt << "] of [" << _npoints << "]";
-	    std::stringstream sstr;
-	    for(integer_t idim=0; idim<get_ndim(); ++idim)
-	    {
-	      sstr << _data[ipt][idim] << "->" << local_data[ipt][idim] << " ";
-	    }
-	    logger::log() << msg::DEBUG << sstr.str();
-	  }
-	}
-      }
-      delete[] _data[ipt];
-    }
-    delete[] _data; // release<real_array_t>(_data, _nreserved);
-    _data = local_data;    
-    
-    logger::log() << msg::INFO << "applied transformation to grid with dimension [" 
-		  << get_ndim() << "], final grid has dimension [" << t->get_out_dim() << "]";
-    
-    _ndim = t->get_out_dim();
-    
-    set_metadata();
-    
-    if(retain)
+    delete mapping;
+    return false;
+  }
+  
+  const gridio::binary_header& header = mapping->get_header();
+  size_t size = (header.precision == HALF ? sizeof(half) : sizeof(real_t));
+  if((header.precision != SINGLE && header.precision != HALF) ||
+     header.data_size != header.npoints * header.ndim * size)
+  {
+    logger::log() << msg::ERROR << "grid data in file [" << file_name << "] is inconsistent with its header";
+    delete mapping;
+    return false;
+  }
+  
+  vector<transform::itransformation_base*> transformations;
+  std::istringstream sstr(restore_transformations ? mapping->get_transformations() : "");
+  while(!(sstr >> std::ws).eof())
+  {
+    transform::itransformation_base* t = transform::read(sstr);
+    if(t == NULL)
     {
-      _transformations.push_back(t);
+      logger::log() << msg::ERROR << "could not restore transformations from file [" << file_name << "]";
+      for(unsigned it=0; it<transformations.size(); ++it)
+      {
+	delete transformations[it];
+      }
+      delete mapping;
+      return false;
     }
-    _is_locked = true;
-    return true;
+    transformations.push_back(t);
+  }
+  
+  //
+  // the current grid is only released once the file is known to be valid
+  //
+  clear();
+  
+  _mapping = mapping;
+  _ndim = header.ndim;
+  _npoints = header.npoints;
+  _nreserved = _npoints;
+  _option_precision = (precision_type)header.precision;
+  _precision_sumsq = header.precision_sumsq;
+  
+  //
+  // the weights are copied (they are released with delete[]), the coordinates 
+  // are used in place
+  //
+  _wgts = new real_t[_npoints];
+  std::copy(mapping->get_weights(), mapping->get_weights() + _npoints, _wgts);
+  
+  if(_option_precision == HALF)
+  {
+    _hbuffer = static_cast<half*>(mapping->get_data());
   }
   else
   {
-    logger::log() << msg::WARN << "failed to configure transformation";
-    return false;
+    _buffer = static_cast<real_t*>(mapping->get_data());
+    _data = new real_array_t[_npoints];
+    for(integer_t irow = 0; irow < _npoints; ++irow) 
+    {
+      _data[irow] = _buffer + (size_t)irow * _ndim;
+    }
   }
+  
+  _axis_names.clear();
+  boost::char_separator<char> sep("\n");
+  string names = mapping->get_axis_names();
+  boost::tokenizer< boost::char_separator<char> > tokens(names, sep);
+  std::copy(tokens.begin(), tokens.end(), std::back_inserter(_axis_names));
+  
+  _transformations.insert(_transformations.end(), transformations.begin(), transformations.end());
+  _owned_transformations.insert(_owned_transformations.end(), transformations.begin(), transformations.end());
+  compile_transformations();
+  _is_locked = !_transformations.empty();
+  
+  set_metadata();
+  
+  logger::log() << msg::INFO << "opened " << _ndim << "-dimensional grid with [" << _npoints << "] points and [" 
+		<< transformations.size() << "] transformations from [" << file_name << "]";
+  
+  return true;
 }
 
 //////////////////////////////////////////////////////////////////////
 
-std::vector<const transform::itransformation_base*> megrid::get_transformations() const
+string megrid::get_cache_file(const string& key) const
 {
-  std::vector<const transform::itransformation_base*> buff;
-  for(unsigned int it=0; it<_transformations.size(); ++it)
+  if(_cache_directory.size() == 0 || key.size() == 0)
   {
-    buff.push_back(_transformations[it]);
+    return "";
   }
-  return buff;
+  return _cache_directory + "/" + key + ".grid";
 }
 
 //////////////////////////////////////////////////////////////////////
 
-bool megrid::store(const string& file_name,
-		   const string& tree_name,
-		   const string& branch_names /* bool cached */)
+bool megrid::save_cache(const string& key, const transform::itransformation_base* t) const
 {
-  if(_npoints == 0)
+  string cache_file = get_cache_file(key);
+  string status;
+  if(cache_file.size() == 0 || gridio::file_status(cache_file, status))
   {
-    logger::log() << msg::ERROR << "grid not defined, not saving to output file";
-    return false;
+    return false; // caching is disabled, or the grid was cached already (eg., by another job)
   }
   
-  TFile* fptr = new TFile(file_name.c_str(), "recreate");
-  if(fptr->IsZombie())
+  //
+  // the transformation state is written first, s.t. it exists whenever the grid does
+  //
+  if(t != NULL)
   {
-    logger::log() << msg::ERROR << "could not open file [" << file_name << "] for reading" ;
-    delete fptr;
-    return false;
+    std::stringstream tmp_name;
+    tmp_name << cache_file << ".transform.tmp" << getpid();
+    std::ofstream ofs(tmp_name.str().c_str());
+    t->write(ofs);
+    ofs << "\n";
+    ofs.close();
+    if(!ofs || rename(tmp_name.str().c_str(), (cache_file + ".transform").c_str()) != 0)
+    {
+      logger::log() << msg::WARN << "could not write transformation to cache [" << cache_file << ".transform]";
+      remove(tmp_name.str().c_str());
+      return false;
+    }
   }
   
-  TTree* tptr = new TTree(tree_name.c_str(), "");
-  
-  vector<string> br_names(_ndim, "");
-  vector<real_t> br_refs(_ndim, 0.0);
-  
-  real_t weight = 0.0;
-  
-  boost::char_separator<char> sep("|");
-  boost::tokenizer< boost::char_separator<char> > tokens(branch_names, sep);
-  std::copy(tokens.begin(), tokens.end(), br_names.begin());
-  
-  for(integer_t ibr = 0; ibr < _ndim; ++ibr)
+  logger::log() << msg::INFO << "saving grid to cache [" << cache_file << "]";
+  return save(cache_file);
+}
+
+//////////////////////////////////////////////////////////////////////
+
+void megrid::get_transformed_point(const real_t* x, real_t* xp, vector<real_t>& buffer) const
+{
+  if(_transformations.size() == 0)
   {
-    tptr->Branch(br_names[ibr].c_str(), &(br_refs[ibr]), (br_names[ibr] + "/F").c_str());
+    std::copy(x, x + _ndim, xp);
+    return;
   }
-  tptr->Branch("weight", &weight, "weight/F");
   
-  real_array_t xarr[1];
-  xarr[0] = new real_t[_ndim];
+  transform_point(_compiled_transformations, x, xp, buffer);
   
-  for(integer_t ipt = 0; ipt < _npoints; ++ipt)
+  if(logger::is_enabled(msg::DEBUG))
   {
-    weight = _wgts[ipt];
-    
-    //
-    // @FIXME get un-transformed points ... (?)
-    //
-    
-    std::copy(_data[ipt], _data[ipt] + _ndim, br_refs.begin());
-    tptr->Fill();
+    std::stringstream sstra;
+    std::stringstream sstrb;
+    for(unsigned idim=0; idim<_transformations.front()->get_in_dim(); ++idim)
+      sstra << x[idim] << " ";
+    for(unsigned idim=0; idim<_transformations.back()->get_out_dim(); ++idim)
+      sstrb << xp[idim] << " ";
+    logger::log() << msg::DEBUG << sstra.str();
+    logger::log() << msg::DEBUG << sstrb.str();    
   }
-  
-  delete[] xarr[0];
-  
-  tptr->Write();
-  fptr->Close();
-  
-  gROOT->cd();
-  
-  return true;
 }
 
 //////////////////////////////////////////////////////////////////////
 
-vector<real_t> megrid::get_transformed_point(const vector<real_t>& x) const
+void megrid::compile_transformations()
 {
+  for(unsigned it=0; it<_composed_transformations.size(); ++it)
+  {
+    delete _composed_transformations[it];
+  }
+  _composed_transformations.clear();
+  _compiled_transformations.clear();
   
-  // 
-  // loop over transformations (in order) and apply them
   //
-  
-  vector<real_t> xa(x), xb(x);
-  for(unsigned itransform=0; itransform<_transformations.size(); ++itransform)
+  // runs of two or more affine transformations are replaced by their composition,
+  // s.t. a test point is transformed with a single matrix-vector product per run
+  //
+  std::vector<double> A;
+  std::vector<double> b;
+  std::vector<const transform::itransformation_base*> run;
+  for(unsigned it=0; it<=_transformations.size(); ++it)
   {
-    xa = xb;
-    xb = vector<real_t>(_transformations[itransform]->get_out_dim());
-    (*(_transformations[itransform]))(&(xa[0]), &(xb[0]));
-    
-    if(logger::msg_level == msg::DEBUG)
+    if(it < _transformations.size() && _transformations[it]->get_affine(A, b))
+    {
+      run.push_back(_transformations[it]);
+      continue;
+    }
+    if(run.size() > 1)
+    {
+      transform::affine* composed = new transform::affine(run);
+      if(composed->get_affine(A, b))
+      {
+	_composed_transformations.push_back(composed);
+	_compiled_transformations.push_back(composed);
+	LOG_DEBUG( "composed [" << run.size() << "] transformations into one affine map" );
+	run.clear();
+      }
+      else
+      {
+	delete composed;
+      }
+    }
+    for(unsigned ir=0; ir<run.size(); ++ir)
+    {
+      _compiled_transformations.push_back(_transformations[it - run.size() + ir]);
+    }
+    run.clear();
+    if(it < _transformations.size())
     {
-      std::stringstream sstra;
-      std::stringstream sstrb;
-      for(integer_t idim=0; idim<(integer_t)xa.size(); ++idim)
-	sstra << xa[idim] << " ";
-      for(integer_t idim=0; idim<(integer_t)xb.size(); ++idim)
-	sstrb << xb[idim] << " ";
-      logger::log() << msg::DEBUG << sstra.str();
-      logger::log() << msg::DEBUG << sstrb.str();    
+      _compiled_transformations.push_back(_transformations[it]);
     }
   }
-  
-  return xb;
-} 
+}
 
 //////////////////////////////////////////////////////////////////////
 
-void megrid::get_transformed_point(const real_t* x, real_t* xp) const
+void megrid::transform_point(const vector<transform::itransformation_base*>& chain,
+			     const real_t* x, real_t* xp, vector<real_t>& buffer) const
 {
-  for(unsigned itransform=0; itransform<_transformations.size(); ++itransform)
+  // 
+  // apply the transformations in order, alternating between two halves of 
+  // the buffer for the intermediate points (buffer is only grown once)
+  //
+  
+  unsigned nmax = 0;
+  for(unsigned itransform=0; itransform<chain.size(); ++itransform)
+  {
+    nmax = max(nmax, max(chain[itransform]->get_in_dim(), 
+			 chain[itransform]->get_out_dim()));
+  }
+  if(buffer.size() < 2 * nmax)
+  {
+    buffer.resize(2 * nmax);
+  }
+  
+  const real_t* xa = x;
+  for(unsigned itransform=0; itransform<chain.size(); ++itransform)
   {
-    (*(_transformations[itransform]))(x, xp);
+    real_t* xb = (itransform + 1 == chain.size() ? xp : &(buffer[(itransform % 2) * nmax]));
+    (*(chain[itransform]))(xa, xb);
+    xa = xb;
   }
 }
 
@@ -681,9 +2313,27 @@ foam* megrid::create_foam(real_t tail_cut,
 			  unsigned nsampl,
 			  unsigned nbin) const
 {
-  if(_npoints != 0)
-    return new foam(_name, _data, _wgts, _ndim, _npoints, tail_cut, vol_frac, ncells, nmin, nsampl, nbin);
-  return NULL;
+  if(_npoints == 0)
+    return NULL;
+  
+  if(_option_precision == HALF)
+  {
+    //
+    // the foam copies the grid points, so a temporary single precision copy suffices
+    //
+    real_array_t* local_data = NULL;
+    real_t* local_buffer = NULL;
+    allocate(local_data, local_buffer, _npoints, _ndim);
+    for(integer_t ipt=0; ipt<_npoints; ++ipt)
+    {
+      get_point(ipt, local_data[ipt]);
+    }
+    foam* f = new foam(_name, local_data, _wgts, _ndim, _npoints, tail_cut, vol_frac, ncells, nmin, nsampl, nbin);
+    release(local_data, local_buffer);
+    return f;
+  }
+  
+  return new foam(_name, _data, _wgts, _ndim, _npoints, tail_cut, vol_frac, ncells, nmin, nsampl, nbin);
 }
 
 //////////////////////////////////////////////////////////////////////
@@ -692,30 +2342,60 @@ bool megrid::reserve(unsigned m)
 {
   if(m == 0) return false;
   
+  release_index(); // the index refers to the current data array
+  
   integer_t N = _nreserved + m;
   
   real_t* local_wgts = new real_t[N];
-  real_array_t* local_data = new real_array_t[N];
   
   if(_wgts != 0x0)
   {
     std::copy(_wgts, _wgts + _npoints, local_wgts);
   }  
-  for(integer_t ipt=0; ipt<N; ++ipt)
+  
+  if(_option_precision == HALF)
+  {
+    half* local_hbuffer = NULL;
+    allocate(local_hbuffer, N, _ndim);
+    if(_hbuffer != 0x0)
+    {
+      std::copy(_hbuffer, _hbuffer + (size_t)_npoints * _ndim, local_hbuffer);
+    }
+    
+    release(_hbuffer);
+    release<real_t>(_wgts);
+    
+    _nreserved = N;
+    
+    _hbuffer = local_hbuffer;
+    _wgts = local_wgts;
+    
+    return true;
+  }
+  
+  real_array_t* local_data = NULL;
+  real_t* local_buffer = NULL;
+  allocate(local_data, local_buffer, N, _ndim);
+  
+  if(!_segments.empty())
   {
-    local_data[ipt] = new real_t[_ndim];
-    if(_data != 0x0 && ipt < _npoints)
+    for(integer_t ipt=0; ipt<_npoints; ++ipt)
     {
       std::copy(_data[ipt], _data[ipt] + _ndim, local_data[ipt]);
     }
   }
+  else if(_buffer != 0x0)
+  {
+    std::copy(_buffer, _buffer + (size_t)_npoints * _ndim, local_buffer);
+  }
   
-  release<real_array_t>(_data, _nreserved);
+  release_data();
   release<real_t>(_wgts);
   
   _nreserved = N;
   
   _data = local_data;
+  _buffer = local_buffer;
   _wgts = local_wgts;
   
   return true;
@@ -734,17 +2414,46 @@ bool megrid::add_point(const vector<real_t>& p, real_t w)
   if((integer_t)p.size() != get_ndim())
     return false; 
   
+  _cache_key = ""; // modified grids are not cached
+  
   if(_nreserved <= _npoints + 1)
   {
     reserve(max(INIT_RESERVE, _npoints/100)); 
   }
   
-  std::copy(p.begin(), p.end(), _data[_npoints]); 
   _wgts[_npoints] = (real_t)w; 
   
+  if(_option_precision == HALF)
+  {
+    vector<real_t> x(_ndim);
+    half* hp = _hbuffer + (size_t)_npoints * _ndim;
+    for(integer_t idim=0; idim<_ndim; ++idim)
+    {
+      hp[idim] = half(p[idim]);
+      if(!is_representable(p[idim], hp[idim]))
+      {
+	logger::log() << msg::ERROR << "grid coordinate [" << p[idim] << "] is out of range for half precision, cannot add point";
+	return false;
+      }
+      x[idim] = hp[idim];
+    }
+    for(integer_t idim=0; idim<_ndim; ++idim)
+    {
+      _precision_sumsq += std::pow((double)p[idim] - x[idim], 2);
+    }
+    
+    _npoints += 1;
+    
+    update_metadata(&(x[0]), _wgts[_npoints-1]);
+    
+    return true;
+  }
+  
+  std::copy(p.begin(), p.end(), _data[_npoints]); 
+  
   _npoints += 1;  
   
-  set_metadata();
+  update_metadata(_data[_npoints-1], _wgts[_npoints-1]);
   
   return true;
 }
@@ -767,7 +2476,7 @@ megrid& megrid::operator+=(const std::pair<std::vector<real_t>, real_t>& weighte
 
 //////////////////////////////////////////////////////////////////////
 
-bool megrid::add_grid(const megrid& g)
+bool megrid::is_compatible(const megrid& g) const
 {
   if(g.get_ndim() != _ndim)
   {
@@ -794,20 +2503,149 @@ bool megrid::add_grid(const megrid& g)
     }
   }  
   
+  return true;
+}
+
+//////////////////////////////////////////////////////////////////////
+
+bool megrid::add_grid(const megrid& g)
+{
+  if(!is_compatible(g))
+  {
+    return false;
+  }
+  
+  _cache_key = ""; // modified grids are not cached
+  
+  if(_option_precision == HALF)
+  {
+    set_option_precision(SINGLE);
+    bool status = add_grid(g);
+    set_option_precision(HALF);
+    return status;
+  }
+  
+  //
+  // add grid data and weights
+  //
+  if(_nreserved < _npoints + g.get_npoints())
+  {
+    integer_t nadd = (_npoints + g.get_npoints()) - _nreserved;
+    reserve(nadd + INIT_RESERVE);
+  }
+  for(integer_t ipt=0; ipt<g.get_npoints(); ++ipt)
+  {
+    g.get_point(ipt, _data[ipt+_npoints]);
+    _wgts[ipt+_npoints] = g.get_weights()[ipt];
+  }
+  _npoints += g.get_npoints();
+  
+  //
+  // re-configure all transformations
+  //
+  for(unsigned int it=0; it<_transformations.size(); ++it)
+  {
+    _transformations[it]->configure(this);
+  }
+  compile_transformations();
+  
+  set_metadata();
+  
+  return true;
+}
+
+//////////////////////////////////////////////////////////////////////
+
+bool megrid::move_grid(megrid& g)
+{
+  if(&g == this)
+  {
+    logger::log() << msg::ERROR << "cannot move a grid into itself";
+    return false;
+  }
+  
+  if(!is_compatible(g))
+  {
+    return false;
+  }
+  
+  if(_option_precision == HALF || g._option_precision == HALF || g._mapping != NULL)
+  {
+    //
+    // the storage cannot be taken over, so the points are copied & released right away
+    //
+    if(!add_grid(g))
+    {
+      return false;
+    }
+    g.clear();
+    return true;
+  }
+  
+  if(g._npoints == 0)
+  {
+    return true;
+  }
+  
+  _cache_key = ""; // modified grids are not cached
+  
+  invalidate(); // the index refers to the current data array
+  
+  if(_npoints == 0)
+  {
+    //
+    // take over the storage of g as is
+    //
+    release_data();
+    release<real_t>(_wgts);
+    unmap(NULL);
+    
+    _data = g._data;
+    _buffer = g._buffer;
+    _segments.swap(g._segments);
+    _wgts = g._wgts;
+    _npoints = g._npoints;
+    _nreserved = g._nreserved;
+  }
+  else
+  {
+    //
+    // the rows of g are appended as a segment, only the row pointers & weights are copied
+    //
+    integer_t N = _npoints + g._npoints;
+    
+    real_array_t* local_data = new real_array_t[N];
+    real_t* local_wgts = new real_t[N];
+    std::copy(_data, _data + _npoints, local_data);
+    std::copy(g._data, g._data + g._npoints, local_data + _npoints);
+    std::copy(_wgts, _wgts + _npoints, local_wgts);
+    std::copy(g._wgts, g._wgts + g._npoints, local_wgts + _npoints);
+    
+    release<real_array_t>(_data);
+    release<real_t>(_wgts);
+    release<real_array_t>(g._data);
+    release<real_t>(g._wgts);
+    
+    if(g._buffer != NULL)
+    {
+      _segments.push_back(g._buffer);
+    }
+    _segments.insert(_segments.end(), g._segments.begin(), g._segments.end());
+    
+    _data = local_data;
+    _wgts = local_wgts;
+    _npoints = N;
+    _nreserved = N;
+  }
+  
   //
-  // add grid data and weights
+  // g no longer owns any storage
   //
-  if(_nreserved < _npoints + g.get_npoints())
-  {
-    integer_t nadd = (_npoints + g.get_npoints()) - _nreserved;
-    reserve(nadd + INIT_RESERVE);
-  }
-  for(integer_t ipt=0; ipt<g.get_npoints(); ++ipt)
-  {
-    std::copy(g.get_data()[ipt], g.get_data()[ipt] + _ndim, _data[ipt+_npoints]);
-    _wgts[ipt+_npoints] = g.get_weights()[ipt];
-  }
-  _npoints += g.get_npoints();
+  g._data = NULL;
+  g._buffer = NULL;
+  g._segments.clear();
+  g._wgts = NULL;
+  g.clear();
   
   //
   // re-configure all transformations
@@ -816,6 +2654,7 @@ bool megrid::add_grid(const megrid& g)
   {
     _transformations[it]->configure(this);
   }
+  compile_transformations();
   
   set_metadata();
   
@@ -834,6 +2673,16 @@ megrid& megrid::operator+=(const megrid& g)
 
 bool megrid::cluster(cluster_type t, unsigned int nclusters, char method, char metric)
 {
+  if(_option_precision == HALF)
+  {
+    set_option_precision(SINGLE);
+    bool status = cluster(t, nclusters, method, metric);
+    set_option_precision(HALF);
+    return status;
+  }
+  
+  _cache_key = ""; // modified grids are not cached
+  
   switch(t)
   {
     case KMEANS:
@@ -842,6 +2691,20 @@ bool megrid::cluster(cluster_type t, unsigned int nclusters, char method, char m
     case HIERARCHICAL:
       return hierarchical_cluster(nclusters, method, metric);
       break;
+    case MINIBATCH_KMEANS:
+      if(metric != 'e')
+      {
+	logger::log() << msg::WARN << "mini-batch k-means clustering uses the Euclidian metric, ignoring metric [" << metric << "]";
+      }
+      return minibatch_cluster(nclusters);
+      break;
+    case HIERARCHICAL_RNN:
+      if(metric != 'e')
+      {
+	logger::log() << msg::WARN << "hierarchical clustering of nearest neighbours uses the Euclidian metric, ignoring metric [" << metric << "]";
+      }
+      return rnn_cluster(nclusters);
+      break;
     default:
       return false;
   }
@@ -876,12 +2739,14 @@ bool megrid::kmeans_cluster(unsigned int nclusters, char method, char metric, un
     return false;
   }
   
-  real_array_t* local_data = new real_array_t[nclusters];
+  real_array_t* local_data = NULL;
+  real_t* local_buffer = NULL;
+  allocate(local_data, local_buffer, nclusters, _ndim);
+  std::fill(local_buffer, local_buffer + (size_t)nclusters * _ndim, 0.);
   real_t* local_wgts = new real_t[nclusters];
   for(integer_t icl=0; icl<(integer_t)nclusters; ++icl)
   {
     local_wgts[icl] = 0.;
-    local_data[icl] = new real_t[_ndim];
   }
   
   std::cout << "clusters: ";
@@ -901,13 +2766,14 @@ bool megrid::kmeans_cluster(unsigned int nclusters, char method, char metric, un
   logger::log() << msg::INFO << "finished clustering using k-means";  
   logger::log() << msg::DEBUG << "overwrite existing grid";
   
-  release<real_array_t>(_data, _nreserved);
+  release_data();
   release<real_t>(_wgts);
   
   _npoints = nclusters;
   _nreserved = nclusters;
   
   _data = local_data;
+  _buffer = local_buffer;
   _wgts = local_wgts;
   
   reserve(INIT_RESERVE); // add padding s.t. adding new points is fast ... 
@@ -950,12 +2816,14 @@ bool megrid::hierarchical_cluster(unsigned int nclusters, char method, char metr
   
   delete[] root_node;
   
-  real_array_t* local_data = new real_array_t[nclusters];
+  real_array_t* local_data = NULL;
+  real_t* local_buffer = NULL;
+  allocate(local_data, local_buffer, nclusters, _ndim);
+  std::fill(local_buffer, local_buffer + (size_t)nclusters * _ndim, 0.);
   real_t* local_wgts = new real_t[nclusters];
   for(integer_t icl=0; icl<(integer_t)nclusters; ++icl)
   {
     local_wgts[icl] = 0.;
-    local_data[icl] = new real_t[_ndim];
   }
   
   std::cout << "clusters: ";
@@ -975,13 +2843,297 @@ bool megrid::hierarchical_cluster(unsigned int nclusters, char method, char metr
   logger::log() << msg::INFO << "finished tree-clustering";  
   logger::log() << msg::DEBUG << "overwrite existing grid";
   
-  release<real_array_t>(_data, _nreserved);
+  release_data();
   release<real_t>(_wgts);
   
   _npoints = nclusters;
   _nreserved = nclusters;
   
   _data = local_data;
+  _buffer = local_buffer;
+  _wgts = local_wgts;
+  
+  reserve(INIT_RESERVE); // add padding s.t. adding new points is fast ... 
+  
+  set_metadata();
+  
+  return true;
+}
+
+//////////////////////////////////////////////////////////////////////
+
+bool megrid::minibatch_cluster(unsigned int nclusters)
+{
+  if(nclusters == 0 || _npoints < (integer_t)nclusters)
+  {
+    logger::log() << msg::ERROR << "grid size too small, cannot cluster";
+    return false;
+  }
+  
+  logger::log() << msg::INFO << "begin clustering using mini-batch k-means";  
+  
+  integer_t K = nclusters;
+  random_index rnd(_npoints + K);
+  
+  real_array_t* centers = NULL;
+  real_t* centers_buffer = NULL;
+  allocate(centers, centers_buffer, K, _ndim);
+  std::vector<real_t> centers_wgts(K, 0.); // (the index does not use the weights)
+  
+  //
+  // k-means|| seeding from a random sample of the grid: in each of a few rounds,
+  // every sample point is drawn as a candidate with probability proportional to
+  // its weight times the distance squared to the nearest candidate so far (about
+  // K candidates per round); the candidates are weighted by the sample points 
+  // nearest to them & reduced to K centers (see reduce_candidates); the distances
+  // are updated with a kd-tree over the candidates of the last round, s.t. each
+  // round takes O(nsample log K) rather than O(nsample K) operations
+  //
+  integer_t nsample = min(_npoints, max(KMEANS_SAMPLE_FACTOR * K, _cluster_batch_size));
+  std::vector<integer_t> sample(_npoints);
+  for(integer_t ipt=0; ipt<_npoints; ++ipt)
+  {
+    sample[ipt] = ipt;
+  }
+  for(integer_t i=0; i<nsample; ++i)
+  {
+    std::swap(sample[i], sample[i + rnd(_npoints - i)]);
+  }
+  sample.resize(nsample);
+  
+  std::vector<double> dsq(nsample, (std::numeric_limits<double>::max)());
+  std::vector<integer_t> nearest(nsample, -1); // nearest candidate of each sample point
+  std::vector<char> is_candidate(nsample, 0);
+  std::vector<integer_t> candidates; // sample indices of the candidates
+  
+  //
+  // the first candidate is drawn by weight (by binary search on the cumulative weights)
+  //
+  {
+    std::vector<double> cumulative(nsample);
+    double sum = 0.;
+    for(integer_t i=0; i<nsample; ++i)
+    {
+      sum += (_wgts[sample[i]] > 0 ? _wgts[sample[i]] : 0.);
+      cumulative[i] = sum;
+    }
+    integer_t ifirst = (sum > 0 ? 
+			std::upper_bound(cumulative.begin(), cumulative.end(), rnd.uniform() * sum) - cumulative.begin() : 
+			rnd(nsample));
+    ifirst = min(ifirst, nsample - 1);
+    candidates.push_back(ifirst);
+    is_candidate[ifirst] = 1;
+  }
+  
+  std::vector<integer_t> fresh(candidates); // candidates drawn in the last round
+  for(integer_t iround=0; ; ++iround)
+  {
+    std::vector<real_array_t> rows(fresh.size());
+    std::vector<real_t> rows_wgts(fresh.size(), 0.); // (the index does not use the weights)
+    for(unsigned i=0; i<fresh.size(); ++i)
+    {
+      rows[i] = _data[sample[fresh[i]]];
+    }
+    integer_t offset = candidates.size() - fresh.size();
+    
+    double total = 0.;
+    {
+      kdtree index(&(rows[0]), &(rows_wgts[0]), _ndim, fresh.size());
+#pragma omp parallel num_threads(_nthreads) reduction(+:total)
+      {
+	agf::workspace ws;
+	real_t d;
+#pragma omp for schedule(static)
+	for(integer_t i=0; i<nsample; ++i)
+	{
+	  integer_t j = index.nearest_index(_data[sample[i]], d, ws);
+	  if(j >= 0 && d < dsq[i])
+	  {
+	    dsq[i] = d;
+	    nearest[i] = offset + j;
+	  }
+	  total += (_wgts[sample[i]] > 0 ? _wgts[sample[i]] * dsq[i] : 0.);
+	}
+      }
+    }
+    
+    if(iround == KMEANS_SEED_ROUNDS || total <= 0)
+    {
+      break;
+    }
+    
+    fresh.clear();
+    for(integer_t i=0; i<nsample; ++i)
+    {
+      if(!is_candidate[i] && _wgts[sample[i]] > 0 && 
+	 rnd.uniform() * total < K * _wgts[sample[i]] * dsq[i])
+      {
+	fresh.push_back(i);
+	candidates.push_back(i);
+	is_candidate[i] = 1;
+      }
+    }
+    if(fresh.empty())
+    {
+      break;
+    }
+    
+    LOG_DEBUG( "k-means|| round [" << iround + 1 << "] drew [" << fresh.size() << "] candidates" );
+  }
+  
+  integer_t ncandidates = candidates.size();
+  std::vector<double> candidates_wgts(ncandidates, 0.);
+  for(integer_t i=0; i<nsample; ++i)
+  {
+    if(nearest[i] >= 0)
+    {
+      candidates_wgts[nearest[i]] += _wgts[sample[i]];
+    }
+  }
+  
+  if(ncandidates <= K)
+  {
+    //
+    // too few candidates (eg., many coincident points): the remaining centers
+    // are taken from the rest of the (randomly ordered) sample
+    //
+    integer_t icl = 0;
+    for(integer_t i=0; i<ncandidates; ++i, ++icl)
+    {
+      std::copy(_data[sample[candidates[i]]], _data[sample[candidates[i]]] + _ndim, centers[icl]);
+    }
+    for(integer_t i=0; i<nsample && icl<K; ++i)
+    {
+      if(!is_candidate[i])
+      {
+	std::copy(_data[sample[i]], _data[sample[i]] + _ndim, centers[icl++]);
+      }
+    }
+  }
+  else
+  {
+    reduce_candidates(_data, _ndim, sample, candidates, candidates_wgts, centers, K, rnd, _nthreads);
+  }
+  std::vector<integer_t>().swap(sample);
+  std::vector<double>().swap(dsq);
+  
+  //
+  // mini-batch updates: the points of each batch are assigned to their nearest 
+  // centers (in parallel), then each center moves towards its points with a step
+  // given by the point weight over the summed weight of the points seen so far
+  //
+  integer_t nbatch = min(_cluster_batch_size, _npoints);
+  std::vector<integer_t> batch(nbatch);
+  std::vector<integer_t> assigned(nbatch);
+  std::vector<double> counts(K, 0.);
+  for(integer_t iter=0; iter<_cluster_iterations; ++iter)
+  {
+    for(integer_t i=0; i<nbatch; ++i)
+    {
+      batch[i] = rnd(_npoints);
+    }
+    
+    kdtree index(centers, &(centers_wgts[0]), _ndim, K);
+#pragma omp parallel num_threads(_nthreads)
+    {
+      agf::workspace ws;
+      real_t d;
+#pragma omp for schedule(static)
+      for(integer_t i=0; i<nbatch; ++i)
+      {
+	assigned[i] = index.nearest_index(_data[batch[i]], d, ws);
+      }
+    }
+    
+    for(integer_t i=0; i<nbatch; ++i)
+    {
+      real_t w = _wgts[batch[i]];
+      integer_t icl = assigned[i];
+      if(w <= 0 || icl < 0)
+      {
+	continue;
+      }
+      counts[icl] += w;
+      double eta = w / counts[icl];
+      for(integer_t idim=0; idim<_ndim; ++idim)
+      {
+	centers[icl][idim] += eta * (_data[batch[i]][idim] - centers[icl][idim]);
+      }
+    }
+    
+    LOG_DEBUG( "finished mini-batch [" << iter + 1 << "] of [" << _cluster_iterations << "]" );
+  }
+  
+  //
+  // assign all grid points to the final centers; the clusters are the weighted 
+  // centroids of their points & carry the summed weights (empty clusters are dropped)
+  //
+  std::vector<integer_t> clids(_npoints, -1);
+  {
+    kdtree index(centers, &(centers_wgts[0]), _ndim, K);
+#pragma omp parallel num_threads(_nthreads)
+    {
+      agf::workspace ws;
+      real_t d;
+#pragma omp for schedule(static)
+      for(integer_t ipt=0; ipt<_npoints; ++ipt)
+      {
+	clids[ipt] = index.nearest_index(_data[ipt], d, ws);
+      }
+    }
+  }
+  
+  std::vector<double> sums((size_t)K * _ndim, 0.);
+  std::vector<double> sumw(K, 0.);
+  std::vector<integer_t> npts(K, 0);
+  for(integer_t ipt=0; ipt<_npoints; ++ipt)
+  {
+    integer_t icl = clids[ipt];
+    for(integer_t idim=0; idim<_ndim; ++idim)
+    {
+      sums[(size_t)icl * _ndim + idim] += (double)_wgts[ipt] * _data[ipt][idim];
+    }
+    sumw[icl] += _wgts[ipt];
+    npts[icl] += 1;
+  }
+  
+  integer_t nfound = 0;
+  for(integer_t icl=0; icl<K; ++icl)
+  {
+    nfound += (npts[icl] > 0 ? 1 : 0);
+  }
+  
+  real_array_t* local_data = NULL;
+  real_t* local_buffer = NULL;
+  allocate(local_data, local_buffer, nfound, _ndim);
+  real_t* local_wgts = new real_t[nfound];
+  integer_t jcl = 0;
+  for(integer_t icl=0; icl<K; ++icl)
+  {
+    if(npts[icl] == 0)
+    {
+      continue;
+    }
+    for(integer_t idim=0; idim<_ndim; ++idim)
+    {
+      local_data[jcl][idim] = (sumw[icl] != 0 ? sums[(size_t)icl * _ndim + idim] / sumw[icl] : centers[icl][idim]);
+    }
+    local_wgts[jcl] = sumw[icl];
+    ++jcl;
+  }
+  release(centers, centers_buffer);
+  
+  logger::log() << msg::INFO << "finished clustering using mini-batch k-means, found [" << nfound << "] non-empty clusters";  
+  logger::log() << msg::DEBUG << "overwrite existing grid";
+  
+  release_data();
+  release<real_t>(_wgts);
+  
+  _npoints = nfound;
+  _nreserved = nfound;
+  
+  _data = local_data;
+  _buffer = local_buffer;
   _wgts = local_wgts;
   
   reserve(INIT_RESERVE); // add padding s.t. adding new points is fast ... 
@@ -993,6 +3145,145 @@ bool megrid::hierarchical_cluster(unsigned int nclusters, char method, char metr
 
 //////////////////////////////////////////////////////////////////////
 
+bool megrid::rnn_cluster(unsigned int nclusters)
+{
+  if(nclusters == 0 || _npoints < (integer_t)nclusters)
+  {
+    logger::log() << msg::ERROR << "grid size too small, cannot cluster";
+    return false;
+  }
+  
+  logger::log() << msg::INFO << "begin clustering by merging reciprocal nearest neighbours";  
+  
+  //
+  // each round merges all reciprocal nearest neighbours, s.t. the number of 
+  // points drops by a roughly constant fraction & the number of rounds is 
+  // logarithmic in the compaction factor
+  //
+  integer_t nround = 0;
+  while(_npoints > (integer_t)nclusters)
+  {
+    integer_t nmerged = merge_neighbours(_npoints - nclusters);
+    if(nmerged == 0)
+    {
+      logger::log() << msg::ERROR << "no reciprocal nearest neighbours found, stopped clustering at [" << _npoints << "] points";
+      set_metadata();
+      return false;
+    }
+    ++nround;
+    logger::log() << msg::DEBUG << "merged [" << nmerged << "] pairs in round [" << nround << "], [" << _npoints << "] points left";
+  }
+  
+  logger::log() << msg::INFO << "finished clustering in [" << nround << "] rounds";  
+  
+  set_metadata();
+  
+  return true;
+}
+
+//////////////////////////////////////////////////////////////////////
+
+integer_t megrid::merge_neighbours(integer_t nmax, double maxd)
+{
+  if(_npoints < 2 || nmax <= 0)
+  {
+    return 0;
+  }
+  
+  invalidate(); // the points are modified in place
+  
+  //
+  // find the nearest neighbour of each point (in parallel) with an index over the grid
+  //
+  std::vector<integer_t> nn(_npoints, -1);
+  std::vector<real_t> nnd(_npoints, 0.);
+  {
+    kdtree index(_data, _wgts, _ndim, _npoints);
+#pragma omp parallel num_threads(_nthreads)
+    {
+      agf::workspace ws;
+#pragma omp for schedule(static)
+      for(integer_t ipt=0; ipt<_npoints; ++ipt)
+      {
+	nn[ipt] = index.nearest_index(_data[ipt], nnd[ipt], ws, ipt);
+      }
+    }
+  }
+  
+  //
+  // collect the reciprocal pairs, with the increase in the weighted sum of squares if merged
+  //
+  double maxd2 = (maxd > 0 ? maxd * maxd : -1);
+  std::vector< std::pair<double, integer_t> > pairs;
+  for(integer_t ipt=0; ipt<_npoints; ++ipt)
+  {
+    integer_t jpt = nn[ipt];
+    if(jpt > ipt && nn[jpt] == ipt && (maxd2 < 0 || nnd[ipt] <= maxd2))
+    {
+      double w = (double)_wgts[ipt] + _wgts[jpt];
+      double cost = (w != 0 ? std::fabs(_wgts[ipt] * (double)_wgts[jpt] / w) : 0.) * nnd[ipt];
+      pairs.push_back(std::make_pair(cost, ipt));
+    }
+  }
+  if((integer_t)pairs.size() > nmax)
+  {
+    std::nth_element(pairs.begin(), pairs.begin() + nmax, pairs.end());
+    pairs.resize(nmax);
+  }
+  
+  //
+  // merge each pair into the first point & compact the remaining points in place
+  //
+  std::vector<char> merged(_npoints, 0);
+  for(unsigned ipair=0; ipair<pairs.size(); ++ipair)
+  {
+    integer_t ipt = pairs[ipair].second;
+    merge_points(ipt, nn[ipt]);
+    merged[nn[ipt]] = 1;
+  }
+  drop_points(merged);
+  
+  return pairs.size();
+}
+
+//////////////////////////////////////////////////////////////////////
+
+void megrid::merge_points(integer_t ipt, integer_t jpt)
+{
+  double wa = _wgts[ipt];
+  double wb = _wgts[jpt];
+  double w = wa + wb;
+  for(integer_t idim=0; idim<_ndim; ++idim)
+  {
+    _data[ipt][idim] = (w != 0 ? (wa * _data[ipt][idim] + wb * _data[jpt][idim]) / w 
+			: 0.5 * (_data[ipt][idim] + _data[jpt][idim])); // weighted centroid of merged pair
+  }
+  _wgts[ipt] = w;
+}
+
+//////////////////////////////////////////////////////////////////////
+
+void megrid::drop_points(const std::vector<char>& drop)
+{
+  integer_t n = 0;
+  for(integer_t ipt=0; ipt<_npoints; ++ipt)
+  {
+    if(drop[ipt])
+    {
+      continue;
+    }
+    if(n != ipt)
+    {
+      std::copy(_data[ipt], _data[ipt] + _ndim, _data[n]);
+      _wgts[n] = _wgts[ipt];
+    }
+    ++n;
+  }
+  _npoints = n;
+}
+
+//////////////////////////////////////////////////////////////////////
+
 hist1D* megrid::project1D(integer_t ix, integer_t nbins, real_t a, real_t b, bool dyn) const 
 {
   if(ix >= _ndim || ix < 0)
@@ -1002,7 +3293,7 @@ hist1D* megrid::project1D(integer_t ix, integer_t nbins, real_t a, real_t b, boo
     h->SetBit(TH1::kCanRebin);
   for(integer_t ipt=0; ipt<_npoints; ++ipt) // 
   {
-    h->Fill(_data[ipt][ix], _wgts[ipt]);
+    h->Fill(get_coordinate(ipt, ix), _wgts[ipt]);
   }
   return h;
 }
@@ -1020,7 +3311,7 @@ hist2D* megrid::project2D(integer_t ix,  integer_t iy, integer_t nbins,
     h->SetBit(TH1::kCanRebin);
   for(integer_t ipt=0; ipt<_npoints; ++ipt) // 
   {
-    h->Fill(_data[ipt][ix], _data[ipt][iy], _wgts[ipt]);
+    h->Fill(get_coordinate(ipt, ix), get_coordinate(ipt, iy), _wgts[ipt]);
   }
   return h;
 }
@@ -1046,7 +3337,7 @@ void megrid::scan(integer_t istart, integer_t nrows, const char* delim) const
   {
     for(integer_t idim=0; idim<_ndim; ++idim)
     {
-      std::cout << std::setw(12) << std::scientific << _data[ipt][idim] << delim;
+      std::cout << std::setw(12) << std::scientific << get_coordinate(ipt, idim) << delim;
     }
     std::cout << std::setw(12) << std::scientific << _wgts[ipt] << delim;
     std::cout << std::endl;
@@ -1068,14 +3359,60 @@ void megrid::set_loglevel(const std::string& lvl)
     logger::set_level(log4cpp::Priority::ERROR);
 }
 
+//////////////////////////////////////////////////////////////////////
+
+void megrid::set_logasync(bool async)
+{ 
+  logger::set_async(async);
+}
+
 //////////////////////////////////////////////////////////////////////
 void megrid::set_metadata() 
 {
+  invalidate(); // grid has changed, rebuild index on next query
+  
   _grid_dimensions = std::vector<real_t>(_ndim, 1);
+  _grid_min = std::vector<real_t>(_ndim, (std::numeric_limits<real_t>::max)());
+  _grid_max = std::vector<real_t>(_ndim, (std::numeric_limits<real_t>::min)());
+  _moment1 = std::vector<double>(_ndim, 0.);
+  _moment2 = 0.;
+  
+  //
+  // single pass over the grid (with the same bounds as agf::pdf::grid_helper)
+  //
+  double sumw = 0.;
+  for(integer_t ipt=0; ipt<_npoints; ++ipt)
+  {
+    for(integer_t idim=0; idim<_ndim; ++idim)
+    {
+      real_t x = get_coordinate(ipt, idim);
+      if(x > _grid_max[idim]) _grid_max[idim] = x;
+      if(x < _grid_min[idim]) _grid_min[idim] = x;
+      _moment1[idim] += x;
+      _moment2 += (double)x * x;
+    }
+    sumw += _wgts[ipt];
+  }
+  for(integer_t idim=0; idim<_ndim; ++idim)
+  {
+    _grid_dimensions[idim] = std::fabs(_grid_max[idim] - _grid_min[idim]);
+  }
+  _sum_wgts = sumw;
+}
+
+//////////////////////////////////////////////////////////////////////
+
+void megrid::update_metadata(const real_t* p, real_t w) 
+{
+  invalidate(); 
+  
   for(integer_t idim=0; idim<_ndim; ++idim)
   {
-    agf::pdf::grid_helper<real_t> h(_data, idim, _npoints);
-    _grid_dimensions[idim] = std::fabs(h.get_max() - h.get_min());
+    if(p[idim] > _grid_max[idim]) _grid_max[idim] = p[idim];
+    if(p[idim] < _grid_min[idim]) _grid_min[idim] = p[idim];
+    _grid_dimensions[idim] = std::fabs(_grid_max[idim] - _grid_min[idim]);
+    _moment1[idim] += p[idim];
+    _moment2 += (double)p[idim] * p[idim];
   }
-  _sum_wgts = std::accumulate(_wgts, _wgts + _npoints, 0.);
+  _sum_wgts += w;
 }
@@ -0,0 +1,187 @@
+#include "megrid_set.hh"
+#include "agf.hh"
+#include "logger.hh"
+
+using std::string;
+using std::vector;
+
+//////////////////////////////////////////////////////////////////////
+
+megrid_set::megrid_set(string name) :
+  _name(name),
+  _grids(),
+  _workspaces(),
+  _nthreads(1)
+{
+
+}
+
+//////////////////////////////////////////////////////////////////////
+
+megrid_set::~megrid_set()
+{
+  for(unsigned ig=0; ig<_workspaces.size(); ++ig)
+  {
+    delete _workspaces[ig];
+  }
+}
+
+//////////////////////////////////////////////////////////////////////
+
+bool megrid_set::add_grid(megrid* g)
+{
+  if(g == NULL)
+  {
+    return false;
+  }
+  if(!_grids.empty())
+  {
+    const megrid* ref = _grids.front();
+    if(g->get_ndim() != ref->get_ndim() || g->get_ndim_effective() != ref->get_ndim_effective())
+    {
+      logger::log() << msg::ERROR << "grid [" << g->get_name() << "] has different dimensions than the grids in set [" << _name << "]";
+      return false;
+    }
+    if(g->get_transformations() != ref->get_transformations())
+    {
+      logger::log() << msg::ERROR << "grid [" << g->get_name() << "] has different transformations than the grids in set [" << _name << "]";
+      return false;
+    }
+  }
+  _grids.push_back(g);
+  _workspaces.push_back(new agf::workspace());
+  return true;
+}
+
+//////////////////////////////////////////////////////////////////////
+
+bool megrid_set::apply_transformation(transform::itransformation_base* t, bool retain, bool force_configure)
+{
+  bool status = true;
+  for(unsigned ig=0; ig<_grids.size(); ++ig)
+  {
+    if(!_grids[ig]->apply_transformation(t, retain, ig == 0 && force_configure))
+    {
+      logger::log() << msg::ERROR << "failed to apply transformation to grid [" << _grids[ig]->get_name() << "] in set [" << _name << "]";
+      status = false;
+    }
+  }
+  return status;
+}
+
+//////////////////////////////////////////////////////////////////////
+
+vector<real_t> megrid_set::pdf(const vector<real_t>& vec) const
+{
+  vector<real_t> out(_grids.size(), -1);
+  if(_grids.empty())
+  {
+    return out;
+  }
+  if((integer_t)vec.size() != _grids.front()->get_ndim_effective())
+  {
+    logger::log() << msg::ERROR << "dimension mismatch in test point" ;
+    return out;
+  }
+  pdf(&(vec[0]), &(out[0]));
+  return out;
+}
+
+//////////////////////////////////////////////////////////////////////
+
+bool megrid_set::pdf(const real_t* x, real_t* out) const
+{
+  integer_t ngrids = _grids.size();
+  if(ngrids == 0)
+  {
+    return false;
+  }
+
+  //
+  // grids that are not loaded are skipped (-1), the others are still evaluated
+  //
+  bool status = true;
+  integer_t iref = -1; // first loaded grid, which transforms the point
+  vector<char> loaded(ngrids, 0);
+  for(integer_t ig=0; ig<ngrids; ++ig)
+  {
+    out[ig] = -1;
+    const megrid* g = _grids[ig];
+    if(g->_npoints == 0 || (g->_data == NULL && g->_hbuffer == NULL) || g->_wgts == NULL)
+    {
+      logger::log() << msg::ERROR << "grid [" << g->get_name() << "] not loaded" ;
+      status = false;
+      continue;
+    }
+    _workspaces[ig]->reserve(g->_npoints, (g->_maxk == 0 ? g->_npoints : g->_maxk) + agf::configuration::KMIN,
+			     g->_ndim, g->get_ndim_effective());
+    loaded[ig] = 1;
+    if(iref < 0)
+    {
+      iref = ig;
+    }
+  }
+  if(iref < 0)
+  {
+    return false;
+  }
+
+  //
+  // the transformations are shared, so the point is transformed once with the first grid
+  //
+  agf::workspace& ws = *_workspaces[iref];
+  double t0 = agf::wall_time();
+  _grids[iref]->get_transformed_point(x, &(ws.point[0]), ws.buffer);
+  double t_transform = agf::wall_time() - t0;
+  real_t* xp = &(ws.point[0]);
+
+#pragma omp parallel for num_threads(_nthreads) schedule(dynamic, 1)
+  for(integer_t ig=0; ig<ngrids; ++ig)
+  {
+    if(!loaded[ig])
+    {
+      continue;
+    }
+    const megrid* g = _grids[ig];
+
+    megrid::statistics stats;
+    stats.nqueries = 1;
+    stats.t_transform = (ig == iref ? t_transform : 0);
+
+    out[ig] = g->evaluate(xp, *_workspaces[ig], stats);
+
+#pragma omp critical(megrid_stats)
+    g->_stats += stats;
+  }
+
+  for(integer_t ig=0; ig<ngrids; ++ig)
+  {
+    if(out[ig] < 0)
+    {
+      status = false;
+    }
+  }
+
+  return status;
+}
+
+//////////////////////////////////////////////////////////////////////
+
+vector<real_t> megrid_set::likelihood_ratios(const vector<real_t>& vec, integer_t iref) const
+{
+  vector<real_t> p = pdf(vec);
+  vector<real_t> ratios(p.size(), -1);
+  if(iref < 0 || iref >= (integer_t)p.size())
+  {
+    logger::log() << msg::ERROR << "no grid [" << iref << "] in set [" << _name << "]";
+    return ratios;
+  }
+  for(unsigned ig=0; ig<p.size(); ++ig)
+  {
+    if(p[ig] >= 0 && p[iref] > 0)
+    {
+      ratios[ig] = p[ig] / p[iref];
+    }
+  }
+  return ratios;
+}
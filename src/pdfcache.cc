@@ -0,0 +1,110 @@
+#include "pdfcache.hh"
+
+#include <cmath>
+#include <cstring>
+
+//
+// bound on the quantised coordinates, s.t. the conversion to an integer is defined
+//
+#define PDFCACHE_MAXQ 9.0e18
+
+//////////////////////////////////////////////////////////////////////
+
+pdfcache::pdfcache(integer_t capacity, real_t tolerance) :
+  _entries(),
+  _lookup(),
+  _capacity(capacity > 0 ? capacity : 1),
+  _tolerance(tolerance > 0 ? tolerance : 0)
+{
+
+}
+
+//////////////////////////////////////////////////////////////////////
+
+pdfcache::~pdfcache()
+{
+
+}
+
+//////////////////////////////////////////////////////////////////////
+
+void pdfcache::make_key(const real_t* x,
+			integer_t ndim,
+			const double* tags,
+			integer_t ntags,
+			key_type& key) const
+{
+  key.resize(ndim + ntags);
+
+  for(integer_t idim=0; idim<ndim; ++idim)
+  {
+    if(_tolerance > 0)
+    {
+      double q = std::floor(x[idim] / (double)_tolerance + 0.5);
+      if(q > PDFCACHE_MAXQ) q = PDFCACHE_MAXQ;
+      if(q < -PDFCACHE_MAXQ) q = -PDFCACHE_MAXQ;
+      key[idim] = (long long)q;
+    }
+    else
+    {
+      //
+      // exact match on the bits of the coordinate (+0 & -0 are folded together)
+      //
+      float f = x[idim] + 0.0f;
+      unsigned int bits;
+      memcpy(&bits, &f, sizeof(bits));
+      key[idim] = bits;
+    }
+  }
+
+  for(integer_t itag=0; itag<ntags; ++itag)
+  {
+    long long bits;
+    memcpy(&bits, tags + itag, sizeof(bits));
+    key[ndim + itag] = bits;
+  }
+}
+
+//////////////////////////////////////////////////////////////////////
+
+bool pdfcache::find(const key_type& key, value_type& value)
+{
+  map_type::iterator it = _lookup.find(key);
+  if(it == _lookup.end())
+  {
+    return false;
+  }
+  _entries.splice(_entries.begin(), _entries, it->second);
+  value = it->second->second;
+  return true;
+}
+
+//////////////////////////////////////////////////////////////////////
+
+void pdfcache::insert(const key_type& key, const value_type& value)
+{
+  map_type::iterator it = _lookup.find(key);
+  if(it != _lookup.end())
+  {
+    it->second->second = value;
+    _entries.splice(_entries.begin(), _entries, it->second);
+    return;
+  }
+
+  if((integer_t)_lookup.size() >= _capacity)
+  {
+    _lookup.erase(_entries.back().first);
+    _entries.pop_back();
+  }
+
+  _entries.push_front(std::make_pair(key, value));
+  _lookup[key] = _entries.begin();
+}
+
+//////////////////////////////////////////////////////////////////////
+
+void pdfcache::clear()
+{
+  _lookup.clear();
+  _entries.clear();
+}
@@ -7,6 +7,8 @@
 #include <string>
 #include <cmath>
 #include <limits>
+#include <iostream>
+#include <iomanip>
 
 #include <boost/tokenizer.hpp>
 
@@ -15,6 +17,94 @@ using std::string;
 
 using namespace transform;
 
+namespace
+{
+  //
+  // write & read a list of values preceded by its length (floating point values 
+  // are written with enough digits to be read back exactly)
+  //
+  template<typename T>
+  void write_values(std::ostream& os, const vector<T>& v)
+  {
+    std::streamsize p = os.precision(std::numeric_limits<T>::digits10 + 3);
+    os << " " << v.size();
+    for(unsigned i=0; i<v.size(); ++i)
+    {
+      os << " " << v[i];
+    }
+    os.precision(p);
+  }
+  
+  template<typename T>
+  bool read_values(std::istream& is, vector<T>& v)
+  {
+    unsigned n = 0;
+    if(!(is >> n))
+    {
+      return false;
+    }
+    v.resize(n);
+    for(unsigned i=0; i<n; ++i)
+    {
+      if(!(is >> v[i]))
+      {
+	return false;
+      }
+    }
+    return true;
+  }
+}
+
+//////////////////////////////////////////////////////////////////////////////// 
+
+void itransformation_base::write(std::ostream& os) const
+{
+  os << get_name() << " " << _in_dim << " " << _out_dim << " " << _configured;
+}
+
+////////////////////////////////////////////////////////////////////////////////
+
+bool itransformation_base::read(std::istream& is)
+{
+  return !(is >> _in_dim >> _out_dim >> _configured).fail();
+}
+
+////////////////////////////////////////////////////////////////////////////////
+
+itransformation_base* transform::read(std::istream& is)
+{
+  string name;
+  if(!(is >> name))
+  {
+    return NULL;
+  }
+  
+  itransformation_base* t = NULL;
+  if(name == "rotate_phi")
+    t = new rotate_phi("");
+  else if(name == "norm_gauss")
+    t = new norm_gauss(0);
+  else if(name == "norm_range")
+    t = new norm_range(0);
+  else if(name == "scale_fixed")
+    t = new scale_fixed(vector<real_t>());
+  else if(name == "affine")
+    t = new affine(0, 0, vector<double>(), vector<double>());
+  else
+  {
+    logger::log() << msg::ERROR << "unknown transformation [" << name << "]";
+    return NULL;
+  }
+  
+  if(!t->read(is))
+  {
+    logger::log() << msg::ERROR << "could not read state of transformation [" << name << "]";
+    delete t;
+    return NULL;
+  }
+  return t;
+}
+
 //////////////////////////////////////////////////////////////////////////////// 
 
 ////////////////////////////////////////////////////////////////////////////////
@@ -165,6 +255,51 @@ bool rotate_phi::operator==(const itransformation_base* t) const
   return false;
 }
 
+////////////////////////////////////////////////////////////////////////////////
+
+void rotate_phi::write(std::ostream& os) const
+{
+  itransformation_base::write(os);
+  os << " " << _coord_def.size() << " " << _coord_def;
+  vector<unsigned> indices;
+  for(unsigned ip=0; ip<_i_pairs.size(); ++ip)
+  {
+    indices.push_back(_i_pairs[ip].first);
+    indices.push_back(_i_pairs[ip].second);
+  }
+  write_values(os, indices);
+}
+
+////////////////////////////////////////////////////////////////////////////////
+
+bool rotate_phi::read(std::istream& is)
+{
+  unsigned n = 0;
+  if(!itransformation_base::read(is) || !(is >> n) || is.get() != ' ')
+  {
+    return false;
+  }
+  _coord_def.resize(n);
+  if(n > 0 && !is.read(&(_coord_def[0]), n))
+  {
+    return false;
+  }
+  vector<unsigned> indices;
+  if(!read_values(is, indices) || indices.size() % 2 != 0)
+  {
+    return false;
+  }
+  _i_pairs.clear();
+  _paired_indexes.clear();
+  for(unsigned i=0; i<indices.size(); i+=2)
+  {
+    _i_pairs.push_back(std::pair<unsigned,unsigned>(indices[i], indices[i+1]));
+    _paired_indexes.insert(indices[i]);
+    _paired_indexes.insert(indices[i+1]);
+  }
+  return true;
+}
+
 //////////////////////////////////////////////////////////////////////////////// 
 
 ////////////////////////////////////////////////////////////////////////////////
@@ -227,6 +362,25 @@ void norm_gauss::operator()(const real_t* x, real_t* xp) const
 
 ////////////////////////////////////////////////////////////////////////////////
 
+bool norm_gauss::get_affine(vector<double>& A, vector<double>& b) const
+{
+  if(!_configured)
+  {
+    return false;
+  }
+  unsigned n = get_in_dim();
+  A.assign(n * n, 0.);
+  b.assign(n, 0.);
+  for(unsigned idim=0; idim<n; ++idim)
+  {
+    A[idim * n + idim] = 1. / _std_deviations[idim];
+    b[idim] = -_means[idim] / (double)_std_deviations[idim];
+  }
+  return true;
+}
+
+////////////////////////////////////////////////////////////////////////////////
+
 bool norm_gauss::operator==(const itransformation_base* t) const
 {
   const norm_gauss* other = dynamic_cast<const norm_gauss*>(t);
@@ -240,6 +394,26 @@ bool norm_gauss::operator==(const itransformation_base* t) const
 
 ////////////////////////////////////////////////////////////////////////////////
 
+void norm_gauss::write(std::ostream& os) const
+{
+  itransformation_base::write(os);
+  write_values(os, _means);
+  write_values(os, _std_deviations);
+}
+
+////////////////////////////////////////////////////////////////////////////////
+
+bool norm_gauss::read(std::istream& is)
+{
+  return (itransformation_base::read(is) && 
+	  read_values(is, _means) && 
+	  read_values(is, _std_deviations) &&
+	  _means.size() == get_in_dim() &&
+	  _std_deviations.size() == get_in_dim());
+}
+
+////////////////////////////////////////////////////////////////////////////////
+
 ////////////////////////////////////////////////////////////////////////////////
 
 real_t* norm_range::operator()(const real_t* x) const
@@ -259,44 +433,27 @@ void norm_range::operator()(const real_t* x, real_t* xp) const
 {
   if(_configured)
   {
-    integer_t l, m, r, d;
-    
     for(unsigned idim=0; idim<get_in_dim(); ++idim)
     {
-      l = 0;
-      m = _sorted_data.size() / 2;
-      r = _sorted_data.size();
-      
-      // binary search to find index of coordinate
+      const vector<real_t>& q = _quantiles[idim];
+      unsigned n = q.size();
       
-      // @TODO interpolate between bracketing points ... 
+      // locate the knots bracketing the coordinate & interpolate between them
       
-      while(true)
+      vector<real_t>::const_iterator it = std::upper_bound(q.begin(), q.end(), x[idim]);
+      if(it == q.begin())
       {
-	if(x[idim] > _sorted_data[idim][m])
-	{
-	  d = std::abs(r - m) / 2;
-	  l = m;
-	  m += d;
-	  if(d <= 1)
-	  {
-	    break;
-	  }
-	}
-	if(x[idim] < _sorted_data[idim][m])
-	{
-	  d = std::abs(m - l) / 2;
-	  r = m;
-	  m -= d;
-	  if(d <= 1)
-	  {
-	    break;
-	  }
-	}
-	if(x[idim] == _sorted_data[idim][m])
-	  break;
-      }      
-      xp[idim] = ((real_t)m) / _sorted_data.size();
+	xp[idim] = 0.;
+      }
+      else if(it == q.end())
+      {
+	xp[idim] = 1.;
+      }
+      else
+      {
+	unsigned k = (it - q.begin()) - 1;
+	xp[idim] = (k + (x[idim] - q[k]) / (q[k+1] - q[k])) / (n - 1);
+      }
     }
   }
 }
@@ -310,25 +467,38 @@ bool norm_range::configure(const igrid_base* g, bool force)
     return g->get_ndim() == (integer_t)get_in_dim();
   }
   _configured = false;
-  _sorted_data.clear();
-  for(integer_t ipt=0; ipt<g->get_npoints(); ++ipt)
+  _quantiles.assign(get_in_dim(), vector<real_t>());
+  
+  //
+  // the sampled coordinates are sorted one axis at a time, s.t. only one
+  // column of the grid is copied at any time & the quantile table is kept
+  //
+  vector<real_t> column;
+  column.reserve(g->get_npoints() / _sampling_frequency + 1);
+  for(unsigned idim=0; idim<get_in_dim(); ++idim)
   {
-    if(ipt % _sampling_frequency == 0)
+    column.clear();
+    for(integer_t ipt=0; ipt<g->get_npoints(); ipt += _sampling_frequency)
     {
-      for(unsigned idim=0; idim<get_in_dim(); ++idim)
-      {
-	_sorted_data[idim].push_back(g->get_data()[ipt][idim]);
-      }
+      column.push_back(g->get_data()[ipt][idim]);
+    }
+    if(column.size() < 2)
+    {
+      return false;
+    }
+    std::sort(column.begin(), column.end());
+    
+    unsigned n = std::min<size_t>(_nknots, column.size());
+    _quantiles[idim].resize(n);
+    for(unsigned k=0; k<n; ++k)
+    {
+      double pos = (double)k * (column.size() - 1) / (n - 1);
+      size_t i = (size_t)pos;
+      double f = pos - i;
+      _quantiles[idim][k] = (i + 1 < column.size() ? (1 - f) * column[i] + f * column[i+1] : column[i]);
     }
-  } 
-  for(unsigned idim=0; idim<get_in_dim(); ++idim)
-  {
-    std::sort(_sorted_data[idim].begin(), _sorted_data[idim].end());
-  }
-  if(_sorted_data[0].size() > 1)
-  {
-    _configured = true;
   }
+  _configured = true;
   return (_configured && g->get_ndim() == (integer_t)get_in_dim());
 }
 
@@ -339,13 +509,43 @@ bool norm_range::operator==(const itransformation_base* t) const
   const norm_range* other = dynamic_cast<const norm_range*>(t);
   if(other != NULL)
   {
-    return (other->get_cdf() == _sorted_data);
+    return (other->get_cdf() == _quantiles);
   }
   return false;
 }
 
 ////////////////////////////////////////////////////////////////////////////////
 
+void norm_range::write(std::ostream& os) const
+{
+  itransformation_base::write(os);
+  os << " " << _sampling_frequency << " " << _nknots << " " << _quantiles.size();
+  for(unsigned idim=0; idim<_quantiles.size(); ++idim)
+  {
+    write_values(os, _quantiles[idim]);
+  }
+}
+
+////////////////////////////////////////////////////////////////////////////////
+
+bool norm_range::read(std::istream& is)
+{
+  unsigned n = 0;
+  if(!itransformation_base::read(is) || !(is >> _sampling_frequency >> _nknots >> n))
+  {
+    return false;
+  }
+  _quantiles.resize(n);
+  for(unsigned idim=0; idim<n; ++idim)
+  {
+    if(!read_values(is, _quantiles[idim]) || (_configured && _quantiles[idim].size() < 2))
+    {
+      return false;
+    }
+  }
+  return true;
+}
+
 ////////////////////////////////////////////////////////////////////////////////
 
 real_t* scale_fixed::operator()(const real_t* x) const
@@ -374,6 +574,24 @@ bool scale_fixed::configure(const igrid_base* g, bool force)
 
 ////////////////////////////////////////////////////////////////////////////////
 
+bool scale_fixed::get_affine(vector<double>& A, vector<double>& b) const
+{
+  unsigned n = get_in_dim();
+  if(_scales.size() != n)
+  {
+    return false;
+  }
+  A.assign(n * n, 0.);
+  b.assign(n, 0.);
+  for(unsigned idim=0; idim<n; ++idim)
+  {
+    A[idim * n + idim] = _scales[idim];
+  }
+  return true;
+}
+
+////////////////////////////////////////////////////////////////////////////////
+
 bool scale_fixed::operator==(const itransformation_base* t) const
 {
   const scale_fixed* other = dynamic_cast<const scale_fixed*>(t);
@@ -383,3 +601,217 @@ bool scale_fixed::operator==(const itransformation_base* t) const
   }
   return false;
 }
+
+////////////////////////////////////////////////////////////////////////////////
+
+void scale_fixed::write(std::ostream& os) const
+{
+  itransformation_base::write(os);
+  write_values(os, _scales);
+}
+
+////////////////////////////////////////////////////////////////////////////////
+
+bool scale_fixed::read(std::istream& is)
+{
+  return (itransformation_base::read(is) && 
+	  read_values(is, _scales) && 
+	  _scales.size() == get_in_dim());
+}
+
+////////////////////////////////////////////////////////////////////////////////
+
+////////////////////////////////////////////////////////////////////////////////
+
+affine::affine(unsigned in_dim, unsigned out_dim, const vector<double>& A, const vector<double>& b) :
+  itransformation_base(in_dim, out_dim),
+  _matrix(A),
+  _offset(b),
+  _diagonal(false)
+{
+  _configured = (_matrix.size() == (size_t)in_dim * out_dim && _offset.size() == out_dim);
+  set_diagonal();
+}
+
+////////////////////////////////////////////////////////////////////////////////
+
+affine::affine(const vector<const itransformation_base*>& chain) :
+  itransformation_base(),
+  _matrix(),
+  _offset(),
+  _diagonal(false)
+{
+  if(chain.empty())
+  {
+    return;
+  }
+  
+  //
+  // start from the identity & compose each map in turn: A' = A_t A, b' = A_t b + b_t
+  //
+  unsigned nin = chain.front()->get_in_dim();
+  unsigned n = nin;
+  _matrix.assign(n * n, 0.);
+  _offset.assign(n, 0.);
+  for(unsigned idim=0; idim<n; ++idim)
+  {
+    _matrix[idim * n + idim] = 1.;
+  }
+  
+  vector<double> A;
+  vector<double> b;
+  for(unsigned it=0; it<chain.size(); ++it)
+  {
+    unsigned nout = chain[it]->get_out_dim();
+    if(chain[it]->get_in_dim() != n || !chain[it]->get_affine(A, b) || 
+       A.size() != (size_t)nout * n || b.size() != nout)
+    {
+      logger::log() << msg::ERROR << "cannot compose transformation [" << chain[it]->get_name() << "] as an affine map";
+      return;
+    }
+    vector<double> matrix(nout * nin, 0.);
+    vector<double> offset(b);
+    for(unsigned i=0; i<nout; ++i)
+    {
+      for(unsigned k=0; k<n; ++k)
+      {
+	double a = A[i * n + k];
+	if(a == 0.)
+	{
+	  continue;
+	}
+	for(unsigned j=0; j<nin; ++j)
+	{
+	  matrix[i * nin + j] += a * _matrix[k * nin + j];
+	}
+	offset[i] += a * _offset[k];
+      }
+    }
+    _matrix.swap(matrix);
+    _offset.swap(offset);
+    n = nout;
+  }
+  
+  set_in_dim(nin);
+  set_out_dim(n);
+  _configured = true;
+  set_diagonal();
+}
+
+////////////////////////////////////////////////////////////////////////////////
+
+void affine::set_diagonal()
+{
+  _diagonal = (_configured && get_in_dim() == get_out_dim());
+  for(unsigned i=0; i<get_out_dim() && _diagonal; ++i)
+  {
+    for(unsigned j=0; j<get_in_dim(); ++j)
+    {
+      if(i != j && _matrix[i * get_in_dim() + j] != 0.)
+      {
+	_diagonal = false;
+	break;
+      }
+    }
+  }
+}
+
+////////////////////////////////////////////////////////////////////////////////
+
+real_t* affine::operator()(const real_t* x) const
+{
+  if(!_configured) 
+  {
+    return NULL;
+  }
+  real_t* xp = new real_t[get_out_dim()];
+  (*this)(x, xp);
+  return xp;
+}
+
+////////////////////////////////////////////////////////////////////////////////
+
+void affine::operator()(const real_t* x, real_t* xp) const
+{
+  if(!_configured)
+  {
+    return;
+  }
+  unsigned nin = get_in_dim();
+  if(_diagonal)
+  {
+    for(unsigned i=0; i<nin; ++i)
+    {
+      xp[i] = _matrix[i * nin + i] * x[i] + _offset[i];
+    }
+    return;
+  }
+  for(unsigned i=0; i<get_out_dim(); ++i)
+  {
+    const double* a = &(_matrix[i * nin]);
+    double sum = _offset[i];
+    for(unsigned j=0; j<nin; ++j)
+    {
+      sum += a[j] * x[j];
+    }
+    xp[i] = sum;
+  }
+}
+
+////////////////////////////////////////////////////////////////////////////////
+
+bool affine::configure(const igrid_base* g, bool force)
+{
+  return (_configured && g->get_ndim() == (integer_t)get_in_dim());
+}
+
+////////////////////////////////////////////////////////////////////////////////
+
+bool affine::operator==(const itransformation_base* t) const
+{
+  const affine* other = dynamic_cast<const affine*>(t);
+  if(other != NULL)
+  {
+    return (other->get_matrix() == _matrix &&
+	    other->get_offset() == _offset);
+  }
+  return false;
+}
+
+////////////////////////////////////////////////////////////////////////////////
+
+bool affine::get_affine(vector<double>& A, vector<double>& b) const
+{
+  if(!_configured)
+  {
+    return false;
+  }
+  A = _matrix;
+  b = _offset;
+  return true;
+}
+
+////////////////////////////////////////////////////////////////////////////////
+
+void affine::write(std::ostream& os) const
+{
+  itransformation_base::write(os);
+  write_values(os, _matrix);
+  write_values(os, _offset);
+}
+
+////////////////////////////////////////////////////////////////////////////////
+
+bool affine::read(std::istream& is)
+{
+  if(!(itransformation_base::read(is) && 
+       read_values(is, _matrix) && 
+       read_values(is, _offset) &&
+       _matrix.size() == (size_t)get_in_dim() * get_out_dim() &&
+       _offset.size() == get_out_dim()))
+  {
+    return false;
+  }
+  set_diagonal();
+  return true;
+}